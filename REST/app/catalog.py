@@ -0,0 +1,157 @@
+import os
+import fcntl
+import bisect
+import threading
+from contextlib import contextmanager
+
+from app.serialization import dumps
+from app.serialization import loads
+
+class Catalog:
+    """
+    Manifest of the video libraries of a database folder, with the owner,
+    number of videos, version and modification time of each of them.
+
+    The manifest is an append-only file of JSON lines, each line the entry of
+    a library or its deletion, the last line of a library winning. The store
+    appends a line whenever it creates, changes or deletes a library, while
+    holding the lock of that library, so the lines of a library follow the
+    order of its changes. Each worker keeps the manifest in memory and replays
+    the lines appended by the others from its last offset, so listing the
+    libraries costs a stat of the manifest instead of a stat of every file.
+
+    Once the file holds many more lines than libraries, it is rewritten with
+    one line per library. The appends share a flock on the lock file of the
+    manifest and the rewrite holds it exclusively, so that no line is
+    appended to a replaced file.
+
+    The manifest is derived from the libraries and is not synced to disk: a
+    line lost in a crash leaves the entry of a library stale until its next
+    change, and a missing manifest is rebuilt by the store.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._names = None
+        self._inode = None
+        self._offset = 0
+        self._lines = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def _flock(self, operation):
+        with open(self.path+".lock", "a") as file:
+            # closing the file releases the flock
+            fcntl.flock(file, operation)
+            yield
+
+    def refresh(self):
+        """
+        Replay the lines appended to the manifest since the last refresh, or
+        read it again if it was replaced.
+
+        :return: whether the manifest was read from its start
+        """
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            st = None
+        inode = None if st is None else st.st_ino
+        reset = inode != self._inode
+        if reset:
+            self._entries, self._names = {}, None
+            self._inode, self._offset, self._lines = inode, 0, 0
+        if st is None or st.st_size <= self._offset:
+            return reset
+        with open(self.path, "rb") as file:
+            file.seek(self._offset)
+            data = file.read()
+        # a trailing line without its newline is still being written
+        end = data.rfind(b"\n")+1
+        self._offset += end
+        for line in data[:end].splitlines():
+            try:
+                entry = loads(line)
+            except ValueError:
+                # the torn line of an append cut short by a crash
+                continue
+            self._lines += 1
+            self._set(entry)
+        return reset
+
+    def _set(self, entry):
+        if entry.get("deleted"):
+            if self._entries.pop(entry['name'], None) is not None:
+                self._names = None
+        else:
+            if entry['name'] not in self._entries:
+                self._names = None
+            self._entries[entry['name']] = entry
+
+    def get(self, name):
+        """Return the entry of a library, or None."""
+        with self._lock:
+            return self._entries.get(name)
+
+    def names(self):
+        """Return the sorted names of the libraries."""
+        with self._lock:
+            return list(self._sorted())
+
+    def _sorted(self):
+        if self._names is None:
+            self._names = sorted(self._entries)
+        return self._names
+
+    def put(self, name, owner, videos, version, modified):
+        """Record the current state of a library."""
+        self._append({"name": name, "owner": owner, "videos": videos, "version": version, "modified": modified})
+
+    def drop(self, name):
+        """Record the deletion of a library."""
+        self._append({"name": name, "deleted": True})
+
+    def _append(self, entry):
+        line = dumps(entry)+b"\n"
+        with self._flock(fcntl.LOCK_SH):
+            with open(self.path, "ab") as file:
+                file.write(line)
+        with self._lock:
+            # read back along with the lines appended by the others
+            self._refresh()
+            compact = self._lines > 2*len(self._entries)+1024
+        if compact:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the manifest with one line per library."""
+        with self._flock(fcntl.LOCK_EX), self._lock:
+            self._refresh()
+            temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as file:
+                file.write(b"".join(dumps(self._entries[name])+b"\n" for name in self._sorted()))
+            os.replace(temporary, self.path)
+            st = os.stat(self.path)
+            self._inode, self._offset, self._lines = st.st_ino, st.st_size, len(self._entries)
+
+    def entries(self, prefix="", cursor=None, limit=None):
+        """
+        List the entries of the libraries in the order of their names.
+
+        :param prefix: the prefix of the names of the listed libraries
+        :param cursor: the name from which to list them, returned by the previous page
+        :param limit: the maximum number of entries, None for all of them
+        :return: the entries of the page and the cursor of the next page, or None
+        """
+        with self._lock:
+            names = self._sorted()
+            start = bisect.bisect_left(names, max(prefix, cursor or ""))
+            end = bisect.bisect_left(names, prefix+"\U0010ffff")
+            if limit is not None and start+limit < end:
+                return [self._entries[name] for name in names[start:start+limit]], names[start+limit]
+            return [self._entries[name] for name in names[start:end]], None
@@ -0,0 +1,120 @@
+import bisect
+import threading
+
+from app.serialization import loads
+
+def versions(record):
+    """Return the first and last versions of a change record of a log, or of a batch of them."""
+    if record['op'] == "batch":
+        return record['records'][0]['version'], record['version']
+    return record['version'], record['version']
+
+def retained(lines, version, history, max_bytes):
+    """
+    Select the lines of a log kept once its changes up to a version are folded
+    into the snapshot: all the following lines, and the lines of the most
+    recent changes before, for the change feed.
+
+    :param lines: the (first version, last version, line) of the lines of the log, in order
+    :param history: the number of changes up to the version to keep
+    :param max_bytes: the maximum size of the lines kept before the version
+    :return: the kept lines, in the same form
+    """
+    older, size = [], 0
+    for entry in reversed([entry for entry in lines if entry[1] <= version]):
+        size += len(entry[2])
+        if version-entry[0] >= history or size > max_bytes:
+            break
+        older.append(entry)
+    return older[::-1]+[entry for entry in lines if entry[1] > version]
+
+def net_changes(records):
+    """
+    Sum up a sequence of change records into the difference between the
+    video library before them and after them.
+
+    A video is identified by its title before the changes, so a renamed video
+    is an updated one, and a video added then removed does not show up.
+
+    :return: the added videos in insertion order, the updated videos with
+        their title before the changes, and the titles of the deleted videos
+    """
+    # the last state of each video by its identity, a title before the changes or an added video
+    states = {}
+    identities = {}
+    for record in records:
+        if record['op'] == "add":
+            identity = ("added", record['version'])
+            states[identity] = record['video']
+            identities[record['video']['title']] = identity
+        elif record['op'] == "replace":
+            identity = identities.pop(record['title'], ("existing", record['title']))
+            states[identity] = record['video']
+            identities[record['video']['title']] = identity
+        elif record['op'] == "remove":
+            states[identities.pop(record['title'], ("existing", record['title']))] = None
+    return {
+        "added": [video for (kind, _), video in states.items() if kind == "added" and video is not None],
+        "updated": [
+            {"title": title, "video": video} for (kind, title), video in states.items()
+            if kind == "existing" and video is not None],
+        "deleted": [title for (kind, title), video in states.items() if kind == "existing" and video is None],
+        }
+
+class ChangeFeed:
+    """
+    Recent changes of a video library, kept as the lines of its log.
+
+    The feed follows the lines of the log read or written by the worker, the
+    ones already folded into the snapshot included, with their versions, so
+    the changes since a version are found by a binary search and only the
+    lines following it are decoded. A line that does not follow the previous
+    one restarts the feed.
+    """
+
+    def __init__(self):
+        self._firsts = []
+        self._lasts = []
+        self._lines = []
+        self._lock = threading.Lock()
+
+    def append(self, first, last, line):
+        """Add the line of the log holding the changes of the versions first to last."""
+        with self._lock:
+            if self._lasts and first != self._lasts[-1]+1:
+                self._firsts, self._lasts, self._lines = [], [], []
+            self._firsts.append(first)
+            self._lasts.append(last)
+            self._lines.append(line)
+
+    def since(self, version, current):
+        """
+        Return the changes after a version.
+
+        :param current: the version of the video library
+        :return: the change records after the version up to the current one,
+            in order, or None if the feed does not reach back to the version
+        """
+        if version == current:
+            return []
+        with self._lock:
+            if version > current or not self._firsts or self._firsts[0] > version+1:
+                return None
+            lines = self._lines[bisect.bisect_right(self._lasts, version):]
+        records = []
+        for line in lines:
+            record = loads(line)
+            for change in record['records'] if record['op'] == "batch" else (record,):
+                if version < change['version'] <= current:
+                    records.append(change)
+        if not records or records[-1]['version'] != current:
+            return None
+        return records
+
+    def trim(self, version, history, max_bytes):
+        """Keep the same lines as the log compacted up to a version, see retained."""
+        with self._lock:
+            kept = retained(list(zip(self._firsts, self._lasts, self._lines)), version, history, max_bytes)
+            self._firsts = [first for first, _, _ in kept]
+            self._lasts = [last for _, last, _ in kept]
+            self._lines = [line for _, _, line in kept]
@@ -0,0 +1,158 @@
+import os
+import zlib
+import struct
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+# compression levels, the defaults of zlib and zstd
+LEVELS = {"gzip": 6, "zstd": 3}
+# the skippable frame closing a zstd snapshot with the size of its content, like the trailer of a gzip file
+_SIZE_FRAME = struct.Struct("<IIQ")
+_SIZE_FRAME_MAGIC = 0x184D2A50
+# the magic numbers of all the skippable zstd frames, ignoring their last 4 bits
+_SKIPPABLE_MASK = 0xFFFFFFF0
+
+def encodings():
+    """Return the available compressions, by their HTTP content coding, the preferred one first."""
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+def compressor(encoding):
+    """
+    Create a streaming compressor.
+
+    :param encoding: the compression, gzip or zstd
+    :return: an object with the compress and flush methods of zlib
+    :raise ValueError: if the compression is unknown, or zstd without the zstandard package
+    """
+    if encoding == "gzip":
+        # the gzip wrapper rather than the zlib one
+        return zlib.compressobj(LEVELS["gzip"], zlib.DEFLATED, 16+zlib.MAX_WBITS)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=LEVELS["zstd"]).compressobj()
+    raise ValueError(f"The compression {encoding} is unknown or unavailable.")
+
+def compress(chunks, encoding):
+    """Compress chunks of bytes as they come, yielding non-empty chunks."""
+    stream = compressor(encoding)
+    for chunk in chunks:
+        data = stream.compress(chunk)
+        if data:
+            yield data
+    yield stream.flush()
+
+def compress_snapshot(chunks, encoding):
+    """
+    Compress the chunks of a snapshot, see compress, so that the size of its
+    content can be found from the end of the file, see content_size.
+    """
+    size = 0
+
+    def counted():
+        nonlocal size
+        for chunk in chunks:
+            size += len(chunk)
+            yield chunk
+    yield from compress(counted(), encoding)
+    if encoding == "zstd":
+        yield _SIZE_FRAME.pack(_SIZE_FRAME_MAGIC, 8, size)
+
+def content_size(fd, size):
+    """
+    Find the size of the content of a file, compressed or not.
+
+    The size is read from the trailer of a gzip file, which keeps it modulo
+    4 GiB, and from the frame closing a zstd snapshot, or from the header of
+    a zstd file compressed at once. It is unknown for the other zstd files,
+    taken as the size of the file.
+
+    :param size: the size of the file
+    """
+    head = os.pread(fd, 18, 0)
+    if head.startswith(GZIP_MAGIC) and size >= 18:
+        return struct.unpack("<I", os.pread(fd, 4, size-4))[0]
+    if head.startswith(ZSTD_MAGIC):
+        if size >= _SIZE_FRAME.size:
+            magic, length, content = _SIZE_FRAME.unpack(os.pread(fd, _SIZE_FRAME.size, size-_SIZE_FRAME.size))
+            if magic == _SIZE_FRAME_MAGIC and length == 8:
+                return content
+        if zstandard is not None:
+            try:
+                content = zstandard.frame_content_size(head)
+            except zstandard.ZstdError:
+                content = -1
+            if content >= 0:
+                return content
+    return size
+
+def decompressing(read):
+    """
+    Wrap a function reading the chunks of a file from its start into one
+    reading the chunks of its content, the compression being recognized by
+    its magic number. A file that is not compressed is read as it is.
+
+    :raise OSError: if the compressed content is truncated or corrupted, or
+        compressed with zstd without the zstandard package
+    """
+    first = read()
+    # enough of the file to recognize its magic number
+    while first and len(first) < len(ZSTD_MAGIC):
+        chunk = read()
+        if not chunk:
+            break
+        first += chunk
+    if first.startswith(GZIP_MAGIC):
+        chunks = _frames(read, first, lambda: zlib.decompressobj(16+zlib.MAX_WBITS))
+    elif first.startswith(ZSTD_MAGIC):
+        if zstandard is None:
+            raise OSError("The snapshot is compressed with zstd, which needs the zstandard package.")
+        chunks = _frames(read, first, lambda: zstandard.ZstdDecompressor().decompressobj())
+    else:
+        pending = [first]
+        return lambda: pending.pop() if pending else read()
+    return lambda: next(chunks, b"")
+
+def _frames(read, data, decompressor):
+    """
+    Decode the frames of a zstd file or the members of a gzip file one after
+    the other, skipping the skippable zstd frames.
+    """
+    errors = (zlib.error,) if zstandard is None else (zlib.error, zstandard.ZstdError)
+    while True:
+        # enough of the next frame to recognize a skippable one
+        while len(data) < 8:
+            chunk = read()
+            if not chunk:
+                break
+            data += chunk
+        if not data:
+            return
+        magic, length = struct.unpack_from("<II", data) if len(data) >= 8 else (0, 0)
+        if magic & _SKIPPABLE_MASK == _SIZE_FRAME_MAGIC:
+            skip = 8+length
+            while len(data) < skip:
+                chunk = read()
+                if not chunk:
+                    raise OSError("The compressed snapshot is truncated.")
+                skip -= len(data)
+                data = chunk
+            data = data[skip:]
+            continue
+        stream = decompressor()
+        try:
+            while not stream.eof:
+                if not data:
+                    data = read()
+                    if not data:
+                        raise OSError("The compressed snapshot is truncated.")
+                content = stream.decompress(data)
+                data = b""
+                if content:
+                    yield content
+        except errors as e:
+            raise OSError(f"The compressed snapshot is corrupted: {e}") from e
+        data = stream.unused_data
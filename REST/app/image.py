@@ -0,0 +1,191 @@
+import mmap
+import bisect
+import struct
+from array import array
+
+from app.serialization import dumps
+from app.serialization import loads
+from app.stats import VideoStats
+from app.stream import iter_library
+
+# the offset of the header, at the end of the image
+_TRAILER = struct.Struct("<Q")
+# the characters separating the lowercased texts
+SEPARATORS = "\t\n"
+# the layout of the images, those of another layout are written again
+FORMAT = 3
+
+def write_image(path, read, signature):
+    """
+    Write the image of the snapshot of a video library, decoding the snapshot
+    one video at a time.
+
+    The image holds each video serialized, with the tables reaching a video
+    by its position in the image or its title, the positions given to the
+    videos by the library, the lowercased texts of the searches and the
+    aggregates of the videos, followed by a JSON header locating them and by
+    the offset of the header.
+
+    :param read: the function returning the next chunk of the snapshot, see iter_library
+    :param signature: the stamp of the snapshot, kept in the header
+    :raise json.decoder.JSONDecodeError: if the snapshot is malformed
+    """
+    fields = {}
+    offsets = array("Q", [0])
+    titles, title_offsets = bytearray(), array("Q", [0])
+    lowered_titles, lowered_title_offsets = bytearray(), array("Q", [0])
+    lowered_actors, lowered_actor_offsets = bytearray(), array("Q", [0])
+    stats = VideoStats()
+    with open(path, "wb") as file:
+        for event in iter_library(read):
+            if event[0] == "field":
+                fields[event[1]] = event[2]
+                continue
+            video = event[1]
+            data = dumps(video)
+            file.write(data)
+            offsets.append(offsets[-1]+len(data))
+            titles += video['title'].encode("utf-8", "surrogatepass")
+            title_offsets.append(len(titles))
+            # the separators keep a search from matching across two texts
+            lowered_titles += video['title'].lower().encode("utf-8", "surrogatepass")+b"\n"
+            lowered_title_offsets.append(len(lowered_titles))
+            lowered_actors += b"\t".join(
+                info.lower().encode("utf-8", "surrogatepass")
+                for actor in video['actors'] for info in (actor["name"], actor["surname"]))+b"\n"
+            lowered_actor_offsets.append(len(lowered_actors))
+            stats.add(video)
+        count = len(offsets)-1
+        # the positions given by the library, stored by the snapshot as runs, or numbering the videos in order
+        runs = fields.pop("positions", None)
+        library_positions = array("Q", range(count) if runs is None else expand_runs(runs))
+        fields.setdefault("next_position", count)
+        # positions sorted by title, a duplicated title resolving to its first video
+        order = array("Q", sorted(range(count), key=lambda i: titles[title_offsets[i]:title_offsets[i+1]]))
+
+        sections = {"videos": [0, offsets[-1]]}
+        for name, data in (
+                ("offsets", offsets), ("library_positions", library_positions),
+                ("titles", titles), ("title_offsets", title_offsets), ("order", order),
+                ("lowered_titles", lowered_titles), ("lowered_title_offsets", lowered_title_offsets),
+                ("lowered_actors", lowered_actors), ("lowered_actor_offsets", lowered_actor_offsets),
+                ("stats", dumps(stats.to_dict()))):
+            # the tables are aligned on their items
+            file.write(b"\0"*(-file.tell() % 8))
+            sections[name] = [file.tell(), memoryview(data).nbytes]
+            file.write(data)
+        start = file.tell()
+        file.write(dumps({"format": FORMAT, "signature": list(signature), "fields": fields, "count": count, "sections": sections}))
+        file.write(_TRAILER.pack(start))
+
+class LibraryImage:
+    """
+    Image of the snapshot of a video library, mapped in memory.
+
+    The pages of the image are shared by all the processes mapping it, so a
+    video library is held once by the host instead of once by each worker.
+    A video is only decoded when it is read, and found by its title with a
+    binary search of the title table; the searches run over the lowercased
+    texts of all the videos at once. The aggregates of the videos are read
+    from the image as well, instead of being counted again by each worker.
+    """
+
+    def __init__(self, path):
+        """
+        :raise ValueError: if the file is not an image of the current layout
+        """
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        (start,) = _TRAILER.unpack_from(self._map, len(self._map)-_TRAILER.size)
+        header = loads(self._map[start:len(self._map)-_TRAILER.size])
+        if header.get('format') != FORMAT:
+            raise ValueError(f"image of format {header.get('format')}, expected {FORMAT}")
+        self.signature = tuple(header['signature'])
+        self.fields = header['fields']
+        self.count = header['count']
+        self._sections = header['sections']
+        self._offsets = self._table("offsets")
+        # the position given by the library to the video at each position of the image, increasing
+        self.library_positions = self._table("library_positions")
+        self._title_offsets = self._table("title_offsets")
+        self._order = self._table("order")
+
+    def _table(self, name):
+        start, size = self._sections[name]
+        return memoryview(self._map)[start:start+size].cast("Q")
+
+    def _text(self, name, offsets, position):
+        start = self._sections[name][0]
+        return self._map[start+offsets[position]:start+offsets[position+1]]
+
+    def video(self, position):
+        """Decode the video at a position."""
+        return loads(self._text("videos", self._offsets, position))
+
+    def stats(self):
+        """Return the aggregates of the videos of the image, see VideoStats."""
+        start, size = self._sections["stats"]
+        return VideoStats.from_dict(loads(self._map[start:start+size]))
+
+    def find(self, title):
+        """Return the position of the video with the given title, or None."""
+        positions = self.find_all(title)
+        return positions[0] if positions else None
+
+    def find_all(self, title):
+        """Return the positions of the videos with the given title, in library order."""
+        key = title.encode("utf-8", "surrogatepass")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low+high)//2
+            if self._text("titles", self._title_offsets, self._order[middle]) < key:
+                low = middle+1
+            else:
+                high = middle
+        positions = []
+        while low < self.count and self._text("titles", self._title_offsets, self._order[low]) == key:
+            positions.append(self._order[low])
+            low += 1
+        return positions
+
+    def search_titles(self, name):
+        """Return the positions of the videos whose title contains the name, without case sensitivity, see _search."""
+        return self._search("lowered_titles", "lowered_title_offsets", name)
+
+    def search_actors(self, name):
+        """Return the positions of the videos with an actor whose name or surname contains the name, see _search."""
+        return self._search("lowered_actors", "lowered_actor_offsets", name)
+
+    def _search(self, name, offsets_name, query):
+        """
+        Find the videos of a search in lowercased texts, in library order.
+
+        The empty name, or a name holding a separator, matches every text or
+        across two texts: its results are only candidates, to be verified.
+        """
+        needle = query.lower().encode("utf-8", "surrogatepass")
+        offsets = self._table(offsets_name)
+        start, size = self._sections[name]
+        positions = []
+        found = self._map.find(needle, start, start+size)
+        while found != -1 and len(positions) < self.count:
+            position = bisect.bisect_right(offsets, found-start)-1
+            positions.append(position)
+            # the next candidate is in a following video
+            found = self._map.find(needle, start+offsets[position+1], start+size)
+        return positions
+
+def position_runs(positions):
+    """Store increasing positions as the [first, count] runs of consecutive positions, see expand_runs."""
+    runs = []
+    for position in positions:
+        if runs and runs[-1][0]+runs[-1][1] == position:
+            runs[-1][1] += 1
+        else:
+            runs.append([position, 1])
+    return runs
+
+def expand_runs(runs):
+    """Iterate over the positions stored as runs by position_runs."""
+    for first, count in runs:
+        yield from range(first, first+count)
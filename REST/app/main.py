@@ -1,19 +1,127 @@
 from flask import Flask
+from flask import Response
+from flask import g
 from flask import request
 from werkzeug.exceptions import abort
+from werkzeug.http import is_resource_modified
 
 import os
+import re
 import json
+import time
+import heapq
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from datetime import datetime
+from datetime import timezone
+
+from app.changes import net_changes
+from app.compression import compress
+from app.compression import encodings
+from app.metrics import REGISTRY
+from app.serialization import BodyCache
+from app.serialization import dumps
+from app.serialization import loads
+from app.store import LibraryNotFound
+from app.store import LibraryStore
+from app.sqlite_store import SQLiteLibraryStore
 
 app = Flask(__name__)
 app.config.from_mapping(
     # a default secret that should be overridden by instance config
     SECRET_KEY = "dev",
+    # storage backend of the video libraries, json (files of the database folder) or sqlite
+    STORAGE = "json",
     # path of the database folder
-    DATABASE = "app/database"
+    DATABASE = "app/database",
+    # path of the SQLite database, when STORAGE is sqlite
+    SQLITE_DATABASE = "app/library.sqlite",
+    # memory budget of the parsed video libraries kept by each worker, in bytes of JSON
+    LIBRARY_CACHE_SIZE = 256 * 1024 * 1024,
+    # size of the files of a video library above which it is read one video at a time, in bytes
+    LIBRARY_STREAM_SIZE = 64 * 1024 * 1024,
+    # folder of the images of the video libraries shared by the workers of the host, in memory like
+    # the worker_tmp_dir of gunicorn, None to decode the video libraries in each worker
+    LIBRARY_SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None,
+    # size of the change log of a video library above which it is folded into its snapshot, in bytes
+    LOG_COMPACT_SIZE = 1024 * 1024,
+    # compression of the snapshots written by the json storage, None, "gzip" or "zstd" (with the zstandard
+    # package); the snapshots are read whatever their compression
+    LIBRARY_COMPRESSION = None,
+    # size of the chunks of the streamed responses, in bytes
+    STREAM_CHUNK_SIZE = 64 * 1024,
+    # memory budget of the serialized response bodies kept by each worker, in bytes
+    RESPONSE_CACHE_SIZE = 64 * 1024 * 1024,
+    # compressions of the cached response bodies offered to the clients through Accept-Encoding, preferred first
+    RESPONSE_ENCODINGS = encodings(),
+    # number of video libraries searched at the same time by a cross-library search
+    SEARCH_WORKERS = 4,
+    # default and maximum number of results of a cross-library search
+    SEARCH_LIMIT = 100,
+    SEARCH_MAX_LIMIT = 1000,
+    # default and maximum number of directors and actors listed by the statistics of a library
+    STATS_TOP = 10,
+    STATS_MAX_TOP = 100,
+    # number of most recent changes of each video library kept for the change feed
+    CHANGES_HISTORY = 1000,
+    # maximum time a request to the change feed waits for a change, in seconds, holding a thread of the worker meanwhile
+    CHANGES_MAX_WAIT = 30,
+    # interval between two checks of a video library by a waiting request to the change feed, in seconds
+    CHANGES_POLL_INTERVAL = 0.25
 )
 
+# fields of a video that can be selected with the fields argument
+VIDEO_FIELDS = ("title", "year", "director", "actors")
+
+def get_store():
+    """
+    Retrieve the library store of the application, created on first use.
+
+    :return: the library store of the configured storage backend
+    """
+    if "library_store" not in app.extensions:
+        if app.config["STORAGE"] == "sqlite":
+            app.extensions["library_store"] = SQLiteLibraryStore(app.config["SQLITE_DATABASE"], app.config["CHANGES_HISTORY"])
+        else:
+            app.extensions["library_store"] = LibraryStore(
+                app.config["DATABASE"], app.config["LIBRARY_CACHE_SIZE"], app.config["LOG_COMPACT_SIZE"],
+                app.config["LIBRARY_STREAM_SIZE"], app.config["LIBRARY_SHARED_DIR"], app.config["CHANGES_HISTORY"],
+                app.config["LIBRARY_COMPRESSION"])
+    return app.extensions["library_store"]
+
+def get_executor():
+    """
+    Retrieve the thread pool of the cross-library searches, created on first use.
+
+    :return: the thread pool shared by the requests of the worker
+    """
+    if "search_executor" not in app.extensions:
+        app.extensions["search_executor"] = ThreadPoolExecutor(max_workers=app.config["SEARCH_WORKERS"])
+    return app.extensions["search_executor"]
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time spent handling the requests until their response starts.",
+    ("route", "method", "status"))
+BODY_CACHE_LOOKUPS = REGISTRY.counter(
+    "response_body_cache_lookups_total", "Lookups of serialized response bodies, by hit or miss.", ("result",))
+REGISTRY.gauge(
+    "response_body_cache_bytes", "Size of the serialized response bodies kept in memory.",
+    function=lambda: get_body_cache().size)
+REGISTRY.gauge(
+    "library_videos", "Number of videos of the video libraries, only the ones kept in memory with the json storage.",
+    ("library",), function=lambda: {(library,): size for library, size in get_store().sizes().items()})
+
+def get_body_cache():
+    """
+    Retrieve the cache of the serialized response bodies, created on first use.
+
+    :return: the body cache shared by the requests of the worker
+    """
+    if "body_cache" not in app.extensions:
+        app.extensions["body_cache"] = BodyCache(app.config["RESPONSE_CACHE_SIZE"])
+    return app.extensions["body_cache"]
+
 def check_video_payload(payload):
     """
     Check the format of the video payload.
@@ -36,19 +144,319 @@ def check_video_payload(payload):
             error = "Actor's surname is required."
     return error
 
+def check_batch_video(payload):
+    """
+    Check the format of a video of a batch, which may not even be an object.
+
+    :return: the state of the error variable
+    """
+    if not isinstance(payload, dict):
+        return "The video is malformed."
+    try:
+        return check_video_payload(payload)
+    except (KeyError, TypeError):
+        return "The video is malformed."
+
+def read_batch():
+    """
+    Extract the items of a batch from the request, sent either as a JSON
+    array or as NDJSON with one item per line.
+
+    :return: the list of items, an unreadable NDJSON line being kept as None
+    :raise 400: if the request is malformed
+    """
+    if request.mimetype == "application/x-ndjson":
+        items = []
+        # read line by line rather than buffering the whole upload
+        for line in request.stream:
+            if line.strip():
+                try:
+                    items.append(loads(line))
+                except json.decoder.JSONDecodeError:
+                    items.append(None)
+        return items
+    try:
+        items = loads(request.get_data())
+    except json.decoder.JSONDecodeError as e:
+        abort(400, e)
+    if not isinstance(items, list):
+        abort(400, "The batch must be a list.")
+    return items
+
+def parse_page_args():
+    """
+    Extract the pagination and projection arguments of the request.
+
+    :return: the cursor, the limit (or None) and the list of fields (or None)
+    :raise 400: if an argument is malformed
+    """
+    try:
+        cursor = int(request.args.get("cursor", 0))
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+    except ValueError:
+        abort(400, "The cursor and the limit must be integers.")
+    if cursor < 0 or (limit is not None and limit <= 0):
+        abort(400, "The cursor must be positive and the limit strictly positive.")
+    fields = None
+    if "fields" in request.args:
+        fields = request.args["fields"].split(",")
+        if not all(field in VIDEO_FIELDS for field in fields):
+            abort(400, f"The fields must be among {', '.join(VIDEO_FIELDS)}.")
+    return cursor, limit, fields
+
+def parse_catalog_args():
+    """
+    Extract the filtering and pagination arguments of a listing of the video libraries.
+
+    :return: the prefix of the names, the cursor (or None) and the limit (or None)
+    :raise 400: if an argument is malformed
+    """
+    try:
+        limit = int(request.args["limit"]) if "limit" in request.args else None
+    except ValueError:
+        abort(400, "The limit must be an integer.")
+    if limit is not None and limit <= 0:
+        abort(400, "The limit must be strictly positive.")
+    return request.args.get("prefix", ""), request.args.get("cursor"), limit
+
+def parse_since():
+    """
+    Extract the version from which to list the changes of a video library,
+    given as a version or as an entity tag of the library.
+
+    :return: the version, and the creation time of the library in hexadecimal
+        when given an entity tag, else None
+    :raise 400: if the version is missing or malformed
+    """
+    since = re.fullmatch(r"(?:([0-9a-f]+)-)?([0-9]+)", resource_etag(request.args.get("since", "").strip('"')))
+    if since is None:
+        abort(400, "The version must be a number of changes, or an entity tag of the library.")
+    return int(since[2]), since[1]
+
+def catalog_response(body, next_cursor, modified):
+    """Serve a page of the listing of the video libraries, the cursor of the next page in a header."""
+    response = validate(hashlib.md5(body).hexdigest(), max(modified, get_store().libraries_modified()))
+    if response is None:
+        response = json_response(body)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
+def project(videos, fields):
+    """Keep only the selected fields of the videos, all of them if fields is None."""
+    if fields is None:
+        return videos
+    return ({field: video[field] for field in fields} for video in videos)
+
+def chunked(pieces):
+    """Group the small pieces of a streamed response into larger chunks."""
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= app.config["STREAM_CHUNK_SIZE"]:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    yield b"".join(buffer)
+
+def stream_library(content, videos):
+    """Serialize a video library piece by piece, in the same format as its file."""
+    yield b'{"owner":'+dumps(content.owner)+b',"last_modify":'+dumps(content.last_modify)+b',"videos":['
+    for i, video in enumerate(videos):
+        yield (b"," if i else b"")+dumps(video)
+    yield b"]}"
+
+def json_response(body, mimetype="application/json", encoding=None):
+    """
+    Wrap a serialized body, or an iterable of chunks, into a response.
+
+    :param encoding: the content coding of a compressed body, see negotiate_encoding
+    """
+    response = Response(body, mimetype=mimetype)
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+def negotiate_encoding():
+    """
+    Choose the compression of the response among the ones accepted by the
+    client, the preferred one of the service winning a tie.
+
+    :return: the content coding, None to send the body as it is
+    """
+    if "encoding" not in g:
+        g.encoding = request.accept_encodings.best_match(app.config["RESPONSE_ENCODINGS"])
+    return g.encoding
+
+def compressible(response):
+    """Mark a response whose body is compressed when the client accepts it."""
+    response.vary.add("Accept-Encoding")
+    return response
+
+def cached(etag, build):
+    """
+    Serve the body of the request from the body cache, building and caching it
+    first if it is missing for the current version of the resource.
+
+    The body is cached compressed with the content coding negotiated with the
+    client, so that it is compressed once per version of the resource.
+
+    :param etag: the entity tag of the resource
+    :param build: the function returning the serialized body
+    """
+    encoding = negotiate_encoding()
+    key = (request.full_path, encoding)
+    body = get_body_cache().get(key, etag)
+    BODY_CACHE_LOOKUPS.inc(labels=("miss" if body is None else "hit",))
+    if body is None:
+        body = build()
+        if encoding is not None:
+            body = b"".join(compress([body], encoding))
+        get_body_cache().put(key, etag, body)
+    return compressible(json_response(body, encoding=encoding))
+
+def cached_stream(etag, pieces, mimetype="application/json", current=None):
+    """
+    Serve a streamed body from the body cache, or stream it and cache it on
+    the way unless it outgrows the budget of the cache. Like with cached, the
+    body is compressed with the content coding negotiated with the client.
+
+    :param etag: the entity tag of the resource
+    :param pieces: the iterable of the serialized pieces of the body
+    :param current: the function telling whether the resource still has this
+        entity tag once the body is streamed, the body is not cached otherwise
+    """
+    encoding = negotiate_encoding()
+    key = (request.full_path, encoding)
+    body = get_body_cache().get(key, etag)
+    BODY_CACHE_LOOKUPS.inc(labels=("miss" if body is None else "hit",))
+    if body is not None:
+        return compressible(json_response(body, mimetype, encoding))
+
+    def stream():
+        kept, size = [], 0
+        chunks = chunked(pieces)
+        for chunk in chunks if encoding is None else compress(chunks, encoding):
+            if kept is not None:
+                kept.append(chunk)
+                size += len(chunk)
+                if size > get_body_cache().max_bytes:
+                    kept = None
+            yield chunk
+        if kept is not None and (current is None or current()):
+            get_body_cache().put(key, etag, b"".join(kept))
+    return compressible(json_response(stream(), mimetype, encoding))
+
+def representation_etag(etag, encoding):
+    """
+    Return the entity tag of a representation of a resource, the content
+    coding of a compressed body appended to the one of the resource, so that
+    a cache never takes a compressed body for another.
+    """
+    return etag if encoding is None else f"{etag}-{encoding}"
+
+def resource_etag(etag):
+    """Return the entity tag of the resource of a representation, see representation_etag."""
+    resource, _, encoding = etag.rpartition("-")
+    return resource if resource and encoding in app.config["RESPONSE_ENCODINGS"] else etag
+
+def frozen(content):
+    """
+    Take a copy of a video library to build the body of the request from,
+    unchanged by the writes made while the body is sent, unless the body is
+    already cached for its version.
+
+    :return: the library to read, and a 304 response if the copy of the
+        client is up to date with the copy, else None
+    """
+    if get_body_cache().get((request.full_path, negotiate_encoding()), content.etag) is not None:
+        return content, None
+    content = content.copy()
+    # the validators follow the copy, in case of a write since they were taken
+    return content, validate(content.etag, content.modified, compressed=True)
+
+def still_current(library, content):
+    """Return the function telling whether a video library is still at the version of its content, see cached_stream."""
+    def current():
+        try:
+            return get_store().load(library).etag == content.etag
+        except (LibraryNotFound, OSError, ValueError):
+            return False
+    return current
+
+def validate(etag, modified, compressed=False):
+    """
+    Check the conditional headers of the request against the validators of
+    the requested resource, which are added to the response.
+
+    :param etag: the entity tag of the resource
+    :param modified: the modification time of the resource, as a timestamp
+    :param compressed: whether the body is compressed when the client accepts
+        it, each content coding then having its own entity tag
+    :return: a 304 response if the copy of the client is up to date, else None
+    """
+    if compressed:
+        etag = representation_etag(etag, negotiate_encoding())
+    g.validators = (etag, datetime.fromtimestamp(modified, timezone.utc))
+    if not is_resource_modified(request.environ, etag=etag, last_modified=g.validators[1]):
+        response = Response(status=304)
+        return compressible(response) if compressed else response
+    return None
+
+def check_precondition(content):
+    """
+    Check the If-Match header of a write against the current version of the
+    video library, whatever the content coding of the representation read.
+
+    :raise 412: if the client modifies a version of the library that is not the current one
+    """
+    if request.if_match and not request.if_match.star_tag and content.etag not in {
+            resource_etag(etag) for etag in request.if_match.as_set()}:
+        abort(412, "The video library was modified since it was read.")
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Record the handling time of the request, by route, method and status."""
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        REQUEST_SECONDS.observe(time.perf_counter()-g.request_start, (route, request.method, response.status_code))
+    return response
+
+@app.after_request
+def add_validators(response):
+    """Add the validators of the requested resource to a successful or 304 response."""
+    if "validators" in g and response.status_code in (200, 304):
+        response.set_etag(g.validators[0])
+        response.last_modified = g.validators[1]
+    return response
+
+@app.route('/metrics')
+def metrics():
+    """
+    Metrics of the worker, in the Prometheus text format.
+
+    :return: the exposition of the metrics
+    """
+    return Response(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.route('/library')
 def library_list():
     """
-    List of video library files in the database.
+    List of video libraries in the database, in the order of their names.
 
-    :return: the list of available video libraries
+    :param prefix: prefix of the names of the video libraries to list
+    :param cursor: name from which to list them, returned in the X-Next-Cursor header of the previous page
+    :param limit: maximum number of video libraries to list
+    :return 200: the list of available video libraries
+    :return 304: if the copy of the client is up to date
+    :raise 400: if an argument is malformed
     """
-    res = []
-    for path in os.listdir(path=app.config["DATABASE"]):
-        # check if the current path exists and if it is a file
-        if os.path.isfile(os.path.join(app.config["DATABASE"], path)):
-            res.append(os.path.splitext(path)[0])
-    return(json.dumps(res))
+    entries, next_cursor = get_store().catalog(*parse_catalog_args())
+    return catalog_response(dumps([entry['name'] for entry in entries]), next_cursor, 0)
 
 @app.route('/library/<string:library>', methods=['GET', 'POST', 'DELETE'])
 def library_management(library):
@@ -56,7 +464,13 @@ def library_management(library):
     Create/retrieve/delete a video library.
 
     GET >
-    :return 200: the content of the requested video library
+    :param cursor: position from which to read the videos, returned as next_cursor by the previous page
+    :param limit: maximum number of videos to return
+    :param fields: comma separated list of the fields of the videos to return
+    :param format: ndjson to stream the videos one per line instead of the library document
+    :return 200: the content of the requested video library, with next_cursor when paginated
+    :return 304: if the copy of the client is up to date
+    :raise 400: if an argument is malformed
     :raise 404: if the video library was not found
     :raise 500: if an error occurs while reading the file
 
@@ -71,19 +485,44 @@ def library_management(library):
     :raise 404: if the video library was not found
     """
     if request.method == "GET":
-        target_library = os.path.join(app.config["DATABASE"], library)+".json"
-        # check if the current path exists and if it is a file
-        if os.path.isfile(target_library):
-            try:
-                with open(target_library, "r") as file:
-                    return json.dumps(json.load(file))
-            except (OSError, json.decoder.JSONDecodeError) as e:
-                abort(500, e)
-        else:
+        cursor, limit, fields = parse_page_args()
+        try:
+            content = get_store().load(library)
+        except LibraryNotFound:
             abort(404)
+        except (OSError, json.decoder.JSONDecodeError) as e:
+            abort(500, e)
+        response = validate(content.etag, content.modified, compressed=True)
+        if response is None:
+            content, response = frozen(content)
+        if response is not None:
+            return response
+
+        if limit is None and cursor == 0:
+            videos, next_cursor = content.videos(), None
+        else:
+            videos, next_cursor = content.page(cursor, len(content) if limit is None else limit)
+        videos = project(videos, fields)
+
+        if request.args.get("format") == "ndjson":
+            # one video per line, the cursor of the next page travels in a header
+            response = cached_stream(
+                content.etag, (dumps(video)+b"\n" for video in videos), "application/x-ndjson",
+                still_current(library, content))
+            if next_cursor is not None:
+                response.headers["X-Next-Cursor"] = str(next_cursor)
+            return response
+        if limit is None and cursor == 0 and fields is None:
+            # the whole library is streamed instead of being serialized at once
+            return cached_stream(content.etag, stream_library(content, videos), current=still_current(library, content))
+        return cached(content.etag, lambda: dumps({
+            "owner": content.owner,
+            "last_modify": content.last_modify,
+            "videos": list(videos),
+            "next_cursor": None if next_cursor is None else str(next_cursor)
+            }))
 
     elif request.method == "POST":
-        new_library = os.path.join(app.config["DATABASE"], library)+".json"
         error = None
 
         try:
@@ -108,9 +547,8 @@ def library_management(library):
                 "videos": []
                 }
             try:
-                with open(new_library, "x") as file:
-                    json.dump(content, file)
-                    return "Success", 201
+                get_store().create(library, content)
+                return "Success", 201
             except FileExistsError as e:
                 abort(409, e)
             except OSError as e:
@@ -119,11 +557,10 @@ def library_management(library):
             abort(400, error)
 
     elif request.method == "DELETE":
-        target_library = os.path.join(app.config["DATABASE"], library)+".json"
         try:
-            os.remove(target_library)
+            get_store().delete(library)
             return "Success", 204
-        except FileNotFoundError as e:
+        except LibraryNotFound as e:
             abort(404, e)
 
 @app.route('/library/<string:library>/video/<string:title>', methods=['GET', 'POST', 'PUT', 'DELETE'])
@@ -133,6 +570,7 @@ def video_management(library,title):
 
     GET >
     :return 200: the content of the requested video
+    :return 304: if the copy of the client is up to date
     :raise 404: if the video was not found
     :raise 500: if an error occurs while reading the file
 
@@ -140,36 +578,36 @@ def video_management(library,title):
     :return 201: Success, if the addition of the new video is successful
     :raise 400: if the request is malformed
     :raise 409: if the video already exists
+    :raise 412: if the video library does not match the If-Match header
     :raise 500: if an error occurs when editing the file
 
     PUT >
     :return 204: Success, if the video modification is successful
     :raise 400: if the request is malformed
     :raise 404: if the video library or the video was not found
+    :raise 409: if the video is renamed after another existing video
+    :raise 412: if the video library does not match the If-Match header
     :raise 500: if an error occurs when editing the file
 
     DELETE >
     :return 204: Success, if the deletion of the video is successful
     :raise 404: if the video library or the video was not found
+    :raise 412: if the video library does not match the If-Match header
     :raise 500: if an error occurs when editing the file
     """
     if request.method == "GET":
-        target_library = os.path.join(app.config["DATABASE"], library)+".json"
-        # check if the current path exists and if it is a file
-        if os.path.isfile(target_library):
-            try:
-                with open(target_library, "r") as file:
-                    content = json.load(file)
-                    for video in content['videos']:
-                        if video['title'] == title:
-                            return json.dumps(video)
-            except (OSError, json.decoder.JSONDecodeError) as e:
-                abort(500, e)
-        else:
+        try:
+            content = get_store().load(library)
+        except LibraryNotFound:
             abort(404)
+        except (OSError, json.decoder.JSONDecodeError) as e:
+            abort(500, e)
+        video = content.get(title)
+        if video is None: abort(404, "The video does not exist.")
+        response = validate(content.etag, content.modified)
+        return json_response(dumps(video)) if response is None else response
 
     elif request.method == "POST":
-        target_library = os.path.join(app.config["DATABASE"], library)+".json"
         try:
             # extract the payload from the POST data and check its contents
             payload = request.get_json()
@@ -178,30 +616,25 @@ def video_management(library,title):
         error = check_video_payload(payload)
 
         if error is None:
-            # check if the current path exists and if it is a file
-            if os.path.isfile(target_library):
-                try:
-                    with open(target_library, "r") as file:
-                        content = json.load(file)
-                        for video in content['videos']:
-                            # insert the new video if no other video has the same title
-                            if video['title'] == title:
-                                abort(409, "The video already exists.")
-                        content['videos'].append(payload)
-                    with open(target_library, "w") as file:
-                        # write the new contents of the video library into its file and update the variable last_modify
-                        content['last_modify'] = date.today().strftime("%d/%m/%Y")
-                        json.dump(content, file)
-                        return "Success", 201
-                except (OSError, json.decoder.JSONDecodeError) as e:
-                    abort(500, e)
-            else:
+            try:
+                # hold the library from the check to the write so that no other writer slips in between
+                with get_store().lock(library):
+                    content = get_store().load(library)
+                    check_precondition(content)
+                    # insert the new video if no other video has the same title
+                    if title in content or payload['title'] in content:
+                        abort(409, "The video already exists.")
+                    # append the new video to the log of the video library and update the variable last_modify
+                    get_store().write(library, {"op": "add", "video": payload, "last_modify": date.today().strftime("%d/%m/%Y")})
+                return "Success", 201
+            except LibraryNotFound:
                 abort(404, "The library does not exist.")
+            except (OSError, json.decoder.JSONDecodeError) as e:
+                abort(500, e)
         else:
             abort(400, error)
 
     elif request.method == "PUT":
-        target_library = os.path.join(app.config["DATABASE"], library)+".json"
         # extract the payload from the POST data and check its contents
         try:
             payload = request.get_json()
@@ -210,98 +643,350 @@ def video_management(library,title):
         error = check_video_payload(payload)
 
         if error is None:
-            # check if the current path exists and if it is a file
-            if os.path.isfile(target_library):
-                try:
-                    with open(target_library, "r") as file:
-                        content = json.load(file)
-                        find = False
-                        for video in content['videos']:
-                            # replace the content of the video if its title matches
-                            if video['title'] == title:
-                                find = True
-                                content['videos'] = [payload if video['title'] == title else video for video in content['videos']]
-                        if not find: abort(404, "The video does not exist.")
-                    with open(target_library, "w") as file:
-                        # write the new contents of the video library into its file and update the variable last_modify
-                        content['last_modify'] = date.today().strftime("%d/%m/%Y")
-                        json.dump(content, file)
-                        return "Success", 204
-                except (OSError, json.decoder.JSONDecodeError) as e:
-                    abort(500, e)
-            else:
+            try:
+                with get_store().lock(library):
+                    content = get_store().load(library)
+                    check_precondition(content)
+                    if title not in content: abort(404, "The video does not exist.")
+                    # a renamed video cannot take the title of another one
+                    if payload['title'] != title and payload['title'] in content:
+                        abort(409, "The video already exists.")
+                    # replace the content of the video in place and update the variable last_modify
+                    get_store().write(library, {"op": "replace", "title": title, "video": payload, "last_modify": date.today().strftime("%d/%m/%Y")})
+                return "Success", 204
+            except LibraryNotFound:
                 abort(404, "The library does not exist.")
+            except (OSError, json.decoder.JSONDecodeError) as e:
+                abort(500, e)
         else:
             abort(400, error)
 
     elif request.method == "DELETE":
-        target_library = os.path.join(app.config["DATABASE"], library)+".json"
-        # check if the current path exists and if it is a file
-        if os.path.isfile(target_library):
-            try:
-                with open(target_library, "r") as file:
-                    content = json.load(file)
-                    find = False
-                    for video in content['videos']:
-                        if video['title'] == title:
-                            find = True
-                            content['videos'].pop(content['videos'].index(video))
-                if not find: abort(404, "The video does not exist.")
-                with open(target_library, "w") as file:
-                    content['last_modify'] = date.today().strftime("%d/%m/%Y")
-                    json.dump(content, file)
-                    return "Success", 204
-            except (OSError, json.decoder.JSONDecodeError) as e:
-                abort(500, e)
-        else:
+        try:
+            with get_store().lock(library):
+                content = get_store().load(library)
+                check_precondition(content)
+                if title not in content: abort(404, "The video does not exist.")
+                get_store().write(library, {"op": "remove", "title": title, "last_modify": date.today().strftime("%d/%m/%Y")})
+            return "Success", 204
+        except LibraryNotFound:
             abort(404, "The library does not exist.")
+        except (OSError, json.decoder.JSONDecodeError) as e:
+            abort(500, e)
 
-@app.route('/library/<string:library>/by-name/<string:name>')
-def search_by_name(library,name):
+@app.route('/library/<string:library>/videos', methods=['GET', 'POST', 'PUT', 'DELETE'])
+def batch_management(library):
     """
-    Search for videos in a video library by filtering them by name.
+    Export/import/update/delete the videos of a video library in batch.
 
-    :return: the list of videos matching the search
+    Each item of a batch is checked on its own and gets its own result, while
+    the valid ones are all written in a single transaction. The items apply in
+    order, so an item sees the changes of the previous ones.
+
+    GET >
+    :return 200: the videos of the video library, streamed one per line (NDJSON)
+    :return 304: if the copy of the client is up to date
+    :raise 404: if the video library was not found
+    :raise 500: if an error occurs while reading the file
+
+    POST > a JSON array or NDJSON of the videos to add
+    PUT > a JSON array or NDJSON of the videos to replace, matched by title
+    DELETE > a JSON array or NDJSON of the titles of the videos to remove
+    :return 200: the list of the results of the items, with their index, title
+        and status: 201/204 if applied, 400 if malformed, 404 if the video does
+        not exist (PUT/DELETE), 409 if the video already exists (POST)
+    :raise 400: if the request is malformed
+    :raise 404: if the video library was not found
+    :raise 412: if the video library does not match the If-Match header
+    :raise 500: if an error occurs when editing the file
     """
-    target_library = os.path.join(app.config["DATABASE"], library)+".json"
-    # check if the current path exists and if it is a file
-    if os.path.isfile(target_library):
+    if request.method == "GET":
         try:
-            with open(target_library, "r") as file:
-                content = json.load(file)
-                match = []
-                for video in content['videos']:
-                    # match without case sensitivity
-                    if name.lower() in video['title'].lower(): match.append(video)
-            # return the list of matches
-            return json.dumps(match)
+            content = get_store().load(library)
+        except LibraryNotFound:
+            abort(404)
         except (OSError, json.decoder.JSONDecodeError) as e:
             abort(500, e)
-    else:
+        response = validate(content.etag, content.modified, compressed=True)
+        if response is None:
+            content, response = frozen(content)
+        if response is not None:
+            return response
+        return cached_stream(
+            content.etag, (dumps(video)+b"\n" for video in content.videos()), "application/x-ndjson",
+            still_current(library, content))
+
+    items = read_batch()
+    results = []
+    records = []
+    today = date.today().strftime("%d/%m/%Y")
+    try:
+        with get_store().lock(library):
+            content = get_store().load(library)
+            check_precondition(content)
+            # one lookup for all the titles of the batch rather than one per item
+            titles = (item if request.method == "DELETE" else item.get('title') if isinstance(item, dict) else None for item in items)
+            present = content.find(title for title in titles if isinstance(title, str))
+            # titles added and removed by the previous items of the batch
+            added, removed = set(), set()
+            for index, item in enumerate(items):
+                if request.method == "DELETE":
+                    error = None if isinstance(item, str) and item else "The title is malformed."
+                    title = item if error is None else None
+                else:
+                    error = check_batch_video(item)
+                    title = item['title'] if error is None else None
+                if error is not None:
+                    results.append({"index": index, "title": title, "status": 400, "error": error})
+                    continue
+                exists = title in added or (title in present and title not in removed)
+
+                if request.method == "POST":
+                    if exists:
+                        results.append({"index": index, "title": title, "status": 409, "error": "The video already exists."})
+                        continue
+                    records.append({"op": "add", "video": item, "last_modify": today})
+                    added.add(title)
+                    removed.discard(title)
+                    results.append({"index": index, "title": title, "status": 201})
+                elif not exists:
+                    results.append({"index": index, "title": title, "status": 404, "error": "The video does not exist."})
+                elif request.method == "PUT":
+                    records.append({"op": "replace", "title": title, "video": item, "last_modify": today})
+                    results.append({"index": index, "title": title, "status": 204})
+                elif request.method == "DELETE":
+                    records.append({"op": "remove", "title": title, "last_modify": today})
+                    added.discard(title)
+                    removed.add(title)
+                    results.append({"index": index, "title": title, "status": 204})
+            get_store().write_many(library, records)
+    except LibraryNotFound:
+        abort(404, "The library does not exist.")
+    except (OSError, json.decoder.JSONDecodeError) as e:
+        abort(500, e)
+    return json_response(dumps(results))
+
+@app.route('/library/<string:library>/by-name/<string:name>')
+def search_by_name(library,name):
+    """
+    Search for videos in a video library by filtering them by name.
+
+    :return 200: the list of videos matching the search
+    :return 304: if the copy of the client is up to date
+    """
+    try:
+        content = get_store().load(library)
+    except LibraryNotFound:
         abort(404)
+    except (OSError, json.decoder.JSONDecodeError) as e:
+        abort(500, e)
+    response = validate(content.etag, content.modified, compressed=True)
+    if response is not None:
+        return response
+    # return the list of matches, without case sensitivity
+    return cached(content.etag, lambda: dumps(content.search_title(name)))
 
 @app.route('/library/<string:library>/by-actor/<string:name>')
 def search_by_actor(library,name):
     """
     Search for videos in a video library by filtering them by actor.
 
-    :return: the list of videos matching the search
+    :return 200: the list of videos matching the search
+    :return 304: if the copy of the client is up to date
+    """
+    try:
+        content = get_store().load(library)
+    except LibraryNotFound:
+        abort(404)
+    except (OSError, json.decoder.JSONDecodeError) as e:
+        abort(500, e)
+    response = validate(content.etag, content.modified, compressed=True)
+    if response is not None:
+        return response
+    # return the list of matches, each video once even if several of its actors match
+    return cached(content.etag, lambda: dumps(content.search_actor(name)))
+
+@app.route('/library/<string:library>/stats')
+def library_stats(library):
+    """
+    Statistics of a video library, kept up to date by each change to it.
+
+    :param top: number of most frequent directors and actors to return
+    :return 200: the number of videos, the number of videos by year, and the
+        most frequent directors and actors with their number of videos
+    :return 304: if the copy of the client is up to date
+    :raise 400: if an argument is malformed
+    :raise 404: if the video library was not found
     """
-    target_library = os.path.join(app.config["DATABASE"], library)+".json"
-    # check if the current path exists and if it is a file
-    if os.path.isfile(target_library):
+    try:
+        top = int(request.args.get("top", app.config["STATS_TOP"]))
+    except ValueError:
+        abort(400, "The top must be an integer.")
+    if not 0 <= top <= app.config["STATS_MAX_TOP"]:
+        abort(400, f"The top must be between 0 and {app.config['STATS_MAX_TOP']}.")
+    try:
+        content = get_store().load(library)
+    except LibraryNotFound:
+        abort(404)
+    except (OSError, json.decoder.JSONDecodeError) as e:
+        abort(500, e)
+    response = validate(content.etag, content.modified, compressed=True)
+    if response is not None:
+        return response
+    return cached(content.etag, lambda: dumps(content.stats(top)))
+
+@app.route('/library/<string:library>/changes')
+def library_changes(library):
+    """
+    Changes of a video library since a version, to bring a copy of it up to
+    date without reading it again.
+
+    The deleted videos are to be removed from the copy and the updated videos
+    put in place of the video with the given title, both titles being the
+    ones of the copy, then the added videos appended in order.
+
+    :param since: version of the copy, as returned by the previous call, or its entity tag
+    :param wait: number of seconds to wait for a change when there is none yet, 0 by default
+    :return 200: the version, entity tag and last_modify of the library, the
+        added videos, the updated videos with their previous title and the
+        titles of the deleted videos
+    :raise 400: if an argument is malformed
+    :raise 404: if the video library was not found
+    :raise 410: if the changes since this version are no longer kept, or the
+        copy belongs to a deleted library of the same name
+    :raise 500: if an error occurs while reading the files
+    """
+    since, created = parse_since()
+    try:
+        wait = float(request.args.get("wait", 0))
+    except ValueError:
+        abort(400, "The wait must be a number.")
+    if not 0 <= wait <= app.config["CHANGES_MAX_WAIT"]:
+        abort(400, f"The wait must be between 0 and {app.config['CHANGES_MAX_WAIT']}.")
+
+    deadline = time.monotonic()+wait
+    while True:
         try:
-            with open(target_library, "r") as file:
-                content = json.load(file)
-                match = []
-                for video in content['videos']:
-                    for actor in video['actors']:
-                        # match without case sensitivity
-                        if any(name.lower() in info.lower() for info in [actor["name"], actor["surname"]]):
-                            match.append(video)
-            # return the list of matches
-            return json.dumps(match)
+            content = get_store().load(library)
+        except LibraryNotFound:
+            abort(404)
         except (OSError, json.decoder.JSONDecodeError) as e:
             abort(500, e)
+        recreated = created is not None and created != f"{content.created:x}"
+        remaining = deadline-time.monotonic()
+        if recreated or content.version != since or remaining <= 0:
+            break
+        # a change written by another worker shows up at the next check
+        time.sleep(min(app.config["CHANGES_POLL_INTERVAL"], remaining))
+    if recreated:
+        abort(410, "The video library was deleted and created again, read it again.")
+
+    def build():
+        records = content.changes(since)
+        if records is None:
+            abort(410, "The changes since this version are no longer kept, read the video library again.")
+        return dumps(dict(
+            {"version": content.version, "etag": content.etag, "last_modify": content.last_modify},
+            **net_changes(records)))
+    # the pollers of a library share the same few bodies
+    return cached(content.etag, build)
+
+@app.route('/stats')
+def stats_all():
+    """
+    Summary of the video libraries, in the order of their names.
+
+    :param prefix: prefix of the names of the video libraries to list
+    :param cursor: name from which to list them, returned in the X-Next-Cursor header of the previous page
+    :param limit: maximum number of video libraries to list
+    :return 200: the list of the video libraries with their name, owner, number of videos, version and modification time
+    :return 304: if the copy of the client is up to date
+    :raise 400: if an argument is malformed
+    """
+    entries, next_cursor = get_store().catalog(*parse_catalog_args())
+    modified = max((entry['modified'] for entry in entries), default=0)
+    return catalog_response(dumps(entries), next_cursor, modified)
+
+def load_library(library):
+    """
+    Load a video library for the cross-library search.
+
+    :return: the library and its content, or None if it disappeared
+    """
+    try:
+        return library, get_store().load(library)
+    except (LibraryNotFound, OSError, json.decoder.JSONDecodeError):
+        return None
+
+def search_library(library, content, type, name):
+    """
+    Search a video library for the cross-library search.
+
+    :return: the library and its matching videos in library order, none if it disappeared
+    """
+    try:
+        return library, content.search_title(name) if type == "title" else content.search_actor(name)
+    except (LibraryNotFound, OSError):
+        return library, []
+
+def rank(video, type, name):
+    """
+    Rank a video matching a search, lower is better: the title or an actor's
+    name or surname equal to the searched name, starting with it, or only
+    containing it.
+    """
+    query = name.lower()
+    if type == "title":
+        infos = [video['title'].lower()]
     else:
-        abort(404)
+        infos = [info.lower() for actor in video['actors'] for info in (actor["name"], actor["surname"])]
+    if query in infos:
+        return 0
+    if any(info.startswith(query) for info in infos):
+        return 1
+    return 2
+
+@app.route('/search')
+def search_all():
+    """
+    Search for videos in all the video libraries at once, by name or by actor.
+
+    :param name: the searched name, without case sensitivity
+    :param type: title (default) or actor
+    :param limit: maximum number of results
+    :return 200: the list of the best matches, best first, each video with the library it belongs to
+    :return 304: if the copy of the client is up to date
+    :raise 400: if an argument is malformed
+    """
+    name = request.args.get("name")
+    type = request.args.get("type", "title")
+    try:
+        limit = int(request.args.get("limit", app.config["SEARCH_LIMIT"]))
+    except ValueError:
+        abort(400, "The limit must be an integer.")
+    if not name:
+        abort(400, "Name is required.")
+    if type not in ("title", "actor"):
+        abort(400, "Unknown search type.")
+    if not 0 < limit <= app.config["SEARCH_MAX_LIMIT"]:
+        abort(400, f"The limit must be between 1 and {app.config['SEARCH_MAX_LIMIT']}.")
+
+    # the pool bounds the number of libraries loaded, then searched, at the same time
+    contents = [loaded for loaded in get_executor().map(load_library, sorted(get_store().libraries())) if loaded is not None]
+
+    # the results change with the search, any library, or the list of libraries,
+    # so a client up to date is answered without searching
+    etag = hashlib.md5(dumps([type, name, limit, [[library, content.etag] for library, content in contents]])).hexdigest()
+    modified = max([content.modified for _, content in contents], default=0)
+    response = validate(etag, max(modified, get_store().libraries_modified()), compressed=True)
+    if response is not None:
+        return response
+
+    def build():
+        searches = get_executor().map(lambda loaded: search_library(*loaded, type, name), contents)
+        # best rank first, then by library and in library order
+        ranked = heapq.nsmallest(limit, (
+            (rank(video, type, name), library, position, video)
+            for library, matches in searches for position, video in enumerate(matches)), key=lambda result: result[:3])
+        return dumps([dict(video, library=library) for _, library, _, video in ranked])
+    return cached(etag, build)
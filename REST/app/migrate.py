@@ -0,0 +1,35 @@
+import sys
+
+from app.main import app
+from app.store import LibraryStore
+from app.sqlite_store import SQLiteLibraryStore
+
+def migrate(database, sqlite_database):
+    """
+    Import the video libraries of a database folder into a SQLite database.
+
+    The libraries already present in the SQLite database are left untouched,
+    and only the first of several videos sharing a title is imported.
+    """
+    source = LibraryStore(database, 0, float("inf"))
+    target = SQLiteLibraryStore(sqlite_database)
+    for library in sorted(source.libraries()):
+        content = source.load(library)
+        try:
+            target.create(library, {"owner": content.owner, "last_modify": content.last_modify})
+        except FileExistsError:
+            print(f"{library}: skipped, the library already exists")
+            continue
+        records, titles = [], set()
+        for video in content.videos():
+            if video['title'] not in titles:
+                titles.add(video['title'])
+                records.append({"op": "add", "video": video, "last_modify": content.last_modify})
+        target.write_many(library, records)
+        print(f"{library}: {len(records)} videos imported")
+
+if __name__ == "__main__":
+    # usage: python -m app.migrate [database folder] [sqlite database]
+    migrate(
+        sys.argv[1] if len(sys.argv) > 1 else app.config["DATABASE"],
+        sys.argv[2] if len(sys.argv) > 2 else app.config["SQLITE_DATABASE"])
@@ -0,0 +1,51 @@
+class SearchIndex:
+    """
+    Case-insensitive substring index over short texts.
+
+    Every lowercased text is split into trigrams and each trigram points to the
+    keys of the texts containing it. A query of at least three characters only
+    verifies the keys shared by the postings of all its trigrams, starting from
+    the rarest one; shorter queries fall back to a scan of the lowercased texts.
+    """
+
+    def __init__(self):
+        self._texts = {}
+        self._postings = {}
+
+    @staticmethod
+    def _trigrams(text):
+        return {text[i:i+3] for i in range(len(text)-2)}
+
+    def add(self, key, texts):
+        """Index the texts of a key, replacing the ones previously indexed."""
+        self.remove(key)
+        lowered = tuple(text.lower() for text in texts)
+        self._texts[key] = lowered
+        for trigram in set().union(*map(self._trigrams, lowered)):
+            self._postings.setdefault(trigram, set()).add(key)
+
+    def remove(self, key):
+        """Forget the texts of a key, if any."""
+        lowered = self._texts.pop(key, None)
+        if lowered is None:
+            return
+        for trigram in set().union(*map(self._trigrams, lowered)):
+            postings = self._postings[trigram]
+            postings.discard(key)
+            if not postings:
+                del self._postings[trigram]
+
+    def search(self, query):
+        """
+        Find the keys with a text containing the query, without case sensitivity.
+
+        :return: the set of matching keys
+        """
+        query = query.lower()
+        trigrams = self._trigrams(query)
+        if not trigrams:
+            return {key for key, lowered in self._texts.items() if any(query in text for text in lowered)}
+        postings = sorted((self._postings.get(trigram, set()) for trigram in trigrams), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        # sharing every trigram does not guarantee that they are contiguous
+        return {key for key in candidates if any(query in text for text in self._texts[key])}
@@ -0,0 +1,81 @@
+import json
+import threading
+import dataclasses
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj):
+    """
+    Serialize an object to JSON, with orjson when it is installed. The
+    dataclasses are serialized as objects of their fields.
+
+    :return: the UTF-8 encoded JSON document
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_fields).encode()
+
+def _fields(obj):
+    # orjson serializes the dataclasses by itself
+    if not dataclasses.is_dataclass(obj):
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return {field.name: getattr(obj, field.name) for field in dataclasses.fields(obj)}
+
+def loads(data):
+    """
+    Deserialize a JSON document, given as bytes or as a string.
+
+    :raise json.decoder.JSONDecodeError: if the document is malformed
+    """
+    if orjson is not None:
+        # orjson.JSONDecodeError is a subclass of json.decoder.JSONDecodeError
+        return orjson.loads(data)
+    return json.loads(data)
+
+class BodyCache:
+    """
+    Bounded cache of serialized response bodies.
+
+    A body is stored under the entity tag of the resource it was built from,
+    so it is served as long as the resource does not change and simply
+    replaced once it does. The least recently used bodies are evicted once
+    their total size exceeds the byte budget.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._bodies = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """Return the total size of the stored bodies, in bytes."""
+        return self._size
+
+    def get(self, key, etag):
+        """Return the body stored for a key and entity tag, or None."""
+        with self._lock:
+            entry = self._bodies.get(key)
+            if entry is None or entry[0] != etag:
+                return None
+            self._bodies.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, etag, body):
+        """Store the body of a key for an entity tag, if it fits in the budget."""
+        with self._lock:
+            previous = self._bodies.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous[1])
+            if len(body) > self.max_bytes:
+                return
+            self._bodies[key] = (etag, body)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                _, (_, evicted) = self._bodies.popitem(last=False)
+                self._size -= len(evicted)
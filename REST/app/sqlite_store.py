@@ -0,0 +1,486 @@
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from app.serialization import dumps
+from app.serialization import loads
+from app.store import LibraryNotFound
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS libraries (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    owner_name TEXT NOT NULL,
+    owner_surname TEXT NOT NULL,
+    last_modify TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    next_position INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS directors (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    surname TEXT NOT NULL,
+    UNIQUE (name, surname)
+);
+CREATE TABLE IF NOT EXISTS actors (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    surname TEXT NOT NULL,
+    UNIQUE (name, surname)
+);
+CREATE INDEX IF NOT EXISTS actors_surname ON actors (surname);
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    library_id INTEGER NOT NULL REFERENCES libraries (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    year,
+    director_id INTEGER NOT NULL REFERENCES directors (id),
+    UNIQUE (library_id, title),
+    UNIQUE (library_id, position)
+);
+CREATE INDEX IF NOT EXISTS videos_title ON videos (title);
+CREATE TABLE IF NOT EXISTS video_actors (
+    video_id INTEGER NOT NULL REFERENCES videos (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    actor_id INTEGER NOT NULL REFERENCES actors (id),
+    PRIMARY KEY (video_id, position)
+);
+CREATE INDEX IF NOT EXISTS video_actors_actor ON video_actors (actor_id);
+CREATE TABLE IF NOT EXISTS changes (
+    library_id INTEGER NOT NULL REFERENCES libraries (id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    record BLOB NOT NULL,
+    PRIMARY KEY (library_id, version)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS video_search USING fts5 (title, actors, tokenize = 'trigram');
+"""
+
+# maximum number of videos whose actors are fetched by a single query
+BATCH_SIZE = 500
+
+class SQLiteLibrary:
+    """
+    Video library stored in SQLite, answering the same questions as a Library
+    with indexed queries instead of holding its videos in memory.
+
+    The cursor of a page is the position of its first video in the library.
+    """
+
+    def __init__(self, store, row):
+        self._store = store
+        self.id, owner_name, owner_surname, self.last_modify, self.version, self.created, self.modified = row
+        self.owner = {"name": owner_name, "surname": owner_surname}
+
+    @property
+    def etag(self):
+        """Return an entity tag changing with every change to the library, or to its successor."""
+        return f"{self.created:x}-{self.version}"
+
+    def copy(self):
+        """
+        Return the library itself, its queries read the database as it is
+        when they run: a body streamed from it may include the changes made
+        in the meantime, see cached_stream.
+        """
+        return self
+
+    def to_dict(self):
+        """Return the content of the video library in the format of a library file."""
+        return {"owner": self.owner, "last_modify": self.last_modify, "videos": list(self.videos())}
+
+    def changes(self, since):
+        """
+        Return the change records applied after a version.
+
+        :return: the change records in order, or None if they are no longer all kept
+        """
+        if since == self.version:
+            return []
+        records = [loads(row[0]) for row in self._store._connection().execute(
+            "SELECT record FROM changes WHERE library_id = ? AND version > ? AND version <= ? ORDER BY version",
+            (self.id, since, self.version))]
+        return records if since < self.version and len(records) == self.version-since else None
+
+    def __len__(self):
+        return self._store._connection().execute(
+            "SELECT count(*) FROM videos WHERE library_id = ?", (self.id,)).fetchone()[0]
+
+    def __contains__(self, title):
+        return self._store._connection().execute(
+            "SELECT 1 FROM videos WHERE library_id = ? AND title = ?", (self.id, title)).fetchone() is not None
+
+    def find(self, titles):
+        """Return the set of the given titles that belong to videos of the library."""
+        titles, found = list(titles), set()
+        for i in range(0, len(titles), BATCH_SIZE):
+            batch = titles[i:i+BATCH_SIZE]
+            found.update(row[0] for row in self._store._connection().execute(
+                "SELECT title FROM videos WHERE library_id = ? AND title IN (%s)" % ",".join("?"*len(batch)),
+                (self.id, *batch)))
+        return found
+
+    def videos(self):
+        """Iterate over the videos of the library in insertion order, a batch at a time."""
+        position = 0
+        while True:
+            page, position = self.page(position, BATCH_SIZE)
+            yield from page
+            if position is None:
+                return
+
+    def page(self, cursor, limit):
+        """
+        Return a page of videos in insertion order.
+
+        :return: the videos of the page and the cursor of the next page, or None
+        """
+        rows = self._store._connection().execute(
+            _VIDEOS+" WHERE v.library_id = ? AND v.position >= ? ORDER BY v.position LIMIT ?",
+            (self.id, cursor, limit+1)).fetchall()
+        next_cursor = rows.pop()[1] if len(rows) > limit else None
+        return self._store._assemble(rows), next_cursor
+
+    def get(self, title):
+        """Return the video with the given title, or None."""
+        rows = self._store._connection().execute(
+            _VIDEOS+" WHERE v.library_id = ? AND v.title = ?", (self.id, title)).fetchall()
+        return self._store._assemble(rows)[0] if rows else None
+
+    def search_title(self, name):
+        """Return the videos whose title contains the name, in library order."""
+        query = name.lower()
+        return [video for video in self._search("title", name) if query in video['title'].lower()]
+
+    def search_actor(self, name):
+        """Return the videos with an actor whose name or surname contains the name, in library order."""
+        query = name.lower()
+        return [
+            video for video in self._search("actors", name)
+            if any(query in info.lower() for actor in video['actors'] for info in (actor["name"], actor["surname"]))]
+
+    def stats(self, top):
+        """Summarize the aggregates of the videos, computed by grouped queries, see VideoStats.summary."""
+        connection = self._store._connection()
+        years = {}
+        for year, count in connection.execute(
+                "SELECT year, count(*) FROM videos WHERE library_id = ? GROUP BY year", (self.id,)):
+            # like VideoStats, the years stored either as integers or as strings are counted together
+            years[str(year)] = years.get(str(year), 0)+count
+        directors = connection.execute(
+            "SELECT d.name, d.surname, count(*) FROM videos v JOIN directors d ON d.id = v.director_id"
+            " WHERE v.library_id = ? GROUP BY d.id ORDER BY count(*) DESC, d.surname, d.name LIMIT ?",
+            (self.id, top))
+        actors = connection.execute(
+            "SELECT a.name, a.surname, count(DISTINCT v.id) FROM videos v"
+            " JOIN video_actors va ON va.video_id = v.id JOIN actors a ON a.id = va.actor_id"
+            " WHERE v.library_id = ? GROUP BY a.id ORDER BY count(DISTINCT v.id) DESC, a.surname, a.name LIMIT ?",
+            (self.id, top))
+        return {
+            "videos": len(self),
+            "years": dict(sorted(years.items())),
+            "directors": [{"name": name, "surname": surname, "videos": count} for name, surname, count in directors],
+            "actors": [{"name": name, "surname": surname, "videos": count} for name, surname, count in actors],
+            }
+
+    def _search(self, column, name):
+        """
+        Find the candidate videos of a search in a column of the full text index.
+
+        The trigram index needs at least three characters, shorter names are
+        looked for among all the videos of the library.
+        """
+        if len(name) < 3:
+            return self.videos()
+        # a phrase restricted to the column, with its quotes escaped
+        match = '%s : "%s"' % (column, name.replace('"', '""'))
+        # matched in a subquery, a join would run the full text query once per video
+        rows = self._store._connection().execute(
+            _VIDEOS+" WHERE v.library_id = ? AND v.id IN (SELECT rowid FROM video_search WHERE video_search MATCH ?)"
+            " ORDER BY v.position", (self.id, match)).fetchall()
+        return self._store._assemble(rows)
+
+# videos with their director, to be completed with their actors
+_VIDEOS = "SELECT v.id, v.position, v.title, v.year, d.name, d.surname FROM videos v JOIN directors d ON d.id = v.director_id"
+
+class SQLiteLibraryStore:
+    """
+    Store the video libraries in a SQLite database.
+
+    The database runs in WAL mode, so readers never wait for the writer. Each
+    thread has its own connection, and a write holds an immediate transaction
+    from the checks of the handler to the last change, serializing the
+    writers across the threads and the workers. Titles and actor names are
+    indexed, and searches go through a trigram full text index. The records
+    of the most recent changes of each library, up to a number of changes,
+    are kept for the change feed.
+    """
+
+    def __init__(self, path, history=1000):
+        self.path = path
+        self.history = history
+        self._local = threading.local()
+
+    def _connection(self):
+        """Return the connection of the current thread, opened on first use."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # transactions are handled explicitly by lock
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=30)
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+            connection.execute("PRAGMA foreign_keys = ON")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.depth = 0
+        return connection
+
+    @contextmanager
+    def lock(self, library, create=False):
+        """
+        Hold the exclusive write access to the database within a transaction,
+        committed on exit or rolled back on error. The lock is reentrant within
+        a thread.
+
+        :param create: whether the video library may not exist yet
+        :raise LibraryNotFound: if the video library does not exist
+        """
+        connection = self._connection()
+        if self._local.depth == 0:
+            connection.execute("BEGIN IMMEDIATE")
+        self._local.depth += 1
+        try:
+            if not create:
+                self._library_id(library)
+            yield
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                connection.execute("ROLLBACK")
+            raise
+        self._local.depth -= 1
+        if self._local.depth == 0:
+            connection.execute("COMMIT")
+
+    def _library_id(self, library):
+        """
+        :return: the identifier of a video library
+        :raise LibraryNotFound: if the video library does not exist
+        """
+        row = self._connection().execute("SELECT id FROM libraries WHERE name = ?", (library,)).fetchone()
+        if row is None:
+            raise LibraryNotFound(library)
+        return row[0]
+
+    def libraries(self):
+        """
+        List the video libraries of the database.
+
+        :return: the names of the video libraries
+        """
+        return [row[0] for row in self._connection().execute("SELECT name FROM libraries ORDER BY name")]
+
+    def libraries_modified(self):
+        """Return the time of the last creation or deletion of a video library."""
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'libraries_modified'").fetchone()
+        return 0 if row is None else row[0]
+
+    def catalog(self, prefix="", cursor=None, limit=None):
+        """
+        List the video libraries with their owner, number of videos, version
+        and modification time, in the order of their names.
+
+        :param prefix: the prefix of the names of the listed libraries
+        :param cursor: the name from which to list them, returned by the previous page
+        :param limit: the maximum number of libraries, None for all of them
+        :return: the entries of the page and the cursor of the next page, or None
+        """
+        # a range of names uses the unique index on the names, unlike LIKE which ignores the case
+        rows = self._connection().execute(
+            "SELECT name, owner_name, owner_surname, version, modified,"
+            " (SELECT count(*) FROM videos WHERE videos.library_id = libraries.id)"
+            " FROM libraries WHERE name >= ? AND name < ? ORDER BY name LIMIT ?",
+            (max(prefix, cursor or ""), prefix+"\U0010ffff", -1 if limit is None else limit+1)).fetchall()
+        next_cursor = rows.pop()[0] if limit is not None and len(rows) > limit else None
+        return [
+            {"name": name, "owner": {"name": owner_name, "surname": owner_surname},
+             "videos": videos, "version": version, "modified": modified}
+            for name, owner_name, owner_surname, version, modified, videos in rows], next_cursor
+
+    def sizes(self):
+        """
+        Count the videos of the video libraries.
+
+        :return: the number of videos by video library
+        """
+        return dict(self._connection().execute(
+            "SELECT name, count(videos.id) FROM libraries LEFT JOIN videos ON videos.library_id = libraries.id"
+            " GROUP BY libraries.id"))
+
+    def load(self, library):
+        """
+        Retrieve a video library.
+
+        :return: the video library
+        :raise LibraryNotFound: if the video library does not exist
+        """
+        row = self._connection().execute(
+            "SELECT id, owner_name, owner_surname, last_modify, version, created, modified"
+            " FROM libraries WHERE name = ?", (library,)).fetchone()
+        if row is None:
+            raise LibraryNotFound(library)
+        return SQLiteLibrary(self, row)
+
+    def _assemble(self, rows):
+        """Build the videos of rows of the videos query, fetching their actors."""
+        videos = {}
+        for video_id, _, title, year, director_name, director_surname in rows:
+            videos[video_id] = {
+                "title": title,
+                "year": year,
+                "director": {"name": director_name, "surname": director_surname},
+                "actors": []}
+        ids = list(videos)
+        for start in range(0, len(ids), BATCH_SIZE):
+            chunk = ids[start:start+BATCH_SIZE]
+            for video_id, name, surname in self._connection().execute(
+                    "SELECT va.video_id, a.name, a.surname FROM video_actors va JOIN actors a ON a.id = va.actor_id"
+                    " WHERE va.video_id IN (%s) ORDER BY va.video_id, va.position" % ",".join("?"*len(chunk)), chunk):
+                videos[video_id]["actors"].append({"name": name, "surname": surname})
+        return list(videos.values())
+
+    def write(self, library, record):
+        """
+        Apply a change record to a video library.
+
+        The version of the record is set from the version of the library, and
+        its modification time from the clock.
+
+        :raise LibraryNotFound: if the video library does not exist
+        """
+        self.write_many(library, [record])
+
+    def write_many(self, library, records):
+        """
+        Apply change records to a video library in a single transaction.
+
+        :raise LibraryNotFound: if the video library does not exist
+        """
+        if not records:
+            return
+        with self.lock(library):
+            connection = self._connection()
+            library_id, version, position = connection.execute(
+                "SELECT id, version, next_position FROM libraries WHERE name = ?", (library,)).fetchone()
+            modified = time.time()
+            people = {}
+            for record in records:
+                version += 1
+                if record['op'] == "add":
+                    video_id = connection.execute(
+                        "INSERT INTO videos (library_id, position, title, year, director_id) VALUES (?, ?, ?, ?, ?)",
+                        (library_id, position, record['video']['title'], record['video']['year'],
+                         self._person("directors", record['video']['director'], people))).lastrowid
+                    position += 1
+                    self._insert_actors(video_id, record['video'], people)
+                elif record['op'] == "replace":
+                    video_id = self._video_id(library_id, record['title'])
+                    connection.execute(
+                        "UPDATE videos SET title = ?, year = ?, director_id = ? WHERE id = ?",
+                        (record['video']['title'], record['video']['year'],
+                         self._person("directors", record['video']['director'], people), video_id))
+                    connection.execute("DELETE FROM video_actors WHERE video_id = ?", (video_id,))
+                    connection.execute("DELETE FROM video_search WHERE rowid = ?", (video_id,))
+                    self._insert_actors(video_id, record['video'], people)
+                elif record['op'] == "remove":
+                    video_id = self._video_id(library_id, record['title'])
+                    connection.execute("DELETE FROM video_search WHERE rowid = ?", (video_id,))
+                    connection.execute("DELETE FROM videos WHERE id = ?", (video_id,))
+                record['version'] = version
+                record['modified'] = modified
+            # only the records still kept once the older ones are dropped are written
+            connection.executemany(
+                "INSERT INTO changes (library_id, version, record) VALUES (?, ?, ?)",
+                [(library_id, record['version'], dumps(record)) for record in records[max(0, len(records)-self.history):]])
+            connection.execute("DELETE FROM changes WHERE library_id = ? AND version <= ?", (library_id, version-self.history))
+            connection.execute(
+                "UPDATE libraries SET last_modify = ?, version = ?, modified = ?, next_position = ? WHERE id = ?",
+                (records[-1]['last_modify'], version, modified, position, library_id))
+
+    def _video_id(self, library_id, title):
+        """
+        :return: the identifier of a video
+        :raise KeyError: if no video has this title
+        """
+        row = self._connection().execute(
+            "SELECT id FROM videos WHERE library_id = ? AND title = ?", (library_id, title)).fetchone()
+        if row is None:
+            raise KeyError(title)
+        return row[0]
+
+    def _person(self, table, person, people):
+        """Return the identifier of a director or an actor, inserted if needed."""
+        key = (table, person['name'], person['surname'])
+        if key not in people:
+            connection = self._connection()
+            connection.execute(
+                "INSERT INTO %s (name, surname) VALUES (?, ?) ON CONFLICT DO NOTHING" % table,
+                (person['name'], person['surname']))
+            people[key] = connection.execute(
+                "SELECT id FROM %s WHERE name = ? AND surname = ?" % table,
+                (person['name'], person['surname'])).fetchone()[0]
+        return people[key]
+
+    def _insert_actors(self, video_id, video, people):
+        """Link the actors of a video and index it for the searches."""
+        connection = self._connection()
+        connection.executemany(
+            "INSERT INTO video_actors (video_id, position, actor_id) VALUES (?, ?, ?)",
+            [(video_id, i, self._person("actors", actor, people)) for i, actor in enumerate(video['actors'])])
+        connection.execute(
+            "INSERT INTO video_search (rowid, title, actors) VALUES (?, ?, ?)",
+            (video_id, video['title'], "\n".join(info for actor in video['actors'] for info in (actor["name"], actor["surname"]))))
+
+    def create(self, library, content):
+        """
+        Create a new video library, stamped with its creation time.
+
+        :raise FileExistsError: if the video library already exists
+        """
+        with self.lock(library, create=True):
+            connection = self._connection()
+            try:
+                connection.execute(
+                    "INSERT INTO libraries (name, owner_name, owner_surname, last_modify, version, created, modified)"
+                    " VALUES (?, ?, ?, ?, 0, ?, ?)",
+                    (library, content['owner']['name'], content['owner']['surname'], content['last_modify'],
+                     time.time_ns(), time.time()))
+            except sqlite3.IntegrityError as e:
+                raise FileExistsError(library) from e
+            self._touch_libraries()
+
+    def delete(self, library):
+        """
+        Delete a video library with its videos.
+
+        :raise LibraryNotFound: if the video library does not exist
+        """
+        with self.lock(library):
+            connection = self._connection()
+            library_id = self._library_id(library)
+            connection.execute(
+                "DELETE FROM video_search WHERE rowid IN (SELECT id FROM videos WHERE library_id = ?)", (library_id,))
+            connection.execute("DELETE FROM libraries WHERE id = ?", (library_id,))
+            self._touch_libraries()
+
+    def _touch_libraries(self):
+        self._connection().execute(
+            "INSERT INTO meta (key, value) VALUES ('libraries_modified', ?)"
+            " ON CONFLICT (key) DO UPDATE SET value = excluded.value", (time.time(),))
@@ -0,0 +1,89 @@
+import heapq
+from collections import Counter
+
+class VideoStats:
+    """
+    Aggregates over the videos of a library: their number, the number of
+    videos per year and the number of videos of each director and actor.
+
+    The aggregates are counters updated by each added or removed video, so
+    keeping them up to date costs a few dictionary updates per change and
+    summarizing them never reads the videos again. The years are counted as
+    strings, since the videos may store them either way.
+    """
+
+    def __init__(self, videos=()):
+        self.count = 0
+        self.years = Counter()
+        self.directors = Counter()
+        self.actors = Counter()
+        for video in videos:
+            self.add(video)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Return the aggregates stored by to_dict."""
+        stats = cls()
+        stats.count = data['count']
+        stats.years = Counter(data['years'])
+        stats.directors = Counter({(name, surname): count for name, surname, count in data['directors']})
+        stats.actors = Counter({(name, surname): count for name, surname, count in data['actors']})
+        return stats
+
+    def to_dict(self):
+        """Return the aggregates as a JSON-serializable dict, see from_dict."""
+        return {
+            "count": self.count,
+            "years": dict(self.years),
+            "directors": [[name, surname, count] for (name, surname), count in self.directors.items()],
+            "actors": [[name, surname, count] for (name, surname), count in self.actors.items()],
+            }
+
+    def add(self, video):
+        """Count a video."""
+        self._update(video, 1)
+
+    def remove(self, video):
+        """Stop counting a video, previously counted."""
+        self._update(video, -1)
+
+    def _update(self, video, delta):
+        self.count += delta
+        for counter, key in ((self.years, str(video['year'])), (self.directors, _person(video['director']))):
+            counter[key] += delta
+            if not counter[key]:
+                del counter[key]
+        # an actor playing several roles in a video still counts one video
+        for key in {_person(actor) for actor in video['actors']}:
+            self.actors[key] += delta
+            if not self.actors[key]:
+                del self.actors[key]
+
+    def summary(self, top):
+        """
+        Summarize the aggregates.
+
+        :param top: the number of most frequent directors and actors to list
+        :return: the number of videos, the number of videos by year, and the
+            most frequent directors and actors with their number of videos,
+            most frequent first
+        """
+        return {
+            "videos": self.count,
+            "years": dict(sorted(self.years.items())),
+            "directors": most_frequent(self.directors.items(), top),
+            "actors": most_frequent(self.actors.items(), top),
+            }
+
+def most_frequent(counts, top):
+    """
+    Select the most frequent people, the ties broken by surname and name.
+
+    :param counts: the ((name, surname), number of videos) pairs
+    :return: the list of the top people with their number of videos
+    """
+    best = heapq.nsmallest(top, counts, key=lambda item: (-item[1], item[0][1], item[0][0]))
+    return [{"name": name, "surname": surname, "videos": count} for (name, surname), count in best]
+
+def _person(person):
+    return (person['name'], person['surname'])
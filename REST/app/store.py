@@ -0,0 +1,1458 @@
+import os
+import copy
+import time
+import fcntl
+import bisect
+import struct
+import hashlib
+import logging
+import itertools
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from app.catalog import Catalog
+from app.changes import ChangeFeed
+from app.changes import retained
+from app.changes import versions
+from app.compression import compress_snapshot
+from app.compression import compressor
+from app.compression import content_size
+from app.compression import decompressing
+from app.image import SEPARATORS
+from app.image import LibraryImage
+from app.image import expand_runs
+from app.image import position_runs
+from app.image import write_image
+from app.metrics import REGISTRY
+from app.search import SearchIndex
+from app.serialization import dumps
+from app.serialization import loads
+from app.stats import VideoStats
+from app.stream import iter_library
+from app.video import compact
+
+FILE_READ_BYTES = REGISTRY.counter(
+    "library_file_read_bytes_total", "Bytes read from the files of the video libraries.", ("file",))
+FILE_READ_SECONDS = REGISTRY.counter(
+    "library_file_read_seconds_total", "Time spent reading the files of the video libraries.", ("file",))
+FILE_WRITE_BYTES = REGISTRY.counter(
+    "library_file_write_bytes_total", "Bytes written to the files of the video libraries.", ("file",))
+FILE_WRITE_SECONDS = REGISTRY.counter(
+    "library_file_write_seconds_total", "Time spent writing and syncing the files of the video libraries.", ("file",))
+PARSE_SECONDS = REGISTRY.histogram(
+    "library_parse_seconds", "Time spent reading and decoding a snapshot, or decoding and applying the new records of a log.", ("file",))
+CACHE_LOADS = REGISTRY.counter(
+    "library_cache_loads_total",
+    "Loads of video libraries, by hit, replay of the log or miss of the cache, mapping of a shared image, or streamed read.",
+    ("result",))
+COMPACTION_FAILURES = REGISTRY.counter(
+    "library_compaction_failures_total", "Background compactions of the video libraries abandoned on an error.")
+IMAGE_FAILURES = REGISTRY.counter(
+    "library_image_failures_total", "Shared images of the video libraries that could not be written, the libraries decoded by the worker instead.")
+
+logger = logging.getLogger(__name__)
+
+class LibraryNotFound(Exception):
+    """Raised when the file of a video library does not exist."""
+
+class Library:
+    """
+    Content of a video library with its videos indexed by title.
+
+    The videos are kept in insertion order in a list of slots next to a hash
+    index mapping each title to its slot, so finding, replacing or removing a
+    video never scans the library. Removed videos leave an empty slot behind,
+    reclaimed once they outnumber the live videos.
+
+    Each video keeps the position it was given when added, stored in the
+    snapshot like in the SQLite backend, so the cursor of a page is the
+    position of its first video and still holds after the empty slots are
+    reclaimed, the snapshot compacted or the library reloaded.
+
+    The videos are held in their compact form, see app.video, with the people
+    shared between the videos of the library.
+
+    The search indexes over titles and actor names are built in the
+    background from the first search, the searches scanning the videos until
+    they are ready, and the aggregates of the videos on the first request for
+    them; both are then kept up to date by every change to the library.
+
+    The version counts the changes applied to the library since its creation,
+    the creation time tells apart a library from a deleted one of the same
+    name, and the modification time is the precise time of the last change.
+    The lines of the log are kept in the feed of the library, see ChangeFeed,
+    to list the changes since a version.
+
+    Changes and searches are serialized by a mutex, so a library shared by the
+    threads of a worker can be searched while another thread updates it.
+    """
+
+    def __init__(self, owner, last_modify, videos=(), version=0, created=0, modified=None):
+        self.owner = owner
+        self.last_modify = last_modify
+        self.version = version
+        self.created = created
+        self.modified = modified
+        self._slots = []
+        # the position of the video of each slot, increasing
+        self._positions = array("q")
+        self.next_position = 0
+        self._index = {}
+        self._people = {}
+        self._titles = None
+        self._actors = None
+        # the changes to replay on the search indexes being built, None when no build is running
+        self._pending = None
+        self._stats = None
+        self._mutex = threading.Lock()
+        self.feed = ChangeFeed()
+        for video in videos:
+            self._append(video)
+
+    def _append(self, video):
+        video = compact(video, self._people)
+        self._slots.append(video)
+        self._positions.append(self.next_position)
+        self.next_position += 1
+        # like a linear scan, a duplicated title resolves to its first video
+        self._index.setdefault(video['title'], len(self._slots)-1)
+
+    @classmethod
+    def from_file(cls, file):
+        """
+        Build a video library from its file, decoding one video at a time so
+        that only their compact form is ever held for the whole library.
+
+        :raise json.decoder.JSONDecodeError: if the file is malformed
+        """
+        library = cls(None, None)
+        fields = {}
+        for event in iter_library(_reader(file)):
+            if event[0] == "video":
+                library._append(event[1])
+            else:
+                fields[event[1]] = event[2]
+        library.owner = fields['owner']
+        library.last_modify = fields['last_modify']
+        if "positions" in fields:
+            library._positions = array("q", expand_runs(fields['positions']))
+            library.next_position = fields['next_position']
+        library.version = fields.get('version', 0)
+        library.created = fields.get('created', 0)
+        library.modified = fields.get('modified')
+        return library
+
+    def to_dict(self):
+        """Return the content of the video library as stored in its file."""
+        return {"owner": self.owner, "last_modify": self.last_modify, "videos": list(self.videos())}
+
+    @property
+    def etag(self):
+        """Return an entity tag changing with every change to the library, or to its successor."""
+        return f"{self.created:x}-{self.version}"
+
+    def copy(self):
+        """
+        Return a copy of the library that the changes applied to this one
+        leave as it is, to be read while the library keeps changing. The
+        copy builds its own search indexes and aggregates if it needs them.
+        """
+        with self._mutex:
+            library = copy.copy(self)
+            library._slots = list(self._slots)
+            library._positions = array("q", self._positions)
+            library._index = dict(self._index)
+        library._titles = library._actors = library._pending = library._stats = None
+        library._mutex = threading.Lock()
+        return library
+
+    def apply(self, record):
+        """
+        Apply a change record of the log to the library, or a batch of them.
+
+        :raise KeyError: if the record targets a video that does not exist
+        """
+        with self._mutex:
+            self._apply(record)
+
+    def _apply(self, record):
+        if record['op'] == "batch":
+            for change in record['records']:
+                self._apply(change)
+            return
+        if record['op'] == "add":
+            self.add(record['video'])
+        elif record['op'] == "replace":
+            self.replace(record['title'], record['video'])
+        elif record['op'] == "remove":
+            self.remove(record['title'])
+        self.last_modify = record['last_modify']
+        self.version = record['version']
+        self.modified = record.get('modified', self.modified)
+
+    def changes(self, since):
+        """Return the change records applied after a version, see ChangeFeed.since."""
+        return self.feed.since(since, self.version)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, title):
+        return title in self._index
+
+    def find(self, titles):
+        """Return the set of the given titles that belong to videos of the library."""
+        return {title for title in titles if title in self._index}
+
+    def videos(self):
+        """Iterate over the videos of the library in insertion order."""
+        return (video for video in self._slots if video is not None)
+
+    def positions(self):
+        """Return the positions of the videos of the library, in insertion order."""
+        with self._mutex:
+            return [position for position, video in zip(self._positions, self._slots) if video is not None]
+
+    def page(self, cursor, limit):
+        """
+        Return a page of videos in insertion order.
+
+        The cursor is the position from which to read, the one returned for
+        the next page skips the videos already read even if some of them were
+        removed in between.
+
+        :return: the videos of the page and the cursor of the next page, or None
+        """
+        page = []
+        with self._mutex:
+            slot = bisect.bisect_left(self._positions, cursor)
+            while slot < len(self._slots) and len(page) < limit:
+                if self._slots[slot] is not None:
+                    page.append(self._slots[slot])
+                slot += 1
+            return page, (self._positions[slot] if slot < len(self._slots) else None)
+
+    def get(self, title):
+        """Return the video with the given title, or None."""
+        position = self._index.get(title)
+        return None if position is None else self._slots[position]
+
+    def add(self, video):
+        """Append a video at the end of the library."""
+        video = compact(video, self._people)
+        self._slots.append(video)
+        self._positions.append(self.next_position)
+        self.next_position += 1
+        self._index[video['title']] = len(self._slots)-1
+        self._index_video(video)
+        if self._stats is not None:
+            self._stats.add(video)
+
+    def replace(self, title, video):
+        """
+        Replace the video with the given title, keeping its position.
+
+        :raise KeyError: if no video has this title
+        """
+        position = self._index.pop(title)
+        self._unindex_video(title)
+        if self._stats is not None:
+            self._stats.remove(self._slots[position])
+        video = compact(video, self._people)
+        self._slots[position] = video
+        self._index[video['title']] = position
+        self._index_video(video)
+        if self._stats is not None:
+            self._stats.add(video)
+
+    def remove(self, title):
+        """
+        Remove the video with the given title.
+
+        :raise KeyError: if no video has this title
+        """
+        position = self._index.pop(title)
+        if self._stats is not None:
+            self._stats.remove(self._slots[position])
+        self._slots[position] = None
+        self._unindex_video(title)
+        if len(self._slots) > 2*len(self._index)+16:
+            self._compact()
+
+    def _compact(self):
+        """Reclaim the empty slots left by removed videos."""
+        self._positions = array("q", (
+            position for position, video in zip(self._positions, self._slots) if video is not None))
+        self._slots = list(self.videos())
+        self._index = {}
+        for position, video in enumerate(self._slots):
+            self._index.setdefault(video['title'], position)
+
+    def search_title(self, name):
+        """Return the videos whose title contains the name, in library order."""
+        query = name.lower()
+        with self._mutex:
+            if self._titles is not None:
+                return self._matches(self._titles.search(name))
+            videos = self._indexed_videos()
+        return [video for video in videos if query in video['title'].lower()]
+
+    def search_actor(self, name):
+        """Return the videos with an actor whose name or surname contains the name, in library order."""
+        query = name.lower()
+        with self._mutex:
+            if self._actors is not None:
+                return self._matches(self._actors.search(name))
+            videos = self._indexed_videos()
+        return [
+            video for video in videos
+            if any(query in info.lower() for actor in video['actors'] for info in (actor["name"], actor["surname"]))]
+
+    def stats(self, top):
+        """Summarize the aggregates of the videos, see VideoStats.summary."""
+        with self._mutex:
+            if self._stats is None:
+                self._stats = VideoStats(self._slots[position] for position in self._index.values())
+            return self._stats.summary(top)
+
+    def _matches(self, titles):
+        return [self._slots[position] for position in sorted(self._index[title] for title in titles)]
+
+    def _indexed_videos(self):
+        """
+        Copy the videos found by the searches, in library order, and start the
+        build of the search indexes if needed. Called under the mutex.
+        """
+        videos = [
+            video for position, video in enumerate(self._slots)
+            if video is not None and self._index[video['title']] == position]
+        if self._pending is None:
+            self._pending = []
+            threading.Thread(target=self._build_search, args=(videos,), daemon=True).start()
+        return videos
+
+    def _build_search(self, videos):
+        """
+        Build the search indexes from a copy of the videos, outside of the
+        mutex, then replay the changes applied in the meantime.
+        """
+        titles, actors = SearchIndex(), SearchIndex()
+        for video in videos:
+            self._add_to_search(titles, actors, video)
+        with self._mutex:
+            for title, video in self._pending:
+                if video is None:
+                    titles.remove(title)
+                    actors.remove(title)
+                else:
+                    self._add_to_search(titles, actors, video)
+            self._titles, self._actors, self._pending = titles, actors, None
+
+    @staticmethod
+    def _add_to_search(titles, actors, video):
+        titles.add(video['title'], [video['title']])
+        actors.add(video['title'], [info for actor in video['actors'] for info in (actor["name"], actor["surname"])])
+
+    def _index_video(self, video):
+        if self._titles is not None:
+            self._add_to_search(self._titles, self._actors, video)
+        elif self._pending is not None:
+            self._pending.append((video['title'], video))
+
+    def _unindex_video(self, title):
+        if self._titles is not None:
+            self._titles.remove(title)
+            self._actors.remove(title)
+        elif self._pending is not None:
+            self._pending.append((title, None))
+
+class StreamedLibrary:
+    """
+    Video library too large to be held in memory, read from its snapshot one
+    video at a time.
+
+    The changes of the log are kept aside and applied to the videos on the
+    fly: the snapshot videos replaced or removed by the log, by their title in
+    the snapshot, and the videos added by the log, whose slots follow the ones
+    of the snapshot. Each query walks the snapshot from its start and stops
+    as soon as it has its answer. The videos keep their positions like in a
+    resident library, the added ones numbered from the next position of the
+    snapshot.
+
+    The snapshot stays open, so the library keeps reading the same snapshot
+    even if a compaction replaces it in the meantime.
+
+    Like for a resident library, the changes are applied under a mutex, and
+    the queries read the changes kept aside under it, so a library shared by
+    the threads of a worker can be queried while another thread updates it.
+    """
+
+    def __init__(self, file, chunk_size=64*1024):
+        self._file = file
+        self._chunk_size = chunk_size
+        # number of videos, counted on first use
+        self._count = None
+        self._changed = {}
+        self._added = []
+        # current title of the videos changed or added by the log, to their slot
+        self._current = {}
+        self._mutex = threading.Lock()
+        self.feed = ChangeFeed()
+        fields = {}
+        for event in self._events():
+            if event[0] == "field":
+                fields[event[1]] = event[2]
+            elif "version" in fields:
+                # the bookkeeping is written ahead of the videos, older snapshots have it after them
+                break
+        self._set_fields(fields)
+
+    def _set_fields(self, fields):
+        """Set the bookkeeping of the library from the top-level fields of its snapshot."""
+        self.owner = fields['owner']
+        self.last_modify = fields['last_modify']
+        self.version = fields.get('version', 0)
+        self.created = fields.get('created', 0)
+        self.modified = fields.get('modified')
+        # positions of the videos of the snapshot, None for an older one numbering them in order
+        self._runs = fields.get('positions')
+        self._next_position = fields.get('next_position')
+
+    @property
+    def next_position(self):
+        """Return the position of the next video added to the library."""
+        if self._next_position is None:
+            self._next_position = sum(1 for event in self._events() if event[0] == "video")
+        return self._next_position+len(self._added)
+
+    @property
+    def etag(self):
+        """Return an entity tag changing with every change to the library, or to its successor."""
+        return f"{self.created:x}-{self.version}"
+
+    def _events(self):
+        """Walk the snapshot from its start, see iter_library."""
+        return iter_library(_reader(self._file, self._chunk_size))
+
+    def _slots(self, start=0):
+        """Iterate over the (position, video) slots of the library from a position, None for a removed video."""
+        positions = itertools.count() if self._runs is None else expand_runs(self._runs)
+        count = 0
+        for event in self._events():
+            if event[0] == "video":
+                position = next(positions)
+                if position >= start:
+                    # the changed videos are never dropped, a lookup needs no mutex
+                    yield position, self._changed.get(event[1]['title'], event[1])
+                count += 1
+        base = count if self._next_position is None else self._next_position
+        for index in range(max(0, start-base), len(self._added)):
+            yield base+index, self._added[index]
+
+    def apply(self, record):
+        """Apply a change record of the log to the library, or a batch of them."""
+        with self._mutex:
+            self._apply(record)
+
+    def _apply(self, record):
+        if record['op'] == "batch":
+            for change in record['records']:
+                self._apply(change)
+            return
+        if record['op'] == "add":
+            self._added.append(record['video'])
+            self._current[record['video']['title']] = ("added", len(self._added)-1)
+            if self._count is not None:
+                self._count += 1
+        elif record['op'] == "replace":
+            slot = self._current.pop(record['title'], ("snapshot", record['title']))
+            self._set(slot, record['video'])
+            self._current[record['video']['title']] = slot
+        elif record['op'] == "remove":
+            self._set(self._current.pop(record['title'], ("snapshot", record['title'])), None)
+            if self._count is not None:
+                self._count -= 1
+        self.last_modify = record['last_modify']
+        self.version = record['version']
+        self.modified = record.get('modified', self.modified)
+
+    def _set(self, slot, video):
+        if slot[0] == "added":
+            self._added[slot[1]] = video
+        else:
+            self._changed[slot[1]] = video
+
+    def _current_video(self, title):
+        slot = self._current[title]
+        return self._added[slot[1]] if slot[0] == "added" else self._changed[slot[1]]
+
+    def _changed_video(self, title):
+        """
+        Look a title up among the changes of the log.
+
+        :return: whether the log settles the title, and its video, None if the
+            snapshot video of this title was renamed or removed
+        """
+        with self._mutex:
+            if title in self._current:
+                return True, self._current_video(title)
+            return title in self._changed, None
+
+    def to_dict(self):
+        """Return the content of the video library as stored in its file."""
+        return {"owner": self.owner, "last_modify": self.last_modify, "videos": list(self.videos())}
+
+    def copy(self):
+        """Return a copy of the library that the changes applied to this one leave as it is."""
+        with self._mutex:
+            library = copy.copy(self)
+            library._changed = dict(self._changed)
+            library._added = list(self._added)
+            library._current = dict(self._current)
+        library._mutex = threading.Lock()
+        return library
+
+    def changes(self, since):
+        """Return the change records applied after a version, see ChangeFeed.since."""
+        return self.feed.since(since, self.version)
+
+    def set_length(self, count):
+        """Set the number of videos of the library when known elsewhere, sparing a walk to count them."""
+        self._count = count
+
+    def __len__(self):
+        if self._count is None:
+            self._count = sum(1 for _ in self.videos())
+        return self._count
+
+    def __contains__(self, title):
+        return self.get(title) is not None
+
+    def find(self, titles):
+        """Return the set of the given titles that belong to videos of the library."""
+        titles = set(titles)
+        with self._mutex:
+            found = {title for title in titles if title in self._current}
+            wanted = {title for title in titles if title not in self._current and title not in self._changed}
+        if wanted:
+            for event in self._events():
+                if event[0] == "video" and event[1]['title'] in wanted:
+                    found.add(event[1]['title'])
+        return found
+
+    def videos(self):
+        """Iterate over the videos of the library in insertion order."""
+        return (video for _, video in self._slots() if video is not None)
+
+    def positions(self):
+        """Return the positions of the videos of the library, in insertion order."""
+        return [position for position, video in self._slots() if video is not None]
+
+    def page(self, cursor, limit):
+        """
+        Return a page of videos in insertion order, see Library.page.
+
+        :return: the videos of the page and the cursor of the next page, or None
+        """
+        page = []
+        for position, video in self._slots(cursor):
+            if len(page) == limit:
+                return page, position
+            if video is not None:
+                page.append(video)
+        return page, None
+
+    def get(self, title):
+        """Return the video with the given title, or None."""
+        changed, video = self._changed_video(title)
+        if changed:
+            return video
+        for event in self._events():
+            if event[0] == "video" and event[1]['title'] == title:
+                return event[1]
+        return None
+
+    def search_title(self, name):
+        """Return the videos whose title contains the name, in library order."""
+        query = name.lower()
+        return [video for video in self.videos() if query in video['title'].lower()]
+
+    def search_actor(self, name):
+        """Return the videos with an actor whose name or surname contains the name, in library order."""
+        query = name.lower()
+        return [
+            video for video in self.videos()
+            if any(query in info.lower() for actor in video['actors'] for info in (actor["name"], actor["surname"]))]
+
+    def stats(self, top):
+        """Summarize the aggregates of the videos, computed by a walk of the library, see VideoStats.summary."""
+        return VideoStats(self.videos()).summary(top)
+
+class SharedLibrary(StreamedLibrary):
+    """
+    Video library read from the image of its snapshot shared by the workers
+    of the host, see LibraryImage.
+
+    Like for a streamed library, the changes of the log are kept aside by
+    each worker and applied to the videos on the fly. The videos of the image
+    are reached directly by their position or by their title, and searched
+    in its lowercased texts, so a query only decodes the videos it returns.
+
+    The aggregates of the videos are read from the image on first use, then
+    follow the changes like those of a resident library, see VideoStats.
+    """
+
+    def __init__(self, image):
+        self._image = image
+        self._count = image.count
+        self._changed = {}
+        self._added = []
+        self._current = {}
+        # aggregates of the videos, read on first use
+        self._stats = None
+        self._mutex = threading.Lock()
+        self.feed = ChangeFeed()
+        self._set_fields(image.fields)
+
+    def copy(self):
+        """Return a copy of the library that the changes applied to this one leave as it is."""
+        library = super().copy()
+        library._stats = None
+        return library
+
+    def _apply(self, record):
+        if self._stats is not None and record['op'] != "batch":
+            # the aggregates follow the change, each video of the title is replaced or removed
+            replaced = [] if record['op'] == "add" else self._videos_titled(record['title'])
+            for video in replaced:
+                self._stats.remove(video)
+            for video in [record['video']] if record['op'] == "add" else [record.get('video')]*len(replaced):
+                if video is not None:
+                    self._stats.add(video)
+        super()._apply(record)
+
+    def _videos_titled(self, title):
+        """Return the current videos with the given title, under the mutex."""
+        if title in self._current:
+            slot = self._current[title]
+            if slot[0] == "added":
+                return [self._added[slot[1]]]
+            # all the videos of the image with the original title were changed
+            return [self._changed[slot[1]]]*len(self._image.find_all(slot[1]))
+        if title in self._changed:
+            return []
+        return [self._image.video(position) for position in self._image.find_all(title)]
+
+    def _snapshot_video(self, position):
+        """Return the video of the image at a position, as changed by the log."""
+        video = self._image.video(position)
+        return self._changed.get(video['title'], video)
+
+    def _slots(self, start=0):
+        """Iterate over the (position, video) slots of the library from a position, None for a removed video."""
+        positions = self._image.library_positions
+        for slot in range(bisect.bisect_left(positions, start), self._image.count):
+            yield positions[slot], self._snapshot_video(slot)
+        for index in range(max(0, start-self._next_position), len(self._added)):
+            yield self._next_position+index, self._added[index]
+
+    def positions(self):
+        """Return the positions of the videos of the library, in insertion order."""
+        with self._mutex:
+            removed = {
+                slot for title, video in self._changed.items() if video is None for slot in self._image.find_all(title)}
+            added = [index for index, video in enumerate(self._added) if video is not None]
+        positions = self._image.library_positions
+        return [positions[slot] for slot in range(self._image.count) if slot not in removed]+[
+            self._next_position+index for index in added]
+
+    def find(self, titles):
+        """Return the set of the given titles that belong to videos of the library."""
+        titles = set(titles)
+        with self._mutex:
+            found = {title for title in titles if title in self._current}
+            wanted = {title for title in titles if title not in self._current and title not in self._changed}
+        return found | {title for title in wanted if self._image.find(title) is not None}
+
+    def get(self, title):
+        """Return the video with the given title, or None."""
+        changed, video = self._changed_video(title)
+        if changed:
+            return video
+        position = self._image.find(title)
+        return None if position is None else self._image.video(position)
+
+    def search_title(self, name):
+        """Return the videos whose title contains the name, in library order."""
+        query = name.lower()
+        return self._search(name, self._image.search_titles(name), lambda video: query in video['title'].lower())
+
+    def search_actor(self, name):
+        """Return the videos with an actor whose name or surname contains the name, in library order."""
+        query = name.lower()
+        return self._search(name, self._image.search_actors(name), lambda video: any(
+            query in info.lower() for actor in video['actors'] for info in (actor["name"], actor["surname"])))
+
+    def _search(self, name, positions, matches):
+        """
+        Complete the results of a search in the image with the matches among
+        the videos changed or added by the log.
+        """
+        # the empty name also matches the videos without actors, and a name
+        # holding a separator may match across two texts of the image
+        verify = not name or any(separator in name for separator in SEPARATORS)
+        with self._mutex:
+            changed, added = dict(self._changed), list(self._added)
+        found = []
+        for position in positions:
+            video = self._image.video(position)
+            if video['title'] not in changed and (not verify or matches(video)):
+                found.append((position, video))
+        for title, video in changed.items():
+            if video is not None and matches(video):
+                found.append((self._image.find(title), video))
+        found.sort(key=lambda match: match[0])
+        return [video for _, video in found]+[video for video in added if video is not None and matches(video)]
+
+    def stats(self, top):
+        """Summarize the aggregates of the videos, see VideoStats.summary."""
+        with self._mutex:
+            if self._stats is None:
+                stats = self._image.stats()
+                for title, video in self._changed.items():
+                    for position in self._image.find_all(title):
+                        stats.remove(self._image.video(position))
+                        if video is not None:
+                            stats.add(video)
+                for video in self._added:
+                    if video is not None:
+                        stats.add(video)
+                self._stats = stats
+            return self._stats.summary(top)
+
+class LibraryStore:
+    """
+    Store the video libraries as a JSON snapshot plus an append-only log.
+
+    Each change to a library is appended as one JSON line to ``<library>.log``
+    and synced to disk, so the cost of a write does not depend on the size of
+    the library. Once the log outgrows its budget it is folded into the
+    ``<library>.json`` snapshot by a background thread; the snapshot is written
+    aside and atomically renamed over the previous one, and records already
+    contained in the snapshot are recognized by their version and skipped.
+    The log still keeps the records of the most recent changes folded into the
+    snapshot, up to a number of changes, for the change feed.
+
+    The snapshots may be compressed with gzip or zstd, recognized by their
+    magic number whatever the configured compression, which only applies to
+    the snapshots written from then on; the logs are never compressed.
+
+    The libraries are kept resident in memory. Before being served, a cached
+    library is revalidated with a stat of its snapshot (inode, size and
+    modification time) and of its log: records appended to the log by another
+    worker are replayed from the last known offset, any other change reloads
+    the library. The least recently used libraries are evicted once the total
+    size of their files, the content of a compressed snapshot counting for its
+    decompressed size, exceeds the byte budget.
+
+    With a shared folder, on a file system in memory such as /dev/shm, the
+    snapshot of a library is not decoded by each worker: the first one to
+    need it writes its image to the folder, and all the workers of the host
+    map the same image, see SharedLibrary. The image is stamped with the
+    signature of its snapshot, and written again once the snapshot changes.
+
+    A library whose files outgrow a size threshold is never loaded in memory,
+    it is read one video at a time from its snapshot instead, see
+    StreamedLibrary.
+
+    The libraries are listed from a manifest kept up to date by the writers,
+    see Catalog, instead of a scan of the database folder. The folder is only
+    scanned again when it changes, to catch the library files added or
+    removed underneath the store, and the manifest is rebuilt when missing.
+
+    The writers of a library are serialized across the threads of a worker by
+    a lock, and across the workers by an exclusive ``flock`` on its
+    ``<library>.lock`` file, while the writers of different libraries never
+    wait for each other. The lock file is kept when the library is deleted, as
+    other workers may be waiting on it.
+    """
+
+    def __init__(self, database, max_bytes, log_max_bytes, stream_bytes=float("inf"), shared=None, history=1000,
+                 compression=None):
+        self.database = database
+        self.max_bytes = max_bytes
+        self.log_max_bytes = log_max_bytes
+        self.stream_bytes = stream_bytes
+        self.history = history
+        if compression is not None:
+            # fail now rather than at the first compaction
+            compressor(compression)
+        self.compression = compression
+        self.shared = None
+        if shared is not None:
+            # the stores of several databases may share the folder
+            self.shared = os.path.join(shared, "video-libraries-"+hashlib.md5(os.path.abspath(database).encode()).hexdigest())
+            os.makedirs(self.shared, exist_ok=True)
+        self._cache = OrderedDict()
+        self._size = 0
+        # the size counted against the budget for each cached library
+        self._sizes = {}
+        # the size of the content of the snapshot of each library, by the signature of its file
+        self._content_sizes = {}
+        self._lock = threading.Lock()
+        self._writers = {}
+        self._held = {}
+        self._compacting = set()
+        self._catalog = Catalog(os.path.join(database, ".catalog"))
+        # modification time of the database folder at its last scan
+        self._folder_modified = None
+
+    def path(self, library):
+        """Return the path of the snapshot file of a video library."""
+        return os.path.join(self.database, library)+".json"
+
+    def log_path(self, library):
+        """Return the path of the log file of a video library."""
+        return os.path.join(self.database, library)+".log"
+
+    def image_path(self, library):
+        """Return the path of the shared image of the snapshot of a video library."""
+        return os.path.join(self.shared, library)+".image"
+
+    def _signature(self, library):
+        """
+        Stat the snapshot file of a video library.
+
+        :return: the (inode, size, modification time) triplet of the file
+        :raise LibraryNotFound: if the file does not exist
+        """
+        try:
+            st = os.stat(self.path(library))
+        except FileNotFoundError as e:
+            raise LibraryNotFound(library) from e
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _log_stat(self, library):
+        """
+        Stat the log file of a video library.
+
+        :return: the (inode, size) pair of the file, None if there is no log
+        """
+        try:
+            st = os.stat(self.log_path(library))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size)
+
+    def lock_path(self, library):
+        """Return the path of the lock file of a video library."""
+        return os.path.join(self.database, library)+".lock"
+
+    def _writer(self, library):
+        """Return the lock serializing the writers of a video library in this process."""
+        with self._lock:
+            return self._writers.setdefault(library, threading.RLock())
+
+    @contextmanager
+    def lock(self, library, create=False):
+        """
+        Hold the exclusive write access to a video library, in this worker and
+        in the others. The lock is reentrant within a thread.
+
+        :param create: whether the video library may not exist yet
+        :raise LibraryNotFound: if the video library does not exist
+        :raise OSError: if the lock file cannot be opened
+        """
+        if not create:
+            # never leave lock files behind for libraries that do not exist
+            self._signature(library)
+        with self._writer(library):
+            depth, file = self._held.get(library, (0, None))
+            if depth == 0:
+                file = open(self.lock_path(library), "a")
+                try:
+                    fcntl.flock(file, fcntl.LOCK_EX)
+                except OSError:
+                    file.close()
+                    raise
+            self._held[library] = (depth+1, file)
+            try:
+                yield
+            finally:
+                if depth == 0:
+                    del self._held[library]
+                    # closing the file releases the flock
+                    file.close()
+                else:
+                    self._held[library] = (depth, file)
+
+    def libraries(self):
+        """
+        List the video libraries of the database folder.
+
+        :return: the names of the video libraries
+        """
+        self._refresh_catalog()
+        return self._catalog.names()
+
+    def catalog(self, prefix="", cursor=None, limit=None):
+        """
+        List the video libraries with their owner, number of videos, version
+        and modification time, in the order of their names.
+
+        :param prefix: the prefix of the names of the listed libraries
+        :param cursor: the name from which to list them, returned by the previous page
+        :param limit: the maximum number of libraries, None for all of them
+        :return: the entries of the page and the cursor of the next page, or None
+        """
+        self._refresh_catalog()
+        return self._catalog.entries(prefix, cursor, limit)
+
+    def _refresh_catalog(self):
+        """Bring the manifest up to date, reconciling it with the folder if the folder changed."""
+        replaced = self._catalog.refresh()
+        modified = os.stat(self.database).st_mtime_ns
+        if replaced or modified != self._folder_modified:
+            self._folder_modified = modified
+            self._reconcile()
+
+    def _reconcile(self):
+        """Add the libraries missing from the manifest and drop the ones whose snapshot disappeared."""
+        with os.scandir(self.database) as entries:
+            # the type of the entries comes with the listing, without a stat of each file
+            found = {entry.name[:-5] for entry in entries if entry.name.endswith(".json") and entry.is_file()}
+        known = set(self._catalog.names())
+        for library in found-known:
+            try:
+                with self.lock(library):
+                    # another worker may have described it meanwhile
+                    self._catalog.refresh()
+                    if self._catalog.get(library) is None:
+                        self._record(library, self.load(library))
+            except (LibraryNotFound, OSError, ValueError):
+                # a malformed library is left out until the folder changes again
+                pass
+        for library in known-found:
+            # the lock file of a library is kept after its deletion
+            with self.lock(library, create=True):
+                if not os.path.exists(self.path(library)):
+                    self._catalog.drop(library)
+
+    def _count_from_catalog(self, library, content):
+        """Take the number of videos of a streamed library from the manifest, if it has its version."""
+        self._catalog.refresh()
+        entry = self._catalog.get(library)
+        if entry is not None and entry['version'] == content.version:
+            content.set_length(entry['videos'])
+
+    def _record(self, library, content):
+        """Record the current state of a video library in the manifest."""
+        self._catalog.put(library, content.owner, len(content), content.version, content.modified)
+
+    def libraries_modified(self):
+        """Return the time of the last creation or deletion of a video library."""
+        # the folder is modified whenever a library is created or deleted
+        return os.stat(self.database).st_mtime
+
+    def load(self, library):
+        """
+        Retrieve a video library, from memory when the cached copy is still up
+        to date with its files.
+
+        :return: the video library
+        :raise LibraryNotFound: if the video library does not exist
+        :raise OSError: if an error occurs while reading the files
+        :raise json.decoder.JSONDecodeError: if the snapshot is malformed
+        """
+        return self._load(library)[3]
+
+    def _load(self, library):
+        """
+        Retrieve a video library with the state of its files.
+
+        :return: the (snapshot signature, log inode, log offset, library) entry
+        """
+        # a compaction by another worker between the reads of the snapshot and
+        # of the log shows up as a gap in the versions, read both again
+        for _ in range(2):
+            entry = self._read(library)
+            if entry is not None:
+                return entry
+        # the writers and the compactions wait for the last attempt, so that it settles
+        with self.lock(library):
+            entry = self._read(library)
+        if entry is None:
+            raise OSError(f"The video library {library} keeps changing while being read.")
+        return entry
+
+    def _read(self, library):
+        """
+        Read a video library from its files, or from its cached entry.
+
+        :return: the (snapshot signature, log inode, log offset, library) entry,
+            None if the files changed while being read
+        """
+        signature = self._signature(library)
+        log = self._log_stat(library)
+        with self._lock:
+            entry = self._cache.get(library)
+            if entry is not None and entry[0] == signature:
+                self._cache.move_to_end(library)
+                if (log is None and entry[1] is None) or (log is not None and log == entry[1:3]):
+                    CACHE_LOADS.inc(labels=("hit",))
+                    return entry
+        try:
+            if entry is not None and entry[0] == signature and log is not None and log[0] == entry[1] and log[1] > entry[2]:
+                # the log only grew, replay its new records on the cached library
+                CACHE_LOADS.inc(labels=("replay",))
+                with self._writer(library):
+                    entry = self._cache.get(library, entry)
+                    offset = self._replay(library, entry[3], entry[2])
+                    entry = (signature, log[0], offset, entry[3])
+            else:
+                if self._snapshot_size(library, signature)+(0 if log is None else log[1]) > self.stream_bytes:
+                    CACHE_LOADS.inc(labels=("stream",))
+                    content = StreamedLibrary(open(self.path(library), "rb"))
+                else:
+                    content = None if self.shared is None else self._map_image(library)
+                    if content is None:
+                        CACHE_LOADS.inc(labels=("miss",))
+                        with open(self.path(library), "rb") as file, PARSE_SECONDS.time(("snapshot",)):
+                            content = Library.from_file(file)
+                if content.modified is None:
+                    # a snapshot written by hand, or before the modification time was kept
+                    content.modified = signature[2]/1e9
+                offset = self._replay(library, content, 0)
+                if isinstance(content, StreamedLibrary):
+                    self._count_from_catalog(library, content)
+                entry = (signature, None if log is None else log[0], offset, content)
+        except _VersionGap:
+            self.discard(library)
+            return None
+        except ValueError:
+            # a log rewritten by a compaction in between is read from a stale offset
+            self.discard(library)
+            if self._signature(library) == signature:
+                raise
+            return None
+        if self._signature(library) != signature:
+            # the log was read after a compaction folded part of it into a newer snapshot
+            self.discard(library)
+            return None
+        self._remember(library, *entry)
+        return entry
+
+    def _snapshot_size(self, library, signature):
+        """
+        Return the size of the content of the snapshot of a video library, the
+        size of its file unless it is compressed, see content_size.
+        """
+        known = self._content_sizes.get(library)
+        if known is not None and known[0] == signature:
+            return known[1]
+        try:
+            with open(self.path(library), "rb") as file:
+                st = os.fstat(file.fileno())
+                if (st.st_ino, st.st_size, st.st_mtime_ns) != signature:
+                    # replaced in the meantime, the library will be read again
+                    return signature[1]
+                size = content_size(file.fileno(), st.st_size)
+        except FileNotFoundError:
+            return signature[1]
+        self._content_sizes[library] = (signature, size)
+        return size
+
+    def _map_image(self, library):
+        """
+        Map the shared image of the snapshot of a video library, writing it
+        first if it is missing or stamped with another snapshot.
+
+        The shared folder is usually a small memory filesystem: an image that
+        cannot be written, for lack of space in particular, is dropped along
+        with the outdated one and the library is decoded by the worker instead.
+
+        :return: the video library, without the changes of its log, or None
+            if its image could not be written
+        """
+        path = self.image_path(library)
+        with open(self.path(library), "rb") as file:
+            # the image is stamped with the snapshot actually read
+            st = os.fstat(file.fileno())
+            signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+            image = _open_image(path)
+            if image is not None and image.signature == signature:
+                CACHE_LOADS.inc(labels=("shared",))
+                return SharedLibrary(image)
+            with open(path+".lock", "a") as lock:
+                # the other workers wait for the image instead of writing it too
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                image = _open_image(path)
+                if image is not None and image.signature == signature:
+                    CACHE_LOADS.inc(labels=("shared",))
+                    return SharedLibrary(image)
+                temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                try:
+                    with PARSE_SECONDS.time(("snapshot",)):
+                        write_image(temporary, _reader(file), signature)
+                    # mapped before it is published, in case another worker removes it meanwhile
+                    image = LibraryImage(temporary)
+                    os.replace(temporary, path)
+                except OSError:
+                    _remove(temporary)
+                    _remove(path)
+                    IMAGE_FAILURES.inc()
+                    logger.warning("The image of the video library %s could not be written.", library, exc_info=True)
+                    return None
+                except BaseException:
+                    _remove(temporary)
+                    raise
+                CACHE_LOADS.inc(labels=("miss",))
+                return SharedLibrary(image)
+
+    def _replay(self, library, content, offset):
+        """
+        Apply the records of the log of a video library from an offset.
+
+        A trailing line without its newline is a record still being written,
+        or torn by a crash, and is left out.
+
+        :return: the offset following the last complete record
+        :raise _VersionGap: if a record is missing between the library and the log
+        """
+        start = time.perf_counter()
+        try:
+            with open(self.log_path(library), "rb") as file:
+                file.seek(offset)
+                data = file.read()
+        except FileNotFoundError:
+            return offset
+        _count_read("log", len(data), start)
+        end = data.rfind(b"\n")+1
+        with PARSE_SECONDS.time(("log",)):
+            self._apply_records(library, content, data[:end])
+        return offset+end
+
+    def _apply_records(self, library, content, data):
+        """Apply complete log lines to a video library, and add them to its feed."""
+        for line in data.splitlines():
+            record = loads(line)
+            first, last = versions(record)
+            content.feed.append(first, last, line)
+            if last <= content.version:
+                # already folded into the snapshot
+                continue
+            if first != content.version+1:
+                raise _VersionGap(library)
+            content.apply(record)
+
+    def write(self, library, record):
+        """
+        Append a change record to the log of a video library and apply it to
+        the library kept in memory.
+
+        The version of the record is set from the version of the library, and
+        its modification time from the clock.
+
+        :raise LibraryNotFound: if the video library does not exist
+        :raise OSError: if an error occurs when writing the log
+        """
+        self.write_many(library, [record])
+
+    def write_many(self, library, records):
+        """
+        Append change records to the log of a video library as a single
+        transaction, and apply them to the library kept in memory.
+
+        Several records are grouped into one batch record written as a single
+        line, so that a crash never leaves only part of them in the log.
+
+        :raise LibraryNotFound: if the video library does not exist
+        :raise OSError: if an error occurs when writing the log
+        """
+        if not records:
+            return
+        with self.lock(library):
+            signature, inode, offset, content = self._load(library)
+            modified = time.time()
+            for version, record in enumerate(records, content.version+1):
+                record['version'] = version
+                record['modified'] = modified
+            if len(records) == 1:
+                record = records[0]
+            else:
+                record = {"op": "batch", "records": records, "version": records[-1]['version']}
+            line = dumps(record)+b"\n"
+            start = time.perf_counter()
+            try:
+                with open(self.log_path(library), "ab") as file:
+                    # drop the torn tail left by a failed write, if any
+                    if file.tell() > offset:
+                        file.truncate(offset)
+                    file.write(line)
+                    file.flush()
+                    os.fsync(file.fileno())
+                    inode = os.fstat(file.fileno()).st_ino
+            except OSError:
+                self.discard(library)
+                raise
+            _count_write("log", len(line), start)
+            content.apply(record)
+            content.feed.append(records[0]['version'], record['version'], line[:-1])
+            self._remember(library, signature, inode, offset+len(line), content)
+            self._record(library, content)
+            compact = offset+len(line) > self.log_max_bytes and library not in self._compacting
+            if compact:
+                self._compacting.add(library)
+        if compact:
+            threading.Thread(target=self._compact, args=(library,), daemon=True).start()
+
+    def _compact(self, library):
+        """Fold the log of a video library into its snapshot, in the background."""
+        try:
+            self.compact(library)
+        except LibraryNotFound:
+            # deleted in the meantime
+            pass
+        except (OSError, ValueError):
+            # the log stays authoritative, the next write will try again
+            COMPACTION_FAILURES.inc()
+            logger.exception("The compaction of the video library %s failed.", library)
+        finally:
+            with self._writer(library):
+                self._compacting.discard(library)
+
+    def compact(self, library):
+        """
+        Fold the log of a video library into its snapshot.
+
+        The snapshot is written to a temporary file, synced and renamed over
+        the previous one; the log then only keeps the records appended since.
+        The compaction is abandoned if another one replaced the snapshot
+        meanwhile.
+
+        :raise LibraryNotFound: if the video library does not exist
+        :raise OSError: if an error occurs when writing the files
+        """
+        with self.lock(library):
+            signature, log_inode, _, content = self._load(library)
+            if log_inode is None:
+                # nothing to fold
+                return
+            version = content.version
+            head = {
+                "owner": content.owner, "last_modify": content.last_modify,
+                "version": version, "created": content.created, "modified": content.modified}
+            if isinstance(content, SharedLibrary):
+                # the image never changes, only the changes of the log are copied
+                content = content.copy()
+            if isinstance(content, StreamedLibrary):
+                # a streamed library belongs to this call
+                videos = content.videos()
+            else:
+                # a resident one keeps changing
+                videos = list(content.videos())
+                head.update(positions=position_runs(content.positions()), next_position=content.next_position)
+        # serialize outside of the lock, the writers may go on meanwhile
+        if "positions" not in head:
+            # a streamed library walks its snapshot for the positions
+            head.update(positions=position_runs(content.positions()), next_position=content.next_position)
+        temporary = f"{self.path(library)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        start = time.perf_counter()
+        chunks = _snapshot_chunks(head, videos)
+        size = _write_durably(temporary, chunks if self.compression is None else compress_snapshot(chunks, self.compression))
+        _count_write("snapshot", size, start)
+        with self.lock(library):
+            if self._signature(library) != signature:
+                os.remove(temporary)
+                return
+            content = self.load(library)
+            os.replace(temporary, self.path(library))
+            start = time.perf_counter()
+            with open(self.log_path(library), "rb") as file:
+                data = file.read()
+            _count_read("log", len(data), start)
+            # the most recent changes already folded are kept for the change feed,
+            # within half of the budget of the log so that the next compaction still waits
+            lines = [versions(loads(line))+(line,) for line in data[:data.rfind(b"\n")+1].splitlines()]
+            kept = b"".join(line+b"\n" for _, _, line in retained(lines, version, self.history, self.log_max_bytes//2))
+            content.feed.trim(version, self.history, self.log_max_bytes//2)
+            temporary = f"{self.log_path(library)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            start = time.perf_counter()
+            _write_durably(temporary, [kept])
+            _count_write("log", len(kept), start)
+            os.replace(temporary, self.log_path(library))
+            _sync_directory(self.database)
+            self._remember(library, self._signature(library), self._log_stat(library)[0], len(kept), content)
+
+    def create(self, library, content):
+        """
+        Create the snapshot file of a new video library, stamped with its
+        creation time.
+
+        :raise FileExistsError: if the video library already exists
+        :raise OSError: if an error occurs when creating the file
+        """
+        with self.lock(library, create=True):
+            if os.path.exists(self.path(library)):
+                raise FileExistsError(self.path(library))
+            modified = time.time()
+            data = dumps({
+                "owner": content['owner'], "last_modify": content['last_modify'],
+                "version": 0, "created": time.time_ns(), "modified": modified, "videos": content['videos']})
+            # the snapshot is written aside, so a crash never leaves a truncated one behind,
+            # and linked into place, which fails like an exclusive creation if it exists
+            temporary = f"{self.path(library)}.{os.getpid()}.{threading.get_ident()}.tmp"
+            start = time.perf_counter()
+            try:
+                size = _write_durably(
+                    temporary, [data] if self.compression is None else compress_snapshot([data], self.compression))
+                _count_write("snapshot", size, start)
+                os.link(temporary, self.path(library))
+            finally:
+                _remove(temporary)
+            # a log left behind by a deletion cut short belongs to the previous library
+            _remove(self.log_path(library))
+            _sync_directory(self.database)
+            self.discard(library)
+            self._catalog.put(library, content['owner'], len(content['videos']), 0, modified)
+
+    def delete(self, library):
+        """
+        Delete the files of a video library.
+
+        :raise LibraryNotFound: if the video library does not exist
+        """
+        with self.lock(library):
+            try:
+                os.remove(self.path(library))
+            except FileNotFoundError as e:
+                raise LibraryNotFound(library) from e
+            try:
+                os.remove(self.log_path(library))
+            except FileNotFoundError:
+                pass
+            if self.shared is not None:
+                _remove(self.image_path(library))
+            self.discard(library)
+            self._content_sizes.pop(library, None)
+            self._catalog.drop(library)
+
+    def sizes(self):
+        """
+        Count the videos of the video libraries kept in memory.
+
+        :return: the number of videos by video library
+        """
+        with self._lock:
+            return {library: len(entry[3]) for library, entry in self._cache.items()}
+
+    def discard(self, library):
+        """Drop a video library from memory."""
+        with self._lock:
+            if self._cache.pop(library, None) is not None:
+                self._size -= self._sizes.pop(library)
+
+    def _remember(self, library, signature, log_inode, offset, content):
+        """Cache a video library and evict the least recently used ones over budget."""
+        size = self._snapshot_size(library, signature)+offset
+        with self._lock:
+            if self._cache.pop(library, None) is not None:
+                self._size -= self._sizes.pop(library)
+            # a library larger than the whole budget is never kept, nor a streamed one
+            if size > self.max_bytes or type(content) is StreamedLibrary:
+                return
+            self._cache[library] = (signature, log_inode, offset, content)
+            self._sizes[library] = size
+            self._size += size
+            evicted = []
+            while self._size > self.max_bytes:
+                evicted.append(self._cache.popitem(last=False)[0])
+                self._size -= self._sizes.pop(evicted[-1])
+        if self.shared is not None:
+            # the memory of an image is given back once the workers still mapping it drop it too
+            for library in evicted:
+                _remove(self.image_path(library))
+
+def _open_image(path):
+    """Map an image, None if it is missing or unreadable."""
+    try:
+        return LibraryImage(path)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class _VersionGap(Exception):
+    """Raised when the log of a video library does not follow its snapshot."""
+
+def _reader(file, chunk_size=64*1024):
+    """
+    Return a function reading the chunks of a snapshot from its start, each
+    call at its own offset so that several readers can share the file. A
+    compressed snapshot is decompressed on the way.
+    """
+    fd = file.fileno()
+    offset = 0
+
+    def read():
+        nonlocal offset
+        start = time.perf_counter()
+        chunk = os.pread(fd, chunk_size, offset)
+        offset += len(chunk)
+        _count_read("snapshot", len(chunk), start)
+        return chunk
+    return decompressing(read)
+
+def _count_read(file, size, start):
+    FILE_READ_BYTES.inc(size, (file,))
+    FILE_READ_SECONDS.inc(time.perf_counter()-start, (file,))
+
+def _count_write(file, size, start):
+    FILE_WRITE_BYTES.inc(size, (file,))
+    FILE_WRITE_SECONDS.inc(time.perf_counter()-start, (file,))
+
+def _snapshot_chunks(head, videos, chunk_size=64*1024):
+    """
+    Serialize a snapshot a chunk at a time, with its bookkeeping ahead of the
+    videos so that a streamed read finds it without walking them.
+    """
+    buffer = [dumps(head)[:-1]+b',"videos":[']
+    size = len(buffer[0])
+    for i, video in enumerate(videos):
+        piece = (b"," if i else b"")+dumps(video)
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    buffer.append(b"]}")
+    yield b"".join(buffer)
+
+def _write_durably(path, chunks):
+    """
+    Write a file from chunks of bytes and sync its content to disk.
+
+    :return: the size of the file
+    """
+    size = 0
+    with open(path, "wb") as file:
+        for chunk in chunks:
+            file.write(chunk)
+            size += len(chunk)
+        file.flush()
+        os.fsync(file.fileno())
+    return size
+
+def _sync_directory(path):
+    """Sync a directory to disk so that the renames done inside are durable."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
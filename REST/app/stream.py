@@ -0,0 +1,95 @@
+import json
+import codecs
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+# the characters starting a number, and the ones that may follow a prefix of a number
+_NUMBER_START = "-0123456789"
+_NUMBER_PART = "0123456789.eE+-"
+
+class _Reader:
+    """Text buffer over a binary reading function, refilled on demand."""
+
+    def __init__(self, read):
+        self._read = read
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self):
+        """Read one more chunk, dropping the text already consumed."""
+        if self.eof:
+            raise json.decoder.JSONDecodeError("Unexpected end of document", self.buffer, len(self.buffer))
+        chunk = self._read()
+        self.eof = not chunk
+        self.buffer = self.buffer[self.position:]+self._decoder.decode(chunk, final=self.eof)
+        self.position = 0
+
+    def peek(self):
+        """Return the next character that is not a whitespace, without consuming it."""
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            self.fill()
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise json.decoder.JSONDecodeError(f"Expecting '{character}'", self.buffer, self.position)
+        self.position += 1
+
+    def value(self):
+        """Decode the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+            except json.decoder.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # a number at the end of the buffer, or cut after its dot or
+                # exponent, may go on in the next chunk
+                cut = self.buffer[self.position] in _NUMBER_START and (
+                    end == len(self.buffer) or self.buffer[end] in _NUMBER_PART)
+                if not cut or self.eof:
+                    self.position = end
+                    return value
+            self.fill()
+
+def iter_library(read):
+    """
+    Walk a video library document incrementally, keeping only one video in
+    memory at a time.
+
+    :param read: the function returning the next chunk of the document, or
+        an empty one at its end
+    :return: an iterator of ("field", name, value) events for the top-level
+        fields and of ("video", video) events for the items of the videos
+        array, in the order of the document
+    :raise json.decoder.JSONDecodeError: if the document is malformed
+    """
+    reader = _Reader(read)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        name = reader.value()
+        reader.expect(":")
+        if name == "videos" and reader.peek() == "[":
+            reader.expect("[")
+            if reader.peek() != "]":
+                while True:
+                    yield ("video", reader.value())
+                    if reader.peek() != ",":
+                        break
+                    reader.expect(",")
+            reader.expect("]")
+        else:
+            yield ("field", name, reader.value())
+        if reader.peek() != ",":
+            break
+        reader.expect(",")
+    reader.expect("}")
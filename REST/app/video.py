@@ -0,0 +1,86 @@
+from dataclasses import dataclass
+
+PERSON_FIELDS = ("name", "surname")
+VIDEO_FIELDS = ("title", "year", "director", "actors")
+_PERSON_KEYS = frozenset(PERSON_FIELDS)
+_VIDEO_KEYS = frozenset(VIDEO_FIELDS)
+
+@dataclass(frozen=True)
+class Person:
+    """
+    Director or actor of a video, shared by all the videos of a library in
+    which the same person appears.
+
+    Like the videos, a person can be read as the dictionary it was built
+    from, with person["name"] and person["surname"].
+    """
+
+    name: str
+    surname: str
+
+    def keys(self):
+        return PERSON_FIELDS
+
+    def __getitem__(self, field):
+        if field not in PERSON_FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+@dataclass
+class Video:
+    """
+    Compact form of a video held in memory.
+
+    A video takes a fraction of the memory of the nested dictionaries it was
+    decoded from: its actors are a tuple and its people are shared. It can
+    still be read as the dictionary, with video['title'],
+    video['actors'][0]['name'] or dict(video), and is serialized as it by
+    app.serialization.dumps.
+
+    Its fields are not slots: orjson serializes a dataclass with a __dict__
+    several times faster.
+    """
+
+    title: str
+    year: object
+    director: Person
+    actors: tuple
+
+    def keys(self):
+        return VIDEO_FIELDS
+
+    def __getitem__(self, field):
+        if field not in VIDEO_FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+def compact(video, people):
+    """
+    Return the compact form of a decoded video.
+
+    A video with other fields than the usual ones, or with malformed people,
+    is kept as it is so that nothing of it is lost.
+
+    :param people: the people already met, by name and surname, completed with the new ones
+    :return: the Video, or the video itself
+    """
+    if not isinstance(video, dict) or video.keys() != _VIDEO_KEYS or not isinstance(video['actors'], list):
+        return video
+    director = _person(video['director'], people)
+    actors = tuple(_person(actor, people) for actor in video['actors'])
+    if director is None or None in actors:
+        return video
+    return Video(video['title'], video['year'], director, actors)
+
+def _person(person, people):
+    if not isinstance(person, dict) or person.keys() != _PERSON_KEYS:
+        return None
+    key = (person['name'], person['surname'])
+    try:
+        return people[key]
+    except KeyError:
+        people[key] = Person(*key)
+        return people[key]
+    except TypeError:
+        # names that are not strings cannot be shared
+        return None
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pytest
+
+# the service is the ``app`` package of the REST folder, next to the ``common`` package of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.main import app as flask_app
+
+@pytest.fixture
+def database(tmp_path):
+    """Return an empty database folder."""
+    path = tmp_path/"database"
+    path.mkdir()
+    return str(path)
+
+@pytest.fixture
+def shared(tmp_path):
+    """Return an empty folder for the shared images."""
+    path = tmp_path/"shared"
+    path.mkdir()
+    return str(path)
+
+@pytest.fixture
+def app(database, shared):
+    """Return the REST application on an empty database, with its caches reset."""
+    config = dict(flask_app.config)
+    flask_app.config.update(DATABASE=database, LIBRARY_SHARED_DIR=shared, STORAGE="json")
+    flask_app.extensions.pop("library_store", None)
+    flask_app.extensions.pop("body_cache", None)
+    yield flask_app
+    flask_app.config.clear()
+    flask_app.config.update(config)
+    flask_app.extensions.pop("library_store", None)
+    flask_app.extensions.pop("body_cache", None)
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def make_video(title, year=2000, actors=(("Jane", "Doe"),)):
+    """Build the payload of a video."""
+    return {
+        "title": title, "year": year, "director": {"name": "John", "surname": "Smith"},
+        "actors": [{"name": name, "surname": surname} for name, surname in actors]}
+
+def add(title, **kwargs):
+    """Build the record adding a video."""
+    return {"op": "add", "video": make_video(title, **kwargs), "last_modify": "01/01/2024"}
+
+def create(store, library, videos=()):
+    """Create a video library in a store."""
+    store.create(library, {"owner": {"name": "Ann", "surname": "Lee"}, "last_modify": "01/01/2024", "videos": list(videos)})
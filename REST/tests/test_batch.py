@@ -0,0 +1,75 @@
+import pytest
+
+from app.serialization import dumps
+from app.serialization import loads
+from conftest import make_video
+
+@pytest.fixture(params=["json", "sqlite"])
+def client(request, app, tmp_path):
+    app.config.update(STORAGE=request.param, SQLITE_DATABASE=str(tmp_path/"library.sqlite"))
+    client = app.test_client()
+    assert client.post("/library/lib", json={"name": "lib", "owner": {"name": "Ann", "surname": "Lee"}}).status_code == 201
+    return client
+
+def statuses(response):
+    assert response.status_code == 200
+    return [(result['index'], result['title'], result['status']) for result in loads(response.data)]
+
+def export(client):
+    response = client.get("/library/lib/videos")
+    assert response.mimetype == "application/x-ndjson"
+    return [loads(line) for line in response.data.splitlines()]
+
+def test_import(client):
+    response = client.post("/library/lib/videos", json=[
+        make_video("A"), make_video("B"), make_video("A"), {"title": "C"}, "D", make_video("", year=1999)])
+    assert statuses(response) == [(0, "A", 201), (1, "B", 201), (2, "A", 409), (3, None, 400), (4, None, 400), (5, None, 400)]
+    assert loads(response.data)[3]['error'] == "The video is malformed."
+    assert loads(response.data)[5]['error'] == "Title is required."
+    assert export(client) == [make_video("A"), make_video("B")]
+    # the videos already in the library conflict as well
+    assert statuses(client.post("/library/lib/videos", json=[make_video("B"), make_video("C")])) == [(0, "B", 409), (1, "C", 201)]
+
+def test_import_ndjson(client):
+    body = dumps(make_video("A"))+b"\n\n{not json\n"+dumps(make_video("B"))+b"\n"
+    response = client.post("/library/lib/videos", data=body, content_type="application/x-ndjson")
+    assert statuses(response) == [(0, "A", 201), (1, None, 400), (2, "B", 201)]
+    assert [video['title'] for video in export(client)] == ["A", "B"]
+
+def test_update_and_delete(client):
+    client.post("/library/lib/videos", json=[make_video(title) for title in "ABC"])
+    response = client.put("/library/lib/videos", json=[make_video("A", year=1999), make_video("X"), [], make_video("C", year=1998)])
+    assert statuses(response) == [(0, "A", 204), (1, "X", 404), (2, None, 400), (3, "C", 204)]
+    response = client.delete("/library/lib/videos", json=["B", "B", "X", 3, ""])
+    assert statuses(response) == [(0, "B", 204), (1, "B", 404), (2, "X", 404), (3, None, 400), (4, None, 400)]
+    assert export(client) == [make_video("A", year=1999), make_video("C", year=1998)]
+
+def test_items_see_the_previous_ones(client):
+    client.post("/library/lib/videos", json=[make_video("A")])
+    assert statuses(client.delete("/library/lib/videos", json=["A"])) == [(0, "A", 204)]
+    # a title removed by a batch can be added again
+    assert statuses(client.post("/library/lib/videos", json=[make_video("A", year=1990), make_video("A")])) == [
+        (0, "A", 201), (1, "A", 409)]
+    assert export(client) == [make_video("A", year=1990)]
+
+@pytest.mark.parametrize("body", [b"{not json", b'{"title": "A"}', b'"A"'])
+def test_malformed_batch(client, body):
+    assert client.post("/library/lib/videos", data=body, content_type="application/json").status_code == 400
+    assert export(client) == []
+
+def test_missing_library(client):
+    assert client.post("/library/nope/videos", json=[make_video("A")]).status_code == 404
+    assert client.get("/library/nope/videos").status_code == 404
+
+def test_precondition(client):
+    etag = client.get("/library/lib/videos").headers["ETag"]
+    assert statuses(client.post("/library/lib/videos", json=[make_video("A")], headers={"If-Match": etag})) == [(0, "A", 201)]
+    assert client.post("/library/lib/videos", json=[make_video("B")], headers={"If-Match": etag}).status_code == 412
+    assert [video['title'] for video in export(client)] == ["A"]
+
+def test_export_revalidation(client):
+    client.post("/library/lib/videos", json=[make_video("A")])
+    etag = client.get("/library/lib/videos").headers["ETag"]
+    assert client.get("/library/lib/videos", headers={"If-None-Match": etag}).status_code == 304
+    client.post("/library/lib/videos", json=[make_video("B")])
+    assert client.get("/library/lib/videos", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,58 @@
+import pytest
+
+OWNER = {"name": "Ann", "surname": "Lee"}
+NAMES = ["alpha", "beta", "bravo", "brick", "charlie"]
+
+@pytest.fixture(params=["json", "sqlite"])
+def client(request, app, tmp_path):
+    app.config.update(STORAGE=request.param, SQLITE_DATABASE=str(tmp_path/"library.sqlite"))
+    client = app.test_client()
+    for name in reversed(NAMES):
+        assert client.post(f"/library/{name}", json={"name": name, "owner": OWNER}).status_code == 201
+    return client
+
+def pages(client, path, query):
+    """Follow the cursors of a listing, return its pages."""
+    pages, cursor = [], None
+    while True:
+        response = client.get(path, query_string=dict(query, **({} if cursor is None else {"cursor": cursor})))
+        assert response.status_code == 200
+        pages.append(response.json if path == "/library" else [entry['name'] for entry in response.json])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+@pytest.mark.parametrize("path", ["/library", "/stats"])
+def test_paging(client, path):
+    assert pages(client, path, {}) == [NAMES]
+    assert pages(client, path, {"limit": 2}) == [["alpha", "beta"], ["bravo", "brick"], ["charlie"]]
+    assert pages(client, path, {"limit": 5}) == [NAMES]
+
+@pytest.mark.parametrize("path", ["/library", "/stats"])
+def test_prefix(client, path):
+    assert pages(client, path, {"prefix": "b"}) == [["beta", "bravo", "brick"]]
+    assert pages(client, path, {"prefix": "br", "limit": 1}) == [["bravo"], ["brick"]]
+    assert pages(client, path, {"prefix": "d"}) == [[]]
+    # the cursor does not leave the prefix
+    assert pages(client, path, {"prefix": "b", "cursor": "a"}) == [["beta", "bravo", "brick"]]
+
+def test_listing_follows_the_libraries(client):
+    etag = client.get("/library?prefix=b").headers["ETag"]
+    assert client.get("/library?prefix=b", headers={"If-None-Match": etag}).status_code == 304
+    client.delete("/library/bravo")
+    response = client.get("/library?prefix=b", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.json == ["beta", "brick"]
+    client.post("/library/bob", json={"name": "bob", "owner": OWNER})
+    assert client.get("/library?prefix=b").json == ["beta", "bob", "brick"]
+
+@pytest.mark.parametrize("path", ["/library", "/stats"])
+@pytest.mark.parametrize("query", ["?limit=x", "?limit=0", "?limit=-2"])
+def test_arguments(client, path, query):
+    assert client.get(f"{path}{query}").status_code == 400
+
+def test_creation_errors(client):
+    assert client.post("/library/beta", json={"name": "beta", "owner": OWNER}).status_code == 409
+    assert client.post("/library/delta", json={"name": "delta", "owner": {"name": "", "surname": "Lee"}}).status_code == 400
+    assert client.post("/library/delta", data=b"{not json", content_type="application/json").status_code == 400
+    assert client.delete("/library/delta").status_code == 404
+    assert client.get("/library").json == NAMES
@@ -0,0 +1,98 @@
+import time
+import threading
+
+import pytest
+
+from app.serialization import loads
+from conftest import make_video
+
+@pytest.fixture(params=["json", "sqlite"])
+def client(request, app, tmp_path):
+    app.config.update(STORAGE=request.param, SQLITE_DATABASE=str(tmp_path/"library.sqlite"))
+    client = app.test_client()
+    response = client.post("/library/lib", json={"name": "lib", "owner": {"name": "Ann", "surname": "Lee"}})
+    assert response.status_code == 201
+    return client
+
+def version(client):
+    return int(client.get("/library/lib").headers["ETag"].strip('"').split("-")[1])
+
+def test_net_changes_since_a_version(client):
+    for title in "ABC":
+        assert client.post(f"/library/lib/video/{title}", json=make_video(title)).status_code == 201
+    assert client.put("/library/lib/video/A", json=make_video("A2", year=1999)).status_code == 204
+    assert client.delete("/library/lib/video/B").status_code == 204
+    assert client.post("/library/lib/video/D", json=make_video("D")).status_code == 201
+    assert client.delete("/library/lib/video/D").status_code == 204
+
+    changes = loads(client.get("/library/lib/changes?since=2").data)
+    assert changes['version'] == 7
+    assert [video['title'] for video in changes['added']] == ["C"]
+    assert changes['updated'] == [{"title": "A", "video": make_video("A2", year=1999)}]
+    assert changes['deleted'] == ["B"]
+    assert loads(client.get("/library/lib/changes?since=7").data)['added'] == []
+
+def test_since_an_entity_tag(client):
+    client.post("/library/lib/video/A", json=make_video("A"))
+    etag = client.get("/library/lib").headers["ETag"]
+    client.post("/library/lib/video/B", json=make_video("B"))
+    changes = loads(client.get("/library/lib/changes", query_string={"since": etag}).data)
+    assert [video['title'] for video in changes['added']] == ["B"]
+
+def test_recreated_library_is_gone(client, monkeypatch):
+    etag = client.get("/library/lib").headers["ETag"]
+    created = int(etag.strip('"').split("-")[0], 16)
+    assert client.delete("/library/lib").status_code == 204
+    # the clock may not have moved since the first creation
+    monkeypatch.setattr(time, "time_ns", lambda: created+1)
+    client.post("/library/lib", json={"name": "lib", "owner": {"name": "Ann", "surname": "Lee"}})
+    monkeypatch.undo()
+    # the creation time of the library tells the two apart, at the same version
+    assert client.get("/library/lib").headers["ETag"] == f'"{created+1:x}-0"'
+    assert client.get("/library/lib/changes", query_string={"since": etag}).status_code == 410
+    assert client.get("/library/lib/changes", query_string={"since": f'"{created+1:x}-0"'}).status_code == 200
+
+def test_future_version_is_gone(client):
+    assert client.get("/library/lib/changes?since=5").status_code == 410
+
+@pytest.mark.parametrize("since", ["", "x", "1.5", "-1", "-", "+1", "1_0", "x-1", "a-", "A-1", " 1"])
+def test_malformed_since(client, since):
+    assert client.get("/library/lib/changes", query_string={"since": since}).status_code == 400
+
+def test_missing_library(client):
+    assert client.get("/library/nope/changes?since=0").status_code == 404
+
+def test_history_retention(app, client):
+    app.config.update(CHANGES_HISTORY=5, LOG_COMPACT_SIZE=4000)
+    app.extensions.pop("library_store", None)
+    for i in range(40):
+        assert client.post(f"/library/lib/video/V{i}", json=make_video(f"V{i}")).status_code == 201
+    if app.config["STORAGE"] == "json":
+        # the background compactions are done once the store folded the log
+        app.extensions["library_store"].compact("lib")
+    current = version(client)
+    assert current == 40
+    # the changes beyond the history are no longer kept
+    assert client.get("/library/lib/changes?since=1").status_code == 410
+    changes = loads(client.get(f"/library/lib/changes?since={current-5}").data)
+    assert [video['title'] for video in changes['added']] == [f"V{i}" for i in range(35, 40)]
+
+def test_wait_for_the_next_change(client):
+    assert client.get("/library/lib/changes?since=0&wait=100").status_code == 400
+    response = client.get("/library/lib/changes?since=0&wait=0.1")
+    assert loads(response.data)['added'] == []
+
+def test_wait_is_woken_by_a_write(app, client):
+    def write():
+        time.sleep(0.2)
+        assert app.test_client().post("/library/lib/video/W", json=make_video("W")).status_code == 201
+
+    writer = threading.Thread(target=write)
+    start = time.monotonic()
+    writer.start()
+    response = client.get("/library/lib/changes?since=0&wait=20")
+    writer.join()
+    assert response.status_code == 200
+    assert [video['title'] for video in loads(response.data)['added']] == ["W"]
+    # answered by the change, long before the end of the wait
+    assert time.monotonic()-start < 10
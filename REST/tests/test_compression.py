@@ -0,0 +1,84 @@
+import os
+import gzip
+
+import pytest
+
+from app import compression
+from app.compression import compress_snapshot
+from app.compression import content_size
+from app.compression import decompressing
+from app.store import LibraryStore
+from conftest import add
+from conftest import create
+from conftest import make_video
+
+ENCODINGS = ["gzip", pytest.param("zstd", marks=pytest.mark.skipif(
+    compression.zstandard is None, reason="zstd needs the zstandard package"))]
+
+DATA = b"".join(b'{"title":"T%d","actors":[{"name":"N%d"}]},' % (i, i % 50) for i in range(5000))
+
+def reader(data, size):
+    """Return a function reading data by chunks of a given size."""
+    chunks = [data[i:i+size] for i in range(0, len(data), size)]
+    return lambda: chunks.pop(0) if chunks else b""
+
+def read_all(read):
+    chunks = []
+    while True:
+        chunk = read()
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+@pytest.mark.parametrize("size", [1, 7, 4096, 1 << 20])
+def test_snapshot_round_trip(encoding, size):
+    compressed = b"".join(compress_snapshot([DATA[i:i+1000] for i in range(0, len(DATA), 1000)], encoding))
+    assert len(compressed) < len(DATA)
+    assert read_all(decompressing(reader(compressed, size))) == DATA
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_content_size(encoding, tmp_path):
+    path = tmp_path/"snapshot"
+    path.write_bytes(b"".join(compress_snapshot([DATA], encoding)))
+    with open(path, "rb") as file:
+        assert content_size(file.fileno(), os.path.getsize(path)) == len(DATA)
+
+def test_plain_file_passes_through(tmp_path):
+    assert read_all(decompressing(reader(DATA, 3))) == DATA
+    path = tmp_path/"snapshot"
+    path.write_bytes(DATA)
+    with open(path, "rb") as file:
+        assert content_size(file.fileno(), len(DATA)) == len(DATA)
+
+def test_multiple_gzip_members():
+    compressed = gzip.compress(DATA[:1000])+gzip.compress(DATA[1000:])
+    assert read_all(decompressing(reader(compressed, 100))) == DATA
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+def test_truncated_or_corrupted(encoding):
+    compressed = b"".join(compress_snapshot([DATA], encoding))
+    for damaged in (compressed[:len(compressed)//2], compressed[:40]+b"x"*200+compressed[240:]):
+        with pytest.raises(OSError):
+            read_all(decompressing(reader(damaged, 4096)))
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+@pytest.mark.parametrize("mode", [{}, {"stream_bytes": 0}, {"shared": True}])
+def test_compressed_store(encoding, mode, database, shared):
+    if mode.get("shared"):
+        mode = {"shared": shared}
+    store = LibraryStore(database, 10**9, 10**9, compression=encoding, **mode)
+    create(store, "lib", [make_video("A")])
+    with open(os.path.join(database, "lib.json"), "rb") as file:
+        assert file.read(2) in (compression.GZIP_MAGIC, compression.ZSTD_MAGIC[:2])
+    store.write("lib", add("B"))
+    store.compact("lib")
+    store.write("lib", add("C"))
+    # a store writing plain snapshots still reads the compressed ones
+    content = LibraryStore(database, 10**9, 10**9, **mode).load("lib")
+    assert [video['title'] for video in content.videos()] == ["A", "B", "C"]
+    assert content.version == 2
+
+def test_unknown_compression(database):
+    with pytest.raises(ValueError):
+        LibraryStore(database, 10**9, 10**9, compression="brotli")
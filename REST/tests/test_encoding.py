@@ -0,0 +1,50 @@
+import gzip
+
+import pytest
+
+from app.serialization import loads
+from conftest import make_video
+
+@pytest.fixture
+def client(app):
+    app.config.update(RESPONSE_ENCODINGS=["gzip"])
+    client = app.test_client()
+    client.post("/library/lib", json={"name": "lib", "owner": {"name": "Ann", "surname": "Lee"}})
+    client.post("/library/lib/video/A", json=make_video("A"))
+    return client
+
+def get(client, path, encoding=None, etag=None):
+    headers = {}
+    if encoding is not None:
+        headers["Accept-Encoding"] = encoding
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    return client.get(path, headers=headers)
+
+@pytest.mark.parametrize("path", ["/library/lib", "/library/lib/stats", "/library/lib/by-actor/jane", "/search?name=a"])
+def test_each_coding_has_its_entity_tag(client, path):
+    plain, compressed = get(client, path), get(client, path, "gzip")
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert loads(gzip.decompress(compressed.data)) == loads(plain.data)
+    assert plain.headers["ETag"] != compressed.headers["ETag"]
+    # a copy is only up to date for the coding it was read with
+    assert get(client, path, etag=compressed.headers["ETag"]).status_code == 200
+    assert get(client, path, "gzip", etag=plain.headers["ETag"]).status_code == 200
+    for encoding, response in ((None, plain), ("gzip", compressed)):
+        unchanged = get(client, path, encoding, etag=response.headers["ETag"])
+        assert unchanged.status_code == 304
+        assert unchanged.headers["ETag"] == response.headers["ETag"]
+        assert "Accept-Encoding" in unchanged.headers["Vary"]
+
+def test_precondition_with_a_compressed_representation(client):
+    etag = get(client, "/library/lib", "gzip").headers["ETag"]
+    response = client.put("/library/lib/video/A", json=make_video("A", year=1999), headers={"If-Match": etag})
+    assert response.status_code == 204
+    response = client.put("/library/lib/video/A", json=make_video("A", year=1998), headers={"If-Match": etag})
+    assert response.status_code == 412
+
+def test_changes_since_a_compressed_representation(client):
+    etag = get(client, "/library/lib", "gzip").headers["ETag"]
+    client.post("/library/lib/video/B", json=make_video("B"))
+    changes = loads(client.get("/library/lib/changes", query_string={"since": etag}).data)
+    assert [video['title'] for video in changes['added']] == ["B"]
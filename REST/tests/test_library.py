@@ -0,0 +1,40 @@
+import pytest
+
+from app.serialization import loads
+from conftest import make_video
+
+OWNER = {"name": "Ann", "surname": "Lee"}
+
+@pytest.fixture(params=["resident", "streamed", "shared"])
+def client(request, app):
+    if request.param == "streamed":
+        app.config.update(LIBRARY_STREAM_SIZE=0)
+    elif request.param == "resident":
+        app.config.update(LIBRARY_SHARED_DIR=None)
+    app.config.update(STREAM_CHUNK_SIZE=256)
+    client = app.test_client()
+    assert client.post("/library/lib", json={"name": "lib", "owner": OWNER}).status_code == 201
+    return client
+
+@pytest.mark.parametrize("query", ["", "?format=ndjson"])
+def test_write_while_streaming(client, query):
+    client.post("/library/lib/videos", json=[make_video(f"V{i}") for i in range(200)])
+    response = client.get(f"/library/lib{query}", buffered=False)
+    etag = response.headers["ETag"]
+    chunks = response.response
+    body = [next(chunks)]
+    # a write lands while the body is being sent
+    assert client.post("/library/lib/video/W", json=make_video("W")).status_code == 201
+    assert client.delete("/library/lib/video/V150").status_code == 204
+    body.extend(chunks)
+    response.close()
+    body = b"".join(body)
+    if query:
+        videos = [loads(line) for line in body.splitlines()]
+    else:
+        videos = loads(body)['videos']
+    assert [video['title'] for video in videos] == [f"V{i}" for i in range(200)]
+    # the next read is not served the body of the previous version
+    response = client.get(f"/library/lib{query}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b'"W"' in response.data and b'"V150"' not in response.data
@@ -0,0 +1,81 @@
+import pytest
+import threading
+
+from app.store import Library
+from conftest import make_video
+
+def titles(videos):
+    return [video['title'] for video in videos]
+
+def record(version, op, **fields):
+    return dict(fields, op=op, version=version, last_modify="01/01/2024")
+
+def test_changes_during_the_build(monkeypatch):
+    library = Library(None, None, [make_video(f"Movie {i}", actors=((f"Name{i}", "Doe"),)) for i in range(20)])
+    started, release = threading.Event(), threading.Event()
+    add_to_search = Library._add_to_search
+
+    def held(titles, actors, video):
+        # the build waits until the changes below are applied
+        started.set()
+        release.wait()
+        add_to_search(titles, actors, video)
+
+    monkeypatch.setattr(Library, "_add_to_search", staticmethod(held))
+    # served by a scan while the indexes are being built
+    assert titles(library.search_title("movie 1")) == ["Movie 1"]+[f"Movie {i}" for i in range(10, 20)]
+    assert started.wait(5)
+    library.apply(record(1, "add", video=make_video("Movie 100", actors=(("Name3", "Roe"),))))
+    library.apply(record(2, "replace", title="Movie 1", video=make_video("Film 1")))
+    library.apply(record(3, "remove", title="Movie 12"))
+    assert titles(library.search_actor("name3")) == ["Movie 3", "Movie 100"]
+    monkeypatch.setattr(Library, "_add_to_search", staticmethod(add_to_search))
+    release.set()
+    for _ in range(500):
+        if library._titles is not None:
+            break
+        threading.Event().wait(0.01)
+    assert library._titles is not None
+
+    expected = Library(None, None, list(library.videos()))
+    for query in ("movie 1", "film", "movie", "100", "mov"):
+        assert titles(library.search_title(query)) == titles(expected.search_title(query))
+    for query in ("name3", "roe", "doe", "name1"):
+        assert titles(library.search_actor(query)) == titles(expected.search_actor(query))
+    assert titles(library.search_title("movie 1")) == [f"Movie {i}" for i in (10, 11, 13, 14, 15, 16, 17, 18, 19, 100)]
+
+def search_client(app):
+    client = app.test_client()
+    for library, videos in (("b", ["Star", "Start", "The Star"]), ("a", ["Lone Star", "Star", "Stars"])):
+        assert client.post(f"/library/{library}", json={"name": library, "owner": {"name": "Ann", "surname": "Lee"}}).status_code == 201
+        client.post(f"/library/{library}/videos", json=[make_video(title) for title in videos])
+    return client
+
+def test_search_ranking(app):
+    client = search_client(app)
+    response = client.get("/search?name=star")
+    assert response.status_code == 200
+    # the exact matches first, then the ones starting with the name, then by library and in library order
+    assert [(video['library'], video['title']) for video in response.json] == [
+        ("a", "Star"), ("b", "Star"), ("a", "Stars"), ("b", "Start"), ("a", "Lone Star"), ("b", "The Star")]
+    assert [video['title'] for video in client.get("/search?name=star&limit=3").json] == ["Star", "Star", "Stars"]
+    assert [video['library'] for video in client.get("/search?name=jane&type=actor&limit=2").json] == ["a", "a"]
+
+@pytest.mark.parametrize("query", ["", "?name=", "?name=star&type=director", "?name=star&limit=x",
+                                   "?name=star&limit=0", "?name=star&limit=-1", "?name=star&limit=1001"])
+def test_search_arguments(app, query):
+    assert search_client(app).get(f"/search{query}").status_code == 400
+
+def test_search_revalidation(app):
+    client = search_client(app)
+    etag = client.get("/search?name=star").headers["ETag"]
+    assert client.get("/search?name=star", headers={"If-None-Match": etag}).status_code == 304
+    # another search is another resource
+    assert client.get("/search?name=start", headers={"If-None-Match": etag}).status_code == 200
+    # a write to any library, or a new library, changes the results
+    client.post("/library/a/video/Starship", json=make_video("Starship"))
+    response = client.get("/search?name=star", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and "Starship" in [video['title'] for video in response.json]
+    etag = response.headers["ETag"]
+    client.post("/library/c", json={"name": "c", "owner": {"name": "Ann", "surname": "Lee"}})
+    assert client.get("/search?name=star", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,57 @@
+import pytest
+
+from conftest import make_video
+
+OWNER = {"name": "Ann", "surname": "Lee"}
+
+@pytest.fixture(params=["json", "sqlite"])
+def client(request, app, tmp_path):
+    app.config.update(STORAGE=request.param, SQLITE_DATABASE=str(tmp_path/"library.sqlite"))
+    client = app.test_client()
+    assert client.post("/library/lib", json={"name": "lib", "owner": OWNER}).status_code == 201
+    client.post("/library/lib/videos", json=[
+        make_video("A", year=1999, actors=(("Jane", "Doe"), ("Bob", "Roe"))), make_video("B", actors=(("Jane", "Doe"),)),
+        make_video("C", actors=(("Al", "Zed"),))])
+    return client
+
+def test_library_stats(client):
+    response = client.get("/library/lib/stats")
+    assert response.status_code == 200
+    assert response.json == {
+        "videos": 3, "years": {"1999": 1, "2000": 2},
+        "directors": [{"name": "John", "surname": "Smith", "videos": 3}],
+        # the ties broken by surname
+        "actors": [{"name": "Jane", "surname": "Doe", "videos": 2}, {"name": "Bob", "surname": "Roe", "videos": 1},
+                   {"name": "Al", "surname": "Zed", "videos": 1}]}
+    assert client.get("/library/lib/stats?top=1").json['actors'] == [{"name": "Jane", "surname": "Doe", "videos": 2}]
+    assert client.get("/library/lib/stats?top=0").json['actors'] == []
+
+def test_library_stats_follow_the_changes(client):
+    etag = client.get("/library/lib/stats").headers["ETag"]
+    assert client.get("/library/lib/stats", headers={"If-None-Match": etag}).status_code == 304
+    client.delete("/library/lib/video/A")
+    response = client.get("/library/lib/stats", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json['videos'] == 2 and response.json['years'] == {"2000": 2}
+
+@pytest.mark.parametrize("query", ["?top=x", "?top=-1", "?top=101"])
+def test_library_stats_arguments(client, query):
+    assert client.get(f"/library/lib/stats{query}").status_code == 400
+
+def test_missing_library_stats(client):
+    assert client.get("/library/nope/stats").status_code == 404
+
+def test_summary(client):
+    client.post("/library/other", json={"name": "other", "owner": {"name": "Bo", "surname": "Ng"}})
+    response = client.get("/stats")
+    assert response.status_code == 200
+    assert [(entry['name'], entry['owner'], entry['videos']) for entry in response.json] == [
+        ("lib", OWNER, 3), ("other", {"name": "Bo", "surname": "Ng"}, 0)]
+    etag = response.headers["ETag"]
+    assert client.get("/stats", headers={"If-None-Match": etag}).status_code == 304
+    # a write to a library changes its entry
+    client.post("/library/other/video/X", json=make_video("X"))
+    response = client.get("/stats", headers={"If-None-Match": etag})
+    assert response.status_code == 200 and response.json[1]['videos'] == 1
+    client.delete("/library/lib")
+    assert [entry['name'] for entry in client.get("/stats").json] == ["other"]
@@ -0,0 +1,315 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from app.stats import VideoStats
+from app import store as store_module
+from app.store import COMPACTION_FAILURES
+from app.store import IMAGE_FAILURES
+from app.store import Library
+from app.store import LibraryNotFound
+from app.store import LibraryStore
+from app.store import SharedLibrary
+from app.store import StreamedLibrary
+from conftest import add
+from conftest import create
+from conftest import make_video
+
+def titles(content):
+    return [video['title'] for video in content.videos()]
+
+@pytest.fixture(params=["resident", "streamed", "shared"])
+def open_store(request, database, shared):
+    """Return a function opening a store of the database in each way of holding the libraries."""
+    def open_store(log_max_bytes=10**9, **kwargs):
+        if request.param == "streamed":
+            kwargs.setdefault("stream_bytes", 0)
+        elif request.param == "shared":
+            kwargs.setdefault("shared", shared)
+        return LibraryStore(database, 10**9, log_max_bytes, **kwargs)
+    open_store.kind = {"resident": Library, "streamed": StreamedLibrary, "shared": SharedLibrary}[request.param]
+    return open_store
+
+def test_write_and_reload(open_store):
+    store = open_store()
+    create(store, "lib", [make_video("A")])
+    store.write("lib", add("B"))
+    store.write_many("lib", [add("C"), {"op": "remove", "title": "A", "last_modify": "02/01/2024"}])
+    store.write("lib", {"op": "replace", "title": "B", "video": make_video("D"), "last_modify": "03/01/2024"})
+    content = open_store().load("lib")
+    assert type(content) is open_store.kind
+    assert titles(content) == ["D", "C"]
+    assert content.version == 4
+    assert content.last_modify == "03/01/2024"
+
+def test_replay_skips_torn_tail(open_store, database):
+    store = open_store()
+    create(store, "lib")
+    for title in "ABC":
+        store.write("lib", add(title))
+    # a crash in the middle of an append leaves a line without its newline
+    with open(os.path.join(database, "lib.log"), "ab") as file:
+        file.write(b'{"op":"add","video":{"title":"X"')
+    other = open_store()
+    assert titles(other.load("lib")) == ["A", "B", "C"]
+    # the next write drops the torn tail
+    other.write("lib", add("D"))
+    content = open_store().load("lib")
+    assert titles(content) == ["A", "B", "C", "D"]
+    assert content.version == 4
+
+def test_compaction_alongside_writes(open_store):
+    store = open_store(log_max_bytes=2000)
+    create(store, "lib")
+    stop = threading.Event()
+
+    def compact():
+        while not stop.is_set():
+            store.compact("lib")
+
+    def write(prefix):
+        for i in range(50):
+            store.write("lib", add(f"{prefix}{i}"))
+
+    compactor = threading.Thread(target=compact)
+    compactor.start()
+    writers = [threading.Thread(target=write, args=(prefix,)) for prefix in "ABC"]
+    for thread in writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    compactor.join()
+    store.compact("lib")
+    content = open_store().load("lib")
+    assert content.version == 150
+    assert sorted(titles(content)) == sorted(f"{prefix}{i}" for prefix in "ABC" for i in range(50))
+    for prefix in "ABC":
+        # the writes of a thread keep their order
+        assert [title for title in titles(content) if title[0] == prefix] == [f"{prefix}{i}" for i in range(50)]
+
+def test_other_worker_follows_the_log(open_store):
+    writer, reader = open_store(), open_store()
+    create(writer, "lib")
+    writer.write("lib", add("A"))
+    assert titles(reader.load("lib")) == ["A"]
+    writer.write("lib", add("B"))
+    writer.compact("lib")
+    writer.write("lib", add("C"))
+    content = reader.load("lib")
+    assert titles(content) == ["A", "B", "C"]
+    assert content.version == 3
+
+def test_reload_after_version_gap(open_store):
+    # the compaction keeps none of the folded changes in the log
+    writer = open_store(history=0)
+    reader = open_store()
+    create(writer, "lib")
+    for title in "AB":
+        writer.write("lib", add(title))
+    replay = reader._replay
+    raced = []
+
+    def racing(library, content, offset):
+        # another worker compacts and writes between the reads of the snapshot and of the log
+        if not raced:
+            raced.append(True)
+            writer.compact(library)
+            writer.write(library, add("C"))
+        return replay(library, content, offset)
+
+    reader._replay = racing
+    content = reader.load("lib")
+    assert raced
+    assert titles(content) == ["A", "B", "C"]
+    assert content.version == 3
+
+def test_concurrent_readers_and_writers(open_store):
+    store = open_store(log_max_bytes=1500)
+    create(store, "lib")
+    errors = []
+    done = threading.Event()
+
+    def read():
+        reader = open_store()
+        while not done.is_set():
+            try:
+                content = reader.load("lib")
+                found = titles(content)
+                assert found == [f"V{i}" for i in range(len(found))]
+                assert len(found) == content.version
+            except Exception as e:
+                errors.append(e)
+                return
+
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for thread in readers:
+        thread.start()
+    for i in range(150):
+        store.write("lib", add(f"V{i}"))
+    done.set()
+    for thread in readers:
+        thread.join()
+    assert not errors
+
+def test_queries_while_changes_are_applied(open_store):
+    store = open_store()
+    create(store, "lib", [make_video(f"M{i}") for i in range(2000)])
+    content = store.load("lib")
+    errors = []
+    done = threading.Event()
+
+    def query():
+        try:
+            while not done.is_set():
+                content.search_title("m1")
+                content.search_actor("jane")
+                content.find(f"M{i}" for i in range(10))
+                content.get("M3")
+        except Exception as e:
+            errors.append(e)
+
+    interval = sys.getswitchinterval()
+    # switch threads as often as possible to interleave the queries with the changes
+    sys.setswitchinterval(1e-6)
+    try:
+        threads = [threading.Thread(target=query) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for i in range(2000):
+            if i % 2:
+                record = {"op": "remove", "title": f"M{i}"}
+            else:
+                record = {"op": "replace", "title": f"M{i}", "video": make_video(f"R{i}")}
+            content.apply(dict(record, last_modify="02/01/2024", version=i+1))
+        done.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert not errors
+    assert titles(content) == [f"R{i}" for i in range(0, 2000, 2)]
+
+def test_stats_follow_the_changes(open_store):
+    store = open_store()
+    create(store, "lib", [make_video(f"M{i}", year=1990+i % 4, actors=((f"N{i % 5}", "Doe"), ("Jo", "Roe")))
+                          for i in range(10)])
+    store.load("lib").stats(3)
+    store.write("lib", add("A", year=1980, actors=(("N1", "Doe"),)))
+    store.write("lib", {"op": "replace", "title": "M0", "video": make_video("B", year=1981), "last_modify": "02/01/2024"})
+    store.write("lib", {"op": "remove", "title": "M3", "last_modify": "02/01/2024"})
+    # read after the changes, then followed along them
+    content = open_store().load("lib")
+    assert content.stats(3) == VideoStats(content.videos()).summary(3)
+    for record in (add("C", actors=(("N9", "Poe"),)), {"op": "remove", "title": "A"},
+                   {"op": "replace", "title": "B", "video": make_video("D", year=1970)},
+                   {"op": "replace", "title": "M1", "video": make_video("E", year=1960)}):
+        content.apply(dict(record, last_modify="03/01/2024", version=content.version+1))
+        assert content.stats(3) == VideoStats(content.videos()).summary(3)
+
+def test_cursor_outlives_removals_and_compactions(open_store):
+    store = open_store()
+    create(store, "lib", [make_video(f"V{i}") for i in range(60)])
+    page, cursor = store.load("lib").page(0, 10)
+    assert [video['title'] for video in page] == [f"V{i}" for i in range(10)]
+    # enough removals to reclaim the empty slots of a resident library
+    store.write_many("lib", [{"op": "remove", "title": f"V{i}", "last_modify": "02/01/2024"} for i in range(45)])
+    page, _ = store.load("lib").page(cursor, 5)
+    assert [video['title'] for video in page] == [f"V{i}" for i in range(45, 50)]
+    store.compact("lib")
+    store.write("lib", add("W"))
+    # another worker reads the compacted snapshot and its log
+    content = open_store().load("lib")
+    page, cursor = content.page(cursor, 5)
+    assert [video['title'] for video in page] == [f"V{i}" for i in range(45, 50)]
+    page, cursor = content.page(cursor, 100)
+    assert [video['title'] for video in page] == [f"V{i}" for i in range(50, 60)]+["W"]
+    assert cursor is None
+    store.compact("lib")
+    content = open_store().load("lib")
+    assert content.next_position == 61
+    page, cursor = content.page(60, 5)
+    assert [video['title'] for video in page] == ["W"] and cursor is None
+
+def test_failed_compaction_is_reported(open_store, monkeypatch, caplog):
+    store = open_store(log_max_bytes=200)
+    create(store, "lib")
+
+    def failing(library):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(store, "compact", failing)
+    failures = COMPACTION_FAILURES._values.get((), 0)
+    store._compacting.add("lib")
+    store._compact("lib")
+    assert COMPACTION_FAILURES._values[()] == failures+1
+    assert "The compaction of the video library lib failed." in caplog.text
+    assert "lib" not in store._compacting
+    # the log keeps the changes
+    store.write("lib", add("A"))
+    assert titles(open_store().load("lib")) == ["A"]
+
+def test_creation_is_all_or_nothing(open_store, database, monkeypatch):
+    store = open_store()
+    create(store, "lib", [make_video("A")])
+    with pytest.raises(FileExistsError):
+        create(store, "lib")
+    write_durably = store_module._write_durably
+
+    def crashing(path, chunks):
+        # the disk fills up in the middle of the snapshot
+        write_durably(path, [next(iter(chunks))[:10]])
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(store_module, "_write_durably", crashing)
+    with pytest.raises(OSError):
+        create(store, "other", [make_video("B")])
+    with pytest.raises(LibraryNotFound):
+        store.load("other")
+    assert not [name for name in os.listdir(database) if name.endswith(".tmp")]
+    assert titles(open_store().load("lib")) == ["A"]
+
+def test_unwritable_image(database, shared, monkeypatch, caplog):
+    store = LibraryStore(database, 10**9, 10**9, shared=shared)
+    create(store, "lib", [make_video("A")])
+    assert type(store.load("lib")) is SharedLibrary
+    store.discard("lib")
+    os.utime(store.path("lib"), ns=(0, 0))
+    write_image = store_module.write_image
+
+    def full(path, read, signature):
+        # the memory filesystem fills up in the middle of the image
+        with open(path, "wb") as file:
+            file.write(b"partial")
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(store_module, "write_image", full)
+    failures = IMAGE_FAILURES._values.get((), 0)
+    content = store.load("lib")
+    assert type(content) is Library and titles(content) == ["A"]
+    assert IMAGE_FAILURES._values[()] == failures+1
+    assert "The image of the video library lib could not be written." in caplog.text
+    # neither the partial image nor the outdated one is left behind
+    assert os.listdir(store.shared) == ["lib.image.lock"]
+    store.write("lib", add("B"))
+    assert titles(LibraryStore(database, 10**9, 10**9, shared=shared).load("lib")) == ["A", "B"]
+    # the image is written again once there is room
+    monkeypatch.setattr(store_module, "write_image", write_image)
+    assert type(LibraryStore(database, 10**9, 10**9, shared=shared).load("lib")) is SharedLibrary
+
+def test_evicted_image_is_removed(database, shared):
+    store = LibraryStore(database, 10**9, 10**9, shared=shared)
+    for library in ("a", "b"):
+        create(store, library, [make_video(f"{library}{i}") for i in range(10)])
+    store = LibraryStore(database, os.path.getsize(store.path("a"))+1, 10**9, shared=shared)
+    content = store.load("a")
+    store.load("b")
+    assert not os.path.exists(store.image_path("a")) and os.path.exists(store.image_path("b"))
+    # the evicted library is still readable by whoever holds it, and loaded again
+    assert titles(content)[:2] == ["a0", "a1"]
+    assert titles(store.load("a"))[:2] == ["a0", "a1"]
+    assert os.path.exists(store.image_path("a")) and not os.path.exists(store.image_path("b"))
+    store.delete("a")
+    assert not os.path.exists(store.image_path("a"))
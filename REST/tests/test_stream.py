@@ -0,0 +1,25 @@
+import json
+
+import pytest
+
+from app.stream import iter_library
+
+DOCUMENT = (b'{"owner":{"name":"Ann","surname":"Lee"},"version":12,"ratio":1234.5678,"scale":-0.5e-2,"big":12E+3,'
+            b'"videos":[{"title":"A","year":1999,"score":7.25},{"title":"B\\u00e9","year":2001,"score":1e3}],"created":-17}')
+
+def events(document, size):
+    chunks = [document[i:i+size] for i in range(0, len(document), size)]
+    return list(iter_library(lambda: chunks.pop(0) if chunks else b""))
+
+@pytest.mark.parametrize("size", range(1, 40))
+def test_any_chunking(size):
+    decoded = json.loads(DOCUMENT)
+    expected = [("field", name, value) for name, value in decoded.items() if name != "videos"]
+    expected[5:5] = [("video", video) for video in decoded['videos']]
+    assert events(DOCUMENT, size) == expected
+
+@pytest.mark.parametrize("document", [b'{"videos":[{"title":"A"}', b'{"version":1.', b'{"version":12-3}'])
+def test_malformed(document):
+    for size in (1, 3, len(document)):
+        with pytest.raises(json.decoder.JSONDecodeError):
+            events(document, size)
@@ -0,0 +1,126 @@
+import time
+import threading
+from collections import OrderedDict
+
+class ResponseCache:
+    """
+    Bounded cache of the decoded API responses.
+
+    Entries are fresh for a fixed time to live, after which they are
+    revalidated with a conditional request using the validators (ETag and
+    Last-Modified) returned by the API. The least recently used entries are
+    evicted once the cache is full. Each entry belongs to a group, the video
+    library it was read from, so that all the entries of a library can be
+    invalidated at once when the frontend modifies it.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up an entry.
+
+        :return: the (fresh, value, etag, last_modified) tuple of the entry, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            expires, group, value, etag, last_modified = entry
+            return (time.monotonic() < expires, value, etag, last_modified)
+
+    def put(self, key, group, value, etag=None, last_modified=None):
+        """Store an entry, fresh for the time to live of the cache."""
+        with self._lock:
+            self._drop(key)
+            self._entries[key] = (time.monotonic()+self.ttl, group, value, etag, last_modified)
+            self._groups.setdefault(group, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def refresh(self, key):
+        """Make an entry fresh again after the API confirmed it did not change."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries[key] = (time.monotonic()+self.ttl,)+entry[1:]
+
+    def invalidate(self, group):
+        """Drop all the entries of a group."""
+        with self._lock:
+            for key in list(self._groups.get(group, ())):
+                self._drop(key)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            keys = self._groups[entry[1]]
+            keys.discard(key)
+            if not keys:
+                del self._groups[entry[1]]
+
+class FragmentCache:
+    """
+    Bounded cache of rendered page fragments.
+
+    A fragment is stored under the version of the API document it was
+    rendered from, its entity tag, so it is served as long as the document
+    does not change and simply replaced once it does. The least recently used
+    fragments are evicted once their total size exceeds the budget. Like the
+    response cache, each fragment belongs to a group so that all the fragments
+    of a video library can be dropped at once when the frontend modifies it.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._fragments = OrderedDict()
+        self._groups = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        """Return the total size of the stored fragments, in characters."""
+        return self._size
+
+    def get(self, key, version):
+        """Return the fragment stored for a key and version, or None."""
+        with self._lock:
+            entry = self._fragments.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._fragments.move_to_end(key)
+            return entry[2]
+
+    def put(self, key, group, version, fragment):
+        """Store the fragment of a key for a version, if it fits in the budget."""
+        with self._lock:
+            self._drop(key)
+            if len(fragment) > self.max_size:
+                return
+            self._fragments[key] = (version, group, fragment)
+            self._groups.setdefault(group, set()).add(key)
+            self._size += len(fragment)
+            while self._size > self.max_size:
+                self._drop(next(iter(self._fragments)))
+
+    def invalidate(self, group):
+        """Drop all the fragments of a group."""
+        with self._lock:
+            for key in list(self._groups.get(group, ())):
+                self._drop(key)
+
+    def _drop(self, key):
+        entry = self._fragments.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[2])
+            keys = self._groups[entry[1]]
+            keys.discard(key)
+            if not keys:
+                del self._groups[entry[1]]
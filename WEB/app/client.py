@@ -0,0 +1,176 @@
+import time
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.metrics import REGISTRY
+from app.serialization import loads
+
+API_REQUEST_SECONDS = REGISTRY.histogram(
+    "api_request_duration_seconds", "Time spent on the requests to the API, by endpoint, method and status.",
+    ("endpoint", "method", "status"))
+# endpoints whose documents depend on all the video libraries
+CROSS_LIBRARY_DOCUMENTS = ("/search", "/stats")
+API_CACHE_LOOKUPS = REGISTRY.counter(
+    "api_cache_lookups_total", "Lookups of the cached API responses, by fresh hit, revalidated hit or miss.", ("result",))
+
+class BackendClient:
+    """
+    HTTP client of the REST API shared by the threads of a worker.
+
+    All requests go through a single connection pool kept alive between
+    requests. The pool is bounded: under the gevent workers a worker serves
+    many more pages at a time than it keeps connections, so a request waits
+    for a free connection rather than opening one thrown away after its
+    response. Each thread gets its own session mounted on that pool, since a
+    session itself is not meant to be shared between threads. Connection
+    failures are retried for every method, since the request never reached the
+    API; read failures and temporary unavailability are only retried for the
+    read methods, which can safely be sent twice.
+
+    The JSON documents read with get_json are kept in an optional response
+    cache and revalidated with conditional requests. Any other request sent to
+    a video library invalidates the cached documents of that library and the
+    cross-library documents (searches and summary), and the list of libraries too when the library
+    itself is created or deleted. The caches derived from the API documents,
+    such as the rendered fragments, are invalidated along with it.
+    """
+
+    def __init__(self, base_url, pool_size, timeout, retries, cache=None, derived_caches=()):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.cache = cache
+        self.derived_caches = derived_caches
+        retry = Retry(
+            total=retries,
+            backoff_factor=0.1,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False)
+        self._adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=retry)
+        self._local = threading.local()
+
+    @property
+    def session(self):
+        """Return the session of the current thread."""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("http://", self._adapter)
+            session.mount("https://", self._adapter)
+            self._local.session = session
+        return session
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request to the API.
+
+        :param path: the path of the endpoint, starting with a slash
+        :return: the response of the API
+        :raise requests.RequestException: if the request fails
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = self.session.request(method, self.base_url+path, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter()-start, (_endpoint_of(path), method, status))
+            # even a failed request may have modified the library
+            if method not in ("GET", "HEAD"):
+                library = _library_of(path)
+                for cache in self._caches():
+                    cache.invalidate(library)
+                    for document in CROSS_LIBRARY_DOCUMENTS:
+                        cache.invalidate(document)
+                    if path == f"/library/{library}":
+                        cache.invalidate(None)
+
+    def _caches(self):
+        if self.cache is not None:
+            yield self.cache
+        yield from self.derived_caches
+
+    def get_json(self, path, params=None):
+        """
+        Retrieve a JSON document from the API, from the cache when possible.
+
+        :return: the decoded document
+        :raise requests.RequestException: if the request fails or returns an error status
+        :raise json.decoder.JSONDecodeError: if the document is malformed
+        """
+        return self.get_versioned_json(path, params)[0]
+
+    def get_versioned_json(self, path, params=None):
+        """
+        Retrieve a JSON document from the API along with its version, see get_json.
+
+        :return: the decoded document and its entity tag, None if the API did not send one
+        """
+        if self.cache is None:
+            r = self.get(path, params=params)
+            r.raise_for_status()
+            return loads(r.content), r.headers.get("ETag")
+
+        key = (path, tuple(sorted((params or {}).items())))
+        cached = self.cache.get(key)
+        headers = {}
+        if cached is not None:
+            fresh, value, etag, last_modified = cached
+            if fresh:
+                API_CACHE_LOOKUPS.inc(labels=("fresh",))
+                return value, etag
+            if etag is not None:
+                headers["If-None-Match"] = etag
+            if last_modified is not None:
+                headers["If-Modified-Since"] = last_modified
+        r = self.get(path, params=params, headers=headers)
+        if r.status_code == 304 and cached is not None:
+            API_CACHE_LOOKUPS.inc(labels=("revalidated",))
+            self.cache.refresh(key)
+            return cached[1], cached[2]
+        API_CACHE_LOOKUPS.inc(labels=("miss",))
+        r.raise_for_status()
+        value = loads(r.content)
+        etag = r.headers.get("ETag")
+        self.cache.put(key, _library_of(path), value, etag, r.headers.get("Last-Modified"))
+        return value, etag
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request("DELETE", path, **kwargs)
+
+def _library_of(path):
+    """
+    Return the video library targeted by an API path, None for the list of
+    libraries and the path itself for the other endpoints.
+    """
+    parts = path.split("/")
+    if parts[1] != "library":
+        return path
+    return parts[2] if len(parts) > 2 else None
+
+def _endpoint_of(path):
+    """
+    Return the endpoint of an API path, with the names of the libraries and
+    of the videos replaced by placeholders.
+    """
+    parts = path.split("/")
+    if parts[1] == "library":
+        if len(parts) > 2:
+            parts[2] = "<library>"
+        if len(parts) > 4:
+            parts[4] = "<name>"
+    return "/".join(parts)
@@ -1,13 +1,23 @@
 from flask import Flask
+from flask import Response
 from flask import flash
+from flask import g
 from flask import redirect
 from flask import render_template
 from flask import request
 from flask import url_for
+from markupsafe import Markup
 from werkzeug.exceptions import abort
 
 import requests
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.cache import FragmentCache
+from app.cache import ResponseCache
+from app.client import BackendClient
+from app.metrics import REGISTRY
 
 app = Flask(__name__)
 app.config.from_mapping(
@@ -15,8 +25,104 @@ app.config.from_mapping(
     SECRET_KEY="dev",
     # url of the API
     API_URL="http://rt0704-tp1-backend-1:8000",
+    # number of videos displayed per page of a video library
+    PAGE_SIZE=50,
+    # number of connections kept alive to the API by each worker, the requests beyond wait for a free one
+    API_POOL_SIZE=10,
+    # connect and read timeouts of the API requests, in seconds
+    API_TIMEOUT=(3.05, 30),
+    # number of retries of a failed API request
+    API_RETRIES=2,
+    # maximum number of API responses cached by each worker
+    API_CACHE_SIZE=256,
+    # time during which a cached API response is used without asking the API, in seconds
+    API_CACHE_TTL=5,
+    # maximum number of API requests sent in the background at the same time by each worker
+    API_CONCURRENCY=16,
+    # maximum size of the rendered video lists cached by each worker, in characters
+    FRAGMENT_CACHE_SIZE=16*1024*1024,
 )
 
+REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time spent rendering the pages, by route, method and status.",
+    ("route", "method", "status"))
+FRAGMENT_CACHE_LOOKUPS = REGISTRY.counter(
+    "fragment_cache_lookups_total", "Lookups of the rendered video lists, by hit or miss.", ("result",))
+REGISTRY.gauge(
+    "fragment_cache_size", "Size of the rendered video lists kept in memory, in characters.",
+    function=lambda: get_fragment_cache().size)
+
+def get_client():
+    """
+    Retrieve the API client of the application, created on first use.
+
+    :return: the client bound to the API URL
+    """
+    if "backend_client" not in app.extensions:
+        cache = ResponseCache(app.config["API_CACHE_SIZE"], app.config["API_CACHE_TTL"])
+        app.extensions["backend_client"] = BackendClient(
+            app.config["API_URL"], app.config["API_POOL_SIZE"], app.config["API_TIMEOUT"], app.config["API_RETRIES"], cache,
+            [get_fragment_cache()])
+    return app.extensions["backend_client"]
+
+def get_fragment_cache():
+    """
+    Retrieve the cache of the rendered video lists, created on first use.
+
+    :return: the fragment cache shared by the requests of the worker
+    """
+    if "fragment_cache" not in app.extensions:
+        app.extensions["fragment_cache"] = FragmentCache(app.config["FRAGMENT_CACHE_SIZE"])
+    return app.extensions["fragment_cache"]
+
+def render_fragment(template, group, version, **context):
+    """
+    Render a fragment of the current page, from the cache when possible.
+
+    The fragment is cached for the current path and query string, under the
+    version of the API document it shows. It is rendered again once the
+    document changes, and dropped when the frontend modifies the library it
+    belongs to.
+
+    :param group: the video library the fragment shows, "/search" for the searches in all of them
+    :param version: the entity tag of the API document, None to render without caching
+    :return: the rendered fragment, safe to insert in a template
+    """
+    if version is None:
+        return Markup(render_template(template, **context))
+    key = (template, request.full_path)
+    fragment = get_fragment_cache().get(key, version)
+    FRAGMENT_CACHE_LOOKUPS.inc(labels=("miss" if fragment is None else "hit",))
+    if fragment is None:
+        fragment = render_template(template, **context)
+        get_fragment_cache().put(key, group, version, fragment)
+    return Markup(fragment)
+
+def get_executor():
+    """
+    Retrieve the pool running the concurrent API requests, created on first use.
+
+    Under the gevent workers its threads are greenlets, like the ones serving
+    the pages.
+
+    :return: the thread pool shared by the requests of the worker
+    """
+    if "api_executor" not in app.extensions:
+        app.extensions["api_executor"] = ThreadPoolExecutor(max_workers=app.config["API_CONCURRENCY"])
+    return app.extensions["api_executor"]
+
+def concurrently(*calls):
+    """
+    Run independent API calls at the same time, the first one in the current thread.
+
+    :return: the list of the results of the calls, in the same order
+    :raise: the first exception raised by a call
+    """
+    futures = [get_executor().submit(call) for call in calls[1:]]
+    results = [calls[0]()]
+    results.extend(future.result() for future in futures)
+    return results
+
 def libs_list():
     """
     Retrieves the list of video libraries via an API request.
@@ -26,32 +132,76 @@ def libs_list():
     """
     libs = None
     try:
-        r = requests.get(f"{app.config['API_URL']}/library")
-        r.raise_for_status()
-        libs = json.loads(r.text)
+        libs = get_client().get_json("/library")
     except (requests.RequestException, json.decoder.JSONDecodeError) as e:
         abort(500, e)
     return libs
 
-def get_lib(library):
+def libs_summary():
     """
-    Retrieves the content of a video library via an API request.
+    Retrieves the number of videos of each video library via an API request.
 
-    :return: the content of the video library
+    :return: the list of available video libraries, each with its name and number of videos
+    :raise 500: if an error occurs during the API request
+    """
+    summary = None
+    try:
+        summary = get_client().get_json("/stats")
+    except (requests.RequestException, json.decoder.JSONDecodeError) as e:
+        abort(500, e)
+    return summary
+
+def get_lib(library, cursor=None, fields=None):
+    """
+    Retrieves a page of the content of a video library via an API request.
+
+    :param cursor: the cursor of the page, None for the first one
+    :param fields: the fields of the videos to retrieve, None for all of them
+    :return: the content of the video library with the videos of the page and the cursor of the next one,
+        and the version of the library
     :raise 404: if the video library does not exist
     :raise 500: if an error occurs during the API request
     """
-    decoded_lib = None
+    decoded_lib = version = None
     try:
         # request the contents of the library at the API
-        r = requests.get(f"{app.config['API_URL']}/library/{library}")
-        r.raise_for_status()
-        decoded_lib = json.loads(r.text)
+        params = {"limit": app.config["PAGE_SIZE"]}
+        if cursor:
+            params["cursor"] = cursor
+        if fields:
+            params["fields"] = ",".join(fields)
+        decoded_lib, version = get_client().get_versioned_json(f"/library/{library}", params=params)
     except requests.HTTPError as e:
-        abort(404, "The video library does not exist.") if r.status_code == 404 else abort(500, e)
+        abort(404, "The video library does not exist.") if e.response.status_code == 404 else abort(500, e)
+    except (requests.RequestException, json.decoder.JSONDecodeError) as e:
+        abort(500, e)
+    return decoded_lib, version
+
+def search(name, type, lib):
+    """
+    Searches for videos via an API request.
+
+    :param type: the type of search, by title or by actor
+    :param lib: the video library to search, an empty one for all of them
+    :return: the list of the videos found and the version of the results
+    :raise 404: if the video library does not exist
+    :raise 500: if an error occurs during the API request
+    """
+    result = version = None
+    try:
+        match type:
+            case "title" | "actor" if not lib:
+                # an empty library stands for all of them
+                result, version = get_client().get_versioned_json("/search", params={"name": name, "type": type})
+            case "title":
+                result, version = get_client().get_versioned_json(f"/library/{lib}/by-name/{name}")
+            case "actor":
+                result, version = get_client().get_versioned_json(f"/library/{lib}/by-actor/{name}")
+    except requests.HTTPError as e:
+        abort(404, "The video library does not exist.") if e.response.status_code == 404 else abort(500, e)
     except (requests.RequestException, json.decoder.JSONDecodeError) as e:
         abort(500, e)
-    return decoded_lib
+    return result, version
 
 def check_video_format():
     """
@@ -109,12 +259,29 @@ def check_video_format():
 
     return (payload, error)
 
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """Record the rendering time of the page, by route, method and status."""
+    if "request_start" in g:
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        REQUEST_SECONDS.observe(time.perf_counter()-g.request_start, (route, request.method, response.status_code))
+    return response
+
+@app.route("/metrics")
+def metrics():
+    """Metrics of the worker, in the Prometheus text format."""
+    return Response(REGISTRY.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Video library section
 
 @app.route("/")
 def index():
-    """List of available video libraries."""
-    return render_template("index.html", libs=libs_list())
+    """List of available video libraries, with their number of videos."""
+    return render_template("index.html", libs=libs_summary())
 
 @app.route("/new-library", methods=["GET", "POST"])
 def new_library():
@@ -136,7 +303,7 @@ def new_library():
             payload = {'name': name, 'owner': {'name': owner_name, 'surname': owner_surname}}
             try:
                 # request the API to create a new video library
-                r = requests.post(f"{app.config['API_URL']}/library/{name}", json=payload)
+                r = get_client().post(f"/library/{name}", json=payload)
                 r.raise_for_status()
             except requests.HTTPError as e:
                 error = "The video library already exists." if r.status_code == 409 else abort(500, e)
@@ -152,20 +319,25 @@ def new_library():
 
 @app.route("/library/<string:library>")
 def show_library(library):
-    """Display the list of videos in a video library."""
-    return render_template("library/show.html", library=library, content=get_lib(library))
+    """Display a page of the list of videos in a video library."""
+    content, version = get_lib(library, request.args.get("cursor"))
+    videos = render_fragment("library/videos.html", library, version, library=library, videos=content["videos"])
+    return render_template("library/show.html", library=library, content=content, videos=videos)
 
 @app.route("/library/<string:library>/settings")
 def settings(library):
     """Manage a video library."""
-    return render_template("library/settings.html", library=library, content=get_lib(library))
+    # only the titles are listed on the settings page
+    content, version = get_lib(library, request.args.get("cursor"), ["title"])
+    videos = render_fragment("library/titles.html", library, version, library=library, videos=content["videos"])
+    return render_template("library/settings.html", library=library, content=content, videos=videos)
 
 @app.route("/library/<string:library>/settings/delete", methods=["POST"])
 def delete_library(library):
     """Delete a video library."""
     try:
         # request the API to delete video library's file
-        r = requests.delete(f"{app.config['API_URL']}/library/{library}")
+        r = get_client().delete(f"/library/{library}")
         r.raise_for_status()
         return redirect(url_for("index"))
     except requests.HTTPError as e:
@@ -187,7 +359,7 @@ def new_video():
         if error is None:
             try:
                 # request the API to add a new video to a video library
-                r = requests.post(f"{app.config['API_URL']}/library/{library}/video/{payload['title']}", json=payload)
+                r = get_client().post(f"/library/{library}/video/{payload['title']}", json=payload)
                 r.raise_for_status()
             except requests.HTTPError as e:
                 error = "The video already exists." if r.status_code == 409 else abort(500, e)
@@ -207,11 +379,9 @@ def update_video(library,video_id):
     decoded_video = None
     try:
         # request the API video information
-        r = requests.get(f"{app.config['API_URL']}/library/{library}/video/{video_id}")
-        r.raise_for_status()
-        decoded_video = json.loads(r.text)
+        decoded_video = get_client().get_json(f"/library/{library}/video/{video_id}")
     except requests.HTTPError as e:
-        abort(404, "The video does not exist.") if r.status_code == 404 else abort(500, e)
+        abort(404, "The video does not exist.") if e.response.status_code == 404 else abort(500, e)
     except (requests.RequestException, json.decoder.JSONDecodeError) as e:
         abort(500, e)
 
@@ -221,7 +391,7 @@ def update_video(library,video_id):
         if error is None:
             try:
                 # request the API to update the video in the video library
-                r = requests.put(f"{app.config['API_URL']}/library/{library}/video/{video_id}", json=payload)
+                r = get_client().put(f"/library/{library}/video/{video_id}", json=payload)
                 r.raise_for_status()
             except requests.RequestException as e:
                 abort(500, e)
@@ -236,7 +406,7 @@ def update_video(library,video_id):
 def delete_video(library,video_id):
     """Delete a video in a video library."""
     try:
-        r = requests.delete(f"{app.config['API_URL']}/library/{library}/video/{video_id}")
+        r = get_client().delete(f"/library/{library}/video/{video_id}")
     except requests.HTTPError as e:
         abort(404, f"The video does not exist.") if r.status_code == 404 else abort(500, e)
     except requests.RequestException as e:
@@ -248,7 +418,7 @@ def delete_video(library,video_id):
 
 @app.route("/search")
 def search_video():
-    """Search for a video in a video library by name or by actor."""
+    """Search for a video in a video library, or in all of them, by name or by actor."""
     error = None
 
     # check if all the required arguments are correctly defined in the search.
@@ -261,30 +431,13 @@ def search_video():
             error = "Name is required."
         elif not type:
             error = "Type is required."
-        elif not lib:
-            error = "Library is required."
+        elif type not in ("title", "actor"):
+            error = "Unknown search type."
 
         if error is None:
-            try:
-                match type:
-                    case "title":
-                        r = requests.get(f"{app.config['API_URL']}/library/{lib}/by-name/{name}")
-                        r.raise_for_status()
-                    case "actor":
-                        r = requests.get(f"{app.config['API_URL']}/library/{lib}/by-actor/{name}")
-                        r.raise_for_status()
-                    case _:
-                        error = "Unknown search type."
-            except requests.HTTPError as e:
-                abort(404, "The video library does not exist.") if r.status_code == 404 else abort(500, e)
-            except requests.RequestException as e:
-                abort(500, e)
-
-            if error is None:
-                try:
-                    result = json.loads(r.text)
-                except json.decoder.JSONDecodeError as e:
-                    abort(500, e)
-                return render_template("search/result.html", result=result)
+            # the results are displayed under the search form, both requests are independent
+            (result, version), libs = concurrently(lambda: search(name, type, lib), libs_list)
+            videos = render_fragment("search/videos.html", lib or "/search", version, videos=result)
+            return render_template("search/result.html", libs=libs, videos=videos)
 
     return render_template("search/search.html", libs=libs_list(), error=error)
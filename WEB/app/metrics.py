@@ -0,0 +1,4 @@
+from common.metrics import Registry
+
+# metrics of the worker, registered by the modules they measure
+REGISTRY = Registry()
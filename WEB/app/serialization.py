@@ -0,0 +1,17 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def loads(data):
+    """
+    Deserialize a JSON document, given as bytes or as a string.
+
+    :raise json.decoder.JSONDecodeError: if the document is malformed
+    """
+    if orjson is not None:
+        # orjson.JSONDecodeError is a subclass of json.decoder.JSONDecodeError
+        return orjson.loads(data)
+    return json.loads(data)
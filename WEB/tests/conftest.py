@@ -0,0 +1,45 @@
+import os
+import json
+import sys
+
+import pytest
+
+# the service is the ``app`` package of the WEB folder, next to the ``common`` package of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+
+class FakeResponse:
+    """Response of the fake API, with the attributes read by the client."""
+
+    def __init__(self, status_code, document=None, etag=None):
+        self.status_code = status_code
+        self.content = b"" if document is None else json.dumps(document).encode()
+        self.headers = {} if etag is None else {"ETag": etag}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise AssertionError(f"unexpected status {self.status_code}")
+
+class FakeSession:
+    """Session answering with the documents of a dictionary, and revalidating them with their entity tags."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.requests = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        path = url.split("://", 1)[1].split("/", 1)[1]
+        self.requests.append((method, "/"+path, dict(headers or {})))
+        if method != "GET":
+            return FakeResponse(204)
+        document, etag = self.documents["/"+path]
+        if (headers or {}).get("If-None-Match") == etag:
+            return FakeResponse(304, etag=etag)
+        return FakeResponse(200, document, etag)
+
+@pytest.fixture
+def session():
+    """Return a fake API session serving no documents yet."""
+    return FakeSession({})
@@ -0,0 +1,45 @@
+from app.cache import FragmentCache
+from app.cache import ResponseCache
+
+def test_fragment_cache_evicts_the_least_recently_used():
+    cache = FragmentCache(10)
+    cache.put("a", "lib", 1, "aaaa")
+    cache.put("b", "lib", 1, "bbbb")
+    assert cache.get("a", 1) == "aaaa"
+    cache.put("c", "other", 1, "cccc")
+    # b was used last before a, it goes first
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == "aaaa" and cache.get("c", 1) == "cccc"
+    assert cache.size == 8
+
+def test_fragment_cache_versions():
+    cache = FragmentCache(10)
+    cache.put("a", "lib", 1, "aaaa")
+    assert cache.get("a", 2) is None
+    cache.put("a", "lib", 2, "AAAAAA")
+    assert cache.get("a", 1) is None and cache.get("a", 2) == "AAAAAA"
+    assert cache.size == 6
+    # a fragment larger than the budget is not kept
+    cache.put("b", "lib", 1, "b"*11)
+    assert cache.get("b", 1) is None and cache.size == 6
+    cache.invalidate("lib")
+    assert cache.get("a", 2) is None and cache.size == 0
+
+def test_response_cache_evicts_the_least_recently_used():
+    cache = ResponseCache(2, 60)
+    cache.put("a", "lib", 1)
+    cache.put("b", "lib", 2)
+    cache.get("a")
+    cache.put("c", "other", 3)
+    assert cache.get("b") is None
+    assert cache.get("a")[1] == 1 and cache.get("c")[1] == 3
+    cache.invalidate("lib")
+    assert cache.get("a") is None and cache.get("c") == (True, 3, None, None)
+
+def test_response_cache_refresh():
+    cache = ResponseCache(2, 0)
+    cache.put("a", "lib", 1, "e1", "Mon, 01 Jan 2024 00:00:00 GMT")
+    assert cache.get("a") == (False, 1, "e1", "Mon, 01 Jan 2024 00:00:00 GMT")
+    cache.ttl = 60
+    cache.refresh("a")
+    assert cache.get("a")[0]
@@ -0,0 +1,59 @@
+import pytest
+
+from app.cache import FragmentCache
+from app.cache import ResponseCache
+from app.client import BackendClient
+from app.client import _library_of
+
+@pytest.fixture
+def fragments():
+    return FragmentCache(1024)
+
+@pytest.fixture
+def client(session, fragments):
+    client = BackendClient("http://api", 1, 1, 0, ResponseCache(16, 60), [fragments])
+    client._local.session = session
+    session.documents.update({
+        "/library": (["a", "b"], "l1"),
+        "/library/a": ({"name": "a"}, "a1"),
+        "/library/b": ({"name": "b"}, "b1"),
+        "/search": ([{"title": "A"}], "s1"),
+        "/stats": ({"videos": 1}, "t1")})
+    for path in session.documents:
+        client.get_json(path)
+        fragments.put(path, _library_of(path), "v", "<p></p>")
+    session.requests.clear()
+    return client
+
+def cached(client):
+    return sorted(path for path, _ in client.cache._entries)
+
+def test_fresh_documents_are_not_requested(client, session):
+    assert client.get_json("/library/a") == {"name": "a"}
+    assert session.requests == []
+
+def test_write_invalidates_its_library(client, session, fragments):
+    client.post("/library/a/video/X", json={})
+    # the other library and the list of libraries are kept
+    assert cached(client) == ["/library", "/library/b"]
+    assert fragments.get("/library/a", "v") is None and fragments.get("/search", "v") is None
+    assert fragments.get("/stats", "v") is None and fragments.get("/library/b", "v") == "<p></p>"
+    session.documents["/library/a"] = ({"name": "a", "videos": ["X"]}, "a2")
+    assert client.get_json("/library/a") == {"name": "a", "videos": ["X"]}
+    assert client.get_json("/search") == [{"title": "A"}]
+    assert [path for _, path, _ in session.requests] == ["/library/a/video/X", "/library/a", "/search"]
+
+def test_library_deletion_invalidates_the_list(client):
+    client.delete("/library/b")
+    assert cached(client) == ["/library/a"]
+
+def test_revalidation_refreshes_the_entry(client, session):
+    # expire the entry, as once its time to live is over
+    entry = client.cache._entries[("/library/a", ())]
+    client.cache._entries[("/library/a", ())] = (0,)+entry[1:]
+    assert client.get_json("/library/a") == {"name": "a"}
+    assert session.requests == [("GET", "/library/a", {"If-None-Match": "a1"})]
+    # fresh again, it is served without asking the API
+    assert client.cache.get(("/library/a", ()))[0]
+    assert client.get_versioned_json("/library/a") == ({"name": "a"}, "a1")
+    assert len(session.requests) == 1
@@ -0,0 +1,317 @@
+"""
+Benchmarks of the REST and WEB services.
+
+Each target and library size runs in a fresh process, on a synthetic library
+generated in a temporary folder. The requests are sent through the Flask test
+client, or with --processes through HTTP by a pool of load generator
+processes to the services served locally by werkzeug. Throughput, median and
+99th percentile latencies and the resident memory of the process serving the
+measured service are reported for each scenario.
+
+usage: python benchmarks/bench.py [--targets rest web] [--sizes 1000 10000]
+                                  [--requests 200] [--processes 0] [--storage json]
+                                  [--save FILE] [--baseline FILE] [--tolerance 0.25]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import importlib
+import traceback
+import multiprocessing
+
+import requests
+
+import generate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the modules shared by the services
+sys.path.insert(0, ROOT)
+LIBRARY = "bench"
+
+def load_service(service):
+    """
+    Import the application of a service, REST or WEB.
+
+    Both services are an ``app`` package, the modules of the one imported are
+    renamed so that the other can be imported in the same process.
+
+    :return: the main module of the service
+    """
+    sys.path.insert(0, os.path.join(ROOT, service))
+    try:
+        main = importlib.import_module("app.main")
+        if service == "REST":
+            importlib.import_module("app.migrate")
+    finally:
+        sys.path.pop(0)
+    for name in [name for name in sys.modules if name == "app" or name.startswith("app.")]:
+        sys.modules[f"{service}.{name}"] = sys.modules.pop(name)
+    return main
+
+def serve(service, config, ports):
+    """Serve a service on a free local port, sent back through a queue."""
+    import logging
+    from werkzeug.serving import make_server
+
+    # the access log would flood the report
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    main = load_service(service)
+    main.app.config.update(config)
+    server = make_server("127.0.0.1", 0, main.app, threaded=True)
+    ports.put(server.server_port)
+    server.serve_forever()
+
+def start_server(service, config):
+    """
+    Start a service in its own process.
+
+    :return: the URL of the service and its process
+    """
+    context = multiprocessing.get_context("spawn")
+    ports = context.Queue()
+    process = context.Process(target=serve, args=(service, config, ports), daemon=True)
+    process.start()
+    return f"http://127.0.0.1:{ports.get(timeout=60)}", process
+
+def rss(pid):
+    """Return the resident memory of a process in MiB, or None if unknown."""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])/1024
+    except OSError:
+        return None
+
+def video_payload(title, size, rng):
+    video = generate.video(0, size, rng)
+    video["title"] = title
+    return video
+
+def video_form(title, size, rng):
+    video = video_payload(title, size, rng)
+    form = {"title": title, "year": str(video["year"]), "library": LIBRARY,
+            "director_name": video["director"]["name"], "director_surname": video["director"]["surname"]}
+    for i, actor in enumerate(video["actors"], 1):
+        form[f"actor{i}_name"] = actor["name"]
+        form[f"actor{i}_surname"] = actor["surname"]
+    return form
+
+def rest_scenarios(size, count, rng):
+    """
+    Build the requests of the scenarios of the REST service.
+
+    :return: the list of (scenario, [(method, path, json, form)]) pairs
+    """
+    base = f"/library/{LIBRARY}"
+    return [
+        # the whole library is much larger than the other responses
+        ("get library", [("GET", base, None, None)]*max(1, count//10)),
+        ("get page", [("GET", f"{base}?limit=50&cursor={rng.randrange(size)}", None, None) for _ in range(count)]),
+        ("get video", [("GET", f"{base}/video/{generate.title(rng.randrange(size))}", None, None) for _ in range(count)]),
+        ("search title", [("GET", f"{base}/by-name/{rng.randrange(size)}", None, None) for _ in range(count)]),
+        ("search actor", [("GET", f"{base}/by-actor/Surname{rng.randrange(generate.people(size))}", None, None)
+            for _ in range(count)]),
+        ("add", [("POST", f"{base}/video/New {i}", video_payload(f"New {i}", size, rng), None) for i in range(count)]),
+        ("update", [("PUT", f"{base}/video/{title}", video_payload(title, size, rng), None)
+            for title in map(generate.title, rng.sample(range(size), min(count, size)))]),
+        ("delete", [("DELETE", f"{base}/video/New {i}", None, None) for i in range(count)]),
+        ]
+
+def web_scenarios(size, count, rng):
+    """
+    Build the requests of the scenarios of the WEB service.
+
+    :return: the list of (scenario, [(method, path, json, form)]) pairs
+    """
+    base = f"/library/{LIBRARY}"
+    return [
+        ("index", [("GET", "/", None, None)]*count),
+        ("show library", [("GET", f"{base}?cursor={rng.randrange(size)}", None, None) for _ in range(count)]),
+        ("update page", [("GET", f"{base}/video/{generate.title(rng.randrange(size))}/update", None, None)
+            for _ in range(count)]),
+        ("search", [("GET", f"/search?name={rng.randrange(size)}&type=title&lib={LIBRARY}", None, None)
+            for _ in range(count)]),
+        ("add", [("POST", "/new-video", None, video_form(f"New {i}", size, rng)) for i in range(count)]),
+        ("update", [("POST", f"{base}/video/{title}/update", None, video_form(title, size, rng))
+            for title in map(generate.title, rng.sample(range(size), min(count, size)))]),
+        ("delete", [("POST", f"{base}/video/New {i}/delete", None, None) for i in range(count)]),
+        ]
+
+def send_in_process(client, specs):
+    """Send requests through a Flask test client, returning their (latency, success) pairs."""
+    results = []
+    for method, path, payload, form in specs:
+        start = time.perf_counter()
+        response = client.open(path, method=method, json=payload, data=form)
+        response.get_data()
+        results.append((time.perf_counter()-start, response.status_code < 400))
+    return results
+
+def send_http(url, specs):
+    """Send requests through HTTP, returning their (latency, success) pairs."""
+    session = requests.Session()
+    results = []
+    for method, path, payload, form in specs:
+        start = time.perf_counter()
+        response = session.request(method, url+path, json=payload, data=form, allow_redirects=False)
+        results.append((time.perf_counter()-start, response.status_code < 400))
+    return results
+
+def percentile(latencies, q):
+    return latencies[min(len(latencies)-1, int(q*len(latencies)))]
+
+def measure(send, specs, pid):
+    """
+    Run the requests of a scenario.
+
+    :param send: the function sending a list of requests and returning their (latency, success) pairs
+    :return: the statistics of the scenario
+    """
+    start = time.perf_counter()
+    results = send(specs)
+    elapsed = time.perf_counter()-start
+    latencies = sorted(latency for latency, _ in results)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, success in results if not success),
+        "throughput": len(results)/elapsed,
+        "p50_ms": percentile(latencies, 0.5)*1000,
+        "p99_ms": percentile(latencies, 0.99)*1000,
+        "rss_mib": rss(pid),
+        }
+
+def run_case(target, size, options, output):
+    """Benchmark a target on a library of a given size, in a fresh process."""
+    folder = tempfile.mkdtemp(prefix="bench-")
+    servers = []
+    pool = None
+    try:
+        database = os.path.join(folder, "database")
+        os.mkdir(database)
+        generate.write_library(database, LIBRARY, size, options.seed)
+        config = {"DATABASE": database, "STORAGE": options.storage, "SQLITE_DATABASE": os.path.join(folder, "library.sqlite"),
+                  # the shared images go away with the temporary folder
+                  "LIBRARY_SHARED_DIR": os.path.join(folder, "shared")}
+        if options.storage == "sqlite":
+            load_service("REST")
+            sys.modules["REST.app.migrate"].migrate(database, config["SQLITE_DATABASE"])
+        rng = random.Random(options.seed)
+
+        if target == "rest":
+            scenarios = rest_scenarios(size, options.requests, rng)
+        else:
+            scenarios = web_scenarios(size, options.requests, rng)
+            # the frontend always reaches the API through HTTP
+            url, process = start_server("REST", config)
+            servers.append(process)
+            config = {"API_URL": url}
+        service = "REST" if target == "rest" else "WEB"
+
+        if options.processes:
+            url, process = start_server(service, config)
+            servers.append(process)
+            pid = process.pid
+            pool = multiprocessing.get_context("spawn").Pool(options.processes)
+
+            def send(specs):
+                parts = [specs[i::options.processes] for i in range(options.processes)]
+                return [result for part in pool.starmap(send_http, [(url, part) for part in parts]) for result in part]
+        else:
+            main = load_service(service)
+            main.app.config.update(config)
+            client = main.app.test_client()
+            pid = os.getpid()
+
+            def send(specs):
+                return send_in_process(client, specs)
+
+        # load the library before measuring
+        send([("GET", f"/library/{LIBRARY}?limit=1" if target == "rest" else "/", None, None)])
+        results = {}
+        for scenario, specs in scenarios:
+            if all(spec[0] == "GET" for spec in specs):
+                # warm up the caches and the lazily built indexes, reads only
+                send(specs[:max(1, len(specs)//10)])
+            results[f"{target}/{size}/{scenario}"] = measure(send, specs, pid)
+        output.put(results)
+    except BaseException:
+        output.put(traceback.format_exc())
+        raise
+    finally:
+        if pool is not None:
+            pool.terminate()
+        for process in servers:
+            process.terminate()
+        shutil.rmtree(folder, ignore_errors=True)
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results to a baseline.
+
+    The 99th percentile is only shown, it is too noisy on short runs to flag
+    a regression.
+
+    :return: the keys of the scenarios slower than the baseline beyond the tolerance
+    """
+    regressions = []
+    print(f"\n{'against the baseline':<32} {'req/s':>10} {'p50':>9} {'p99':>9}")
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratios = [result[stat]/baseline[key][stat] for stat in ("throughput", "p50_ms", "p99_ms")]
+        slower = ratios[0] < 1-tolerance or ratios[1] > 1+tolerance
+        if slower:
+            regressions.append(key)
+        print(f"{key:<32} {ratios[0]:>9.2f}x {ratios[1]:>8.2f}x {ratios[2]:>8.2f}x{'  REGRESSION' if slower else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the REST and WEB services.")
+    parser.add_argument("--targets", nargs="+", choices=("rest", "web"), default=["rest", "web"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[1000, 10000], help="numbers of videos of the library")
+    parser.add_argument("--requests", type=int, default=200, help="number of requests per scenario")
+    parser.add_argument("--processes", type=int, default=0,
+        help="number of load generator processes sending HTTP requests, 0 to use the Flask test client")
+    parser.add_argument("--storage", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="file to save the results to, as a baseline")
+    parser.add_argument("--baseline", help="file of the results to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown tolerated against the baseline")
+    options = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    print(f"{'scenario':<32} {'requests':>8} {'errors':>6} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'RSS MiB':>8}")
+    for target in options.targets:
+        for size in options.sizes:
+            output = context.Queue()
+            process = context.Process(target=run_case, args=(target, size, options, output))
+            process.start()
+            case = output.get()
+            process.join()
+            if isinstance(case, str):
+                sys.exit(f"{target}/{size} failed:\n{case}")
+            for key, result in case.items():
+                memory = "" if result["rss_mib"] is None else f"{result['rss_mib']:.1f}"
+                print(f"{key:<32} {result['requests']:>8} {result['errors']:>6} {result['throughput']:>10.1f}"
+                      f" {result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {memory:>8}")
+            results.update(case)
+
+    if options.save:
+        with open(options.save, "w") as file:
+            json.dump({"options": {key: value for key, value in vars(options).items() if key not in ("save", "baseline")},
+                       "results": results}, file, indent=2)
+    if options.baseline:
+        with open(options.baseline) as file:
+            baseline = json.load(file)["results"]
+        if compare(results, baseline, options.tolerance):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
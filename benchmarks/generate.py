@@ -0,0 +1,51 @@
+"""
+Generate synthetic video libraries for the benchmarks.
+
+usage: python benchmarks/generate.py <folder> <name> <size> [seed]
+"""
+import os
+import sys
+import json
+import random
+
+def title(i):
+    """Return the title of the i-th synthetic video."""
+    return f"Video {i}"
+
+def person(j):
+    """Return the j-th synthetic person."""
+    return {"name": f"Name{j}", "surname": f"Surname{j}"}
+
+def people(size):
+    """Return the number of distinct people appearing in a library of a given size."""
+    return max(100, size//20)
+
+def video(i, size, rng):
+    """Build the i-th synthetic video of a library of a given size."""
+    return {
+        "title": title(i),
+        "year": rng.randrange(1920, 2023),
+        "director": person(rng.randrange(people(size))),
+        "actors": [person(rng.randrange(people(size))) for _ in range(3)]
+        }
+
+def write_library(folder, name, size, seed=0):
+    """
+    Write a video library of synthetic videos in the format of the database
+    folder, one video at a time so that large libraries fit in memory.
+
+    :return: the path of the written file
+    """
+    rng = random.Random(seed)
+    path = os.path.join(folder, name)+".json"
+    with open(path, "w") as file:
+        file.write('{"owner": {"name": "Bench", "surname": "Mark"}, "last_modify": "01/01/2022", "videos": [')
+        for i in range(size):
+            file.write((", " if i else "")+json.dumps(video(i, size, rng)))
+        file.write("]}")
+    return path
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (4, 5):
+        sys.exit(__doc__.strip())
+    print(write_library(sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4]) if len(sys.argv) == 5 else 0))
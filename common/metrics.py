@@ -0,0 +1,149 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+
+# upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Registry:
+    """
+    Set of metrics exposed in the Prometheus text format.
+
+    The values are kept by each worker process, a scrape only sees the worker
+    that answered it.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, documentation, labels=()):
+        """Register a counter."""
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        """Register a histogram."""
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        """
+        Register a gauge.
+
+        :param function: a function called on each scrape and returning the
+            value of the gauge, or a dictionary of values by label values
+        """
+        return self._register(Gauge(name, documentation, labels, function))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return the exposition of all the metrics."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return "\n".join(lines)+"\n"
+
+class Metric:
+    """Base of the metrics, holding their values by label values."""
+
+    type = "untyped"
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _format(self, name, labels, value, extra=()):
+        pairs = [f'{label}="{_escape(str(label_value))}"' for label, label_value in zip(self.labels, labels)]
+        pairs.extend(f'{label}="{label_value}"' for label, label_value in extra)
+        return f"{name}{{{','.join(pairs)}}} {value}" if pairs else f"{name} {value}"
+
+class Counter(Metric):
+    """Value that only goes up."""
+
+    type = "counter"
+
+    def inc(self, amount=1, labels=()):
+        """Increase the counter of the given label values."""
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0)+amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [self._format(self.name, labels, value) for labels, value in values]
+
+class Gauge(Metric):
+    """Value that goes up and down, set directly or read on each scrape."""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labels, function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, labels=()):
+        """Set the gauge of the given label values."""
+        with self._lock:
+            self._values[labels] = value
+
+    def samples(self):
+        if self.function is not None:
+            values = self.function()
+            values = values.items() if isinstance(values, dict) else [((), values)]
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        return [self._format(self.name, labels, value) for labels, value in values]
+
+class Histogram(Metric):
+    """Distribution of observed values into cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels, buckets):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, labels=()):
+        """Record a value for the given label values."""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # one count per bucket, then the overflow, the sum and the total count
+                counts = self._values[labels] = [0]*(len(self.buckets)+1)+[0, 0]
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, labels=()):
+        """Observe the duration of the block, in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter()-start, labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        lines = []
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets+("+Inf",), counts):
+                cumulative += count
+                lines.append(self._format(f"{self.name}_bucket", labels, cumulative, [("le", bound)]))
+            lines.append(self._format(f"{self.name}_sum", labels, counts[-2]))
+            lines.append(self._format(f"{self.name}_count", labels, counts[-1]))
+        return lines
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')